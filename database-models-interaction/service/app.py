@@ -2,15 +2,25 @@ from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 from models import db
-from views import service_blueprint
+from expiry import reap_notifications_command
+from transfer import import_notifications_command
+from views import service_blueprint, credential_cache, count_cache, \
+        response_cache, display_counter_buffer, notification_reaper
 
 def create_app(config_filename):
     app = Flask(__name__)
     app.config.from_object(config_filename)
 
     db.init_app(app)
+    credential_cache.init_app(app)
+    count_cache.init_app(app)
+    response_cache.init_app(app)
+    display_counter_buffer.init_app(app)
+    notification_reaper.init_app(app)
 
     app.register_blueprint(service_blueprint, url_prefix='/service')
+    app.cli.add_command(import_notifications_command)
+    app.cli.add_command(reap_notifications_command)
 
     migrate = Migrate(app, db)
 
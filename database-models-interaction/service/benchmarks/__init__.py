@@ -0,0 +1,61 @@
+"""
+This package contains the benchmarks for the API. Each module can be run from
+the service directory, e.g. `python -m benchmarks.auth_benchmark`.
+
+The benchmarks create and drop the tables of the configured database, so they
+refuse to run unless the configuration is the testing one (DATABASE_DEV).
+"""
+import time
+
+from base64 import b64encode
+from contextlib import contextmanager
+
+from app import create_app
+from models import db
+
+
+def get_authentication_headers(username, password):
+    credentials = b64encode(
+        (username + ':' + password).encode('utf-8')).decode('utf-8')
+    return {
+        'Accept': 'application/json',
+        'Content-Type': 'application/json',
+        'Authorization': 'Basic ' + credentials
+    }
+
+def get_token_authentication_headers(token):
+    return {
+        'Accept': 'application/json',
+        'Content-Type': 'application/json',
+        'Authorization': 'Bearer ' + token
+    }
+
+@contextmanager
+def benchmark_application():
+    app = create_app('config')
+    if not app.config.get('TESTING'):
+        raise SystemExit('Benchmarks only run against the testing database. '
+                         'Please, set the DATABASE_DEV environment variable.')
+    app.config['SERVER_NAME'] = 'localhost'
+    with app.app_context():
+        db.create_all()
+        try:
+            yield app
+        finally:
+            db.session.remove()
+            db.drop_all()
+
+def measure(function, iterations):
+    """Calls the function the given number of times and returns the calls
+    per second."""
+    start = time.perf_counter()
+    for _ in range(iterations):
+        function()
+    elapsed = time.perf_counter() - start
+    return iterations / elapsed
+
+def report(title, rows):
+    print(title)
+    width = max(len(name) for name, _ in rows)
+    for name, value in rows:
+        print('  {0:<{1}}  {2:>12.1f}'.format(name, width, value))
@@ -0,0 +1,59 @@
+"""
+This module compares the requests per second served by the list endpoints
+when the clients authenticate with HTTP Basic credentials (with and without
+the credential cache) and with bearer tokens.
+"""
+import argparse
+
+from flask import json, url_for
+
+from benchmarks import benchmark_application, get_authentication_headers, \
+        get_token_authentication_headers, measure, report
+from views import credential_cache
+
+USER_NAME = 'benchmarkuser'
+USER_PASS = 'B3nchm4rk#'
+
+LIST_ENDPOINTS = (
+    'service.notificationlistresource',
+    'service.notificationcategorylistresource')
+
+
+def run(iterations):
+    with benchmark_application() as app:
+        client = app.test_client()
+        client.post(
+            url_for('service.userlistresource'),
+            headers=get_authentication_headers(USER_NAME, USER_PASS),
+            data=json.dumps({'name': USER_NAME, 'password': USER_PASS}))
+        basic_headers = get_authentication_headers(USER_NAME, USER_PASS)
+        token_response = client.post(
+            url_for('service.tokenresource'),
+            headers=basic_headers)
+        token = json.loads(token_response.get_data(as_text=True))['token']
+        token_headers = get_token_authentication_headers(token)
+
+        for endpoint in LIST_ENDPOINTS:
+            url = url_for(endpoint)
+            rows = []
+            credential_cache.max_size = 0
+            credential_cache.clear()
+            rows.append(('basic', measure(
+                lambda: client.get(url, headers=basic_headers),
+                iterations)))
+            credential_cache.max_size = \
+                app.config['CREDENTIAL_CACHE_MAX_SIZE']
+            # Warm up the cache so that only hits are measured
+            client.get(url, headers=basic_headers)
+            rows.append(('basic (cached credentials)', measure(
+                lambda: client.get(url, headers=basic_headers),
+                iterations)))
+            rows.append(('bearer token', measure(
+                lambda: client.get(url, headers=token_headers),
+                iterations)))
+            report('{0} (requests/second)'.format(url), rows)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--iterations', type=int, default=50)
+    run(parser.parse_args().iterations)
@@ -0,0 +1,71 @@
+"""
+This module measures the SQL statements executed and the latency of the
+requests that create notifications, notification categories and users.
+"""
+import argparse
+import time
+
+from flask import json, url_for
+from sqlalchemy import event
+
+from benchmarks import benchmark_application, get_authentication_headers, \
+        get_token_authentication_headers
+from models import db
+
+USER_NAME = 'benchmarkuser'
+USER_PASS = 'B3nchm4rk#'
+
+
+def run(iterations):
+    with benchmark_application() as app:
+        client = app.test_client()
+        basic_headers = get_authentication_headers(USER_NAME, USER_PASS)
+        client.post(
+            url_for('service.userlistresource'),
+            headers=basic_headers,
+            data=json.dumps({'name': USER_NAME, 'password': USER_PASS}))
+        token_response = client.post(
+            url_for('service.tokenresource'),
+            headers=basic_headers)
+        token = json.loads(token_response.get_data(as_text=True))['token']
+        headers = get_token_authentication_headers(token)
+
+        statements = []
+        def record_statement(conn, cursor, statement, *args):
+            statements.append(statement)
+        event.listen(db.engine, 'before_cursor_execute', record_statement)
+
+        requests = (
+            ('notification (new category)', 'service.notificationlistresource',
+             lambda i: {'message': 'Benchmark notification {0}'.format(i),
+                        'ttl': 30,
+                        'notification_category': 'Category {0}'.format(i)}),
+            ('notification (existing category)',
+             'service.notificationlistresource',
+             lambda i: {'message': 'Another notification {0}'.format(i),
+                        'ttl': 30,
+                        'notification_category': 'Category {0}'.format(i)}),
+            ('notification category', 'service.notificationcategorylistresource',
+             lambda i: {'name': 'Benchmark category {0}'.format(i)}),
+        )
+        print('{0:<34} {1:>12} {2:>12}'.format(
+            'POST', 'queries/req', 'ms/req'))
+        for name, endpoint, make_data in requests:
+            url = url_for(endpoint)
+            del statements[:]
+            start = time.perf_counter()
+            for i in range(iterations):
+                response = client.post(
+                    url, headers=headers, data=json.dumps(make_data(i)))
+                assert response.status_code == 201, response.get_data()
+            elapsed = time.perf_counter() - start
+            print('{0:<34} {1:>12.1f} {2:>12.2f}'.format(
+                name,
+                len(statements) / iterations,
+                elapsed * 1000 / iterations))
+        event.remove(db.engine, 'before_cursor_execute', record_statement)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--iterations', type=int, default=200)
+    run(parser.parse_args().iterations)
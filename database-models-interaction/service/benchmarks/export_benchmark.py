@@ -0,0 +1,83 @@
+"""
+This module measures the rows per second streamed by the export of the
+notifications and the peak resident memory of the process, which shouldn't
+grow with the number of exported rows.
+"""
+import argparse
+import resource
+import time
+
+from datetime import timedelta
+
+from flask import json, url_for
+
+from benchmarks import benchmark_application, get_authentication_headers
+from models import db, Notification, NotificationCategory, utc_now
+
+USER_NAME = 'benchmarkuser'
+USER_PASS = 'B3nchm4rk#'
+INSERT_BATCH_SIZE = 10000
+# Long enough for the notifications not to expire before they are exported
+TTL = 7 * 24 * 3600
+
+
+def get_peak_rss_mb():
+    # ru_maxrss is measured in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def populate(rows):
+    category = NotificationCategory('Benchmark')
+    db.session.add(category)
+    db.session.commit()
+    # The table insert skips the listener that sets the expiration date
+    creation_date = utc_now()
+    expiration_date = creation_date + timedelta(seconds=TTL)
+    for start in range(0, rows, INSERT_BATCH_SIZE):
+        db.session.execute(
+            Notification.__table__.insert(),
+            [{'message': 'Exported notification {0}'.format(i),
+              'ttl': TTL,
+              'creation_date': creation_date,
+              'expiration_date': expiration_date,
+              'notification_category_id': category.id}
+             for i in range(start, min(start + INSERT_BATCH_SIZE, rows))])
+        db.session.commit()
+
+def run(rows):
+    with benchmark_application() as app:
+        client = app.test_client()
+        client.post(
+            url_for('service.userlistresource'),
+            headers=get_authentication_headers(USER_NAME, USER_PASS),
+            data=json.dumps({'name': USER_NAME, 'password': USER_PASS}))
+        populate(rows)
+        db.session.remove()
+        headers = get_authentication_headers(USER_NAME, USER_PASS)
+        results = []
+        for export_format in ('ndjson', 'csv'):
+            peak_rss_before = get_peak_rss_mb()
+            start = time.perf_counter()
+            response = client.get(
+                url_for('service.notificationexportresource',
+                        format=export_format),
+                headers=headers,
+                buffered=False)
+            lines = 0
+            for chunk in response.response:
+                lines += chunk.count(b'\n')
+            response.close()
+            elapsed = time.perf_counter() - start
+            exported_rows = lines - 1 if export_format == 'csv' else lines
+            assert exported_rows == rows, exported_rows
+            results.append((export_format, rows / elapsed, peak_rss_before,
+                            get_peak_rss_mb()))
+        print('{0:<8} {1:>12} {2:>18} {3:>18}'.format(
+            'format', 'rows/s', 'peak RSS before MB', 'peak RSS after MB'))
+        for export_format, rows_per_second, before, after in results:
+            print('{0:<8} {1:>12.0f} {2:>18.1f} {3:>18.1f}'.format(
+                export_format, rows_per_second, before, after))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=1000000)
+    run(parser.parse_args().rows)
@@ -0,0 +1,76 @@
+"""
+This module measures the objects per second dumped by the marshmallow schemas
+and by the functions that serializers compiles for them, for the pages of
+notifications, the notification categories with their embedded notifications
+and the users.
+"""
+import argparse
+
+from benchmarks import benchmark_application, measure, report
+from helpers import eager_loading_options
+from models import db, Notification, NotificationCategory, \
+        NotificationCategorySchema, NotificationSchema, User, UserSchema
+from serializers import dump
+
+USER_PASS = 'B3nchm4rk#'
+CATEGORY_COUNT = 10
+
+
+def populate(count):
+    categories = [NotificationCategory('Benchmark category {0}'.format(i))
+                  for i in range(CATEGORY_COUNT)]
+    db.session.add_all(categories)
+    # Hashing a password for each user would take most of the time
+    password_user = User('benchmarkuser')
+    password_user.check_password_strength_and_hash_if_ok(USER_PASS)
+    for i in range(count):
+        db.session.add(Notification(
+            'Benchmark notification {0}'.format(i), 3600,
+            categories[i % CATEGORY_COUNT]))
+        user = User('benchmarkuser{0}'.format(i))
+        user.password_hash = password_user.password_hash
+        db.session.add(user)
+    db.session.commit()
+
+def run(count, iterations):
+    with benchmark_application() as app:
+        populate(count)
+        notification_schema = NotificationSchema()
+        notification_category_schema = NotificationCategorySchema()
+        user_schema = UserSchema()
+        notifications = Notification.query\
+            .options(*eager_loading_options(
+                Notification, notification_schema))\
+            .all()
+        notification_categories = NotificationCategory.query\
+            .options(*eager_loading_options(
+                NotificationCategory, notification_category_schema))\
+            .all()
+        NotificationCategory.load_embedded_notifications(
+            notification_categories)
+        users = User.query.all()
+        rows = []
+        with app.test_request_context():
+            for name, schema, objects in (
+                    ('notifications', notification_schema, notifications),
+                    ('categories', notification_category_schema,
+                     notification_categories),
+                    ('users', user_schema, users)):
+                assert dump(schema, objects, many=True) == \
+                    schema.dump(objects, many=True).data
+                marshmallow_rate = measure(
+                    lambda: schema.dump(objects, many=True), iterations)
+                compiled_rate = measure(
+                    lambda: dump(schema, objects, many=True), iterations)
+                rows.append(('{0} (marshmallow)'.format(name),
+                             marshmallow_rate * len(objects)))
+                rows.append(('{0} (compiled)'.format(name),
+                             compiled_rate * len(objects)))
+        report('Objects dumped per second', rows)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--count', type=int, default=100)
+    parser.add_argument('--iterations', type=int, default=50)
+    args = parser.parse_args()
+    run(args.count, args.iterations)
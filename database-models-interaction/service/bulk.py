@@ -0,0 +1,273 @@
+"""
+This module contains the bulk operations that process many notifications with
+a constant number of queries and a single transaction, instead of a few
+queries and a commit per notification, along with the filters that select
+the notifications processed by them, listed or exported.
+"""
+from datetime import timedelta
+
+from marshmallow import Schema, fields, validate, validates_schema, \
+        ValidationError
+from sqlalchemy import bindparam
+
+from models import db, Notification, NotificationCategory, \
+        NotificationSchema, ResourceAddUpdateDelete, add_seconds, utc_now, \
+        utc_timestamp
+from http_status import HttpStatus
+import serializers
+
+# The columns that the notification lists can be sorted by
+NOTIFICATION_SORT_COLUMNS = ('id', 'message', 'ttl', 'creation_date',
+                             'displayed_times')
+
+class NotificationFilterSchema(Schema):
+    """Filters the notifications. The ranges include their minimum and
+    exclude their maximum creation date."""
+    category = fields.Integer()
+    displayed_once = fields.Boolean()
+    min_ttl = fields.Integer()
+    max_ttl = fields.Integer()
+    created_after = fields.DateTime()
+    created_before = fields.DateTime()
+
+class NotificationListSchema(NotificationFilterSchema):
+    """The query arguments of the notification lists. A leading minus in
+    the sort column sorts in descending order."""
+    sort = fields.String(validate=validate.OneOf(
+        NOTIFICATION_SORT_COLUMNS +
+        tuple('-' + column for column in NOTIFICATION_SORT_COLUMNS)))
+
+class NotificationSelectionSchema(NotificationFilterSchema):
+    """Selects the notifications affected by a bulk update or delete, either
+    by their ids, by a filter or by both."""
+    ids = fields.List(fields.Integer())
+
+    @validates_schema
+    def validate_selection(self, data):
+        if not data:
+            raise ValidationError(
+                'Please, provide the ids or a filter of the notifications.')
+
+class NotificationChangesSchema(Schema):
+    """The fields that a bulk update can set."""
+    ttl = fields.Integer()
+    displayed_times = fields.Integer()
+    displayed_once = fields.Boolean()
+
+    @validates_schema
+    def validate_changes(self, data):
+        if not data:
+            raise ValidationError('Please, provide the changes to apply.')
+
+notification_schema = NotificationSchema()
+notification_list_schema = NotificationListSchema()
+notification_selection_schema = NotificationSelectionSchema()
+notification_changes_schema = NotificationChangesSchema()
+
+
+def create_notifications(notification_dicts, dump=True):
+    """Creates the notifications described by the received dictionaries.
+
+    The items are validated in a single pass, the referenced categories are
+    resolved with one query (the missing ones are created), the messages are
+    checked for uniqueness with one IN query and the valid notifications are
+    inserted with a single executemany INSERT. The invalid items don't abort
+    the operation.
+
+    Args:
+        notification_dicts (list): The notifications to create
+        dump (bool): Whether to read the created notifications back to
+            include them in the results
+    Returns:
+        A list with a result dictionary for each received item, including
+        the HTTP status code and either the created notification (when
+        dumped) or the validation errors
+    """
+    results = [None] * len(notification_dicts)
+    valid_items = []
+    seen_messages = set()
+    for index, notification_dict in enumerate(notification_dicts):
+        if not isinstance(notification_dict, dict):
+            errors = {'_schema': ['Invalid input type.']}
+        else:
+            # Keep the deserialized values, e.g. the ttl read from a CSV file
+            notification_dict, errors = notification_schema.load(
+                notification_dict)
+            if not errors and 'ttl' not in notification_dict:
+                errors = {'ttl': ['Missing data for required field.']}
+        if not errors:
+            message = notification_dict['message']
+            if message in seen_messages:
+                errors = {'error': 'A notification with the message <{0}>'
+                          ' already exists'.format(message)}
+            seen_messages.add(message)
+        if errors:
+            results[index] = {
+                'status': HttpStatus.bad_request_400.value,
+                'errors': errors}
+        else:
+            valid_items.append((index, notification_dict))
+
+    existing_messages = set()
+    if seen_messages:
+        existing_messages = {message for message, in db.session
+            .query(Notification.message)
+            .filter(Notification.message.in_(seen_messages))}
+    items_to_insert = []
+    for index, notification_dict in valid_items:
+        message = notification_dict['message']
+        if message in existing_messages:
+            results[index] = {
+                'status': HttpStatus.bad_request_400.value,
+                'errors': {'error': 'A notification with the message <{0}>'
+                           ' already exists'.format(message)}}
+        else:
+            items_to_insert.append((index, notification_dict))
+    if not items_to_insert:
+        return results
+
+    notification_categories = get_or_create_notification_categories(
+        notification_dict['notification_category']['name']
+        for _, notification_dict in items_to_insert)
+    # Statements don't run the defaults and events of the instances
+    creation_date = utc_now()
+    db.session.execute(
+        Notification.__table__.insert(),
+        [{
+            'message': notification_dict['message'],
+            'ttl': notification_dict['ttl'],
+            'creation_date': creation_date,
+            'expiration_date': creation_date + timedelta(
+                seconds=notification_dict['ttl']),
+            'notification_category_id': notification_categories[
+                notification_dict['notification_category']['name']].id
+        } for _, notification_dict in items_to_insert])
+
+    if not dump:
+        for index, _ in items_to_insert:
+            results[index] = {'status': HttpStatus.created_201.value}
+        ResourceAddUpdateDelete.commit(changed_tables=[
+            Notification.__table__, NotificationCategory.__table__])
+        return results
+
+    # Read the created notifications back in the same transaction to dump them
+    created_notifications = {
+        notification.message: notification
+        for notification in Notification.query
+            .options(db.joinedload(Notification.notification_category))
+            .filter(Notification.message.in_(
+                [notification_dict['message']
+                 for _, notification_dict in items_to_insert]))}
+    for index, notification_dict in items_to_insert:
+        notification = created_notifications[notification_dict['message']]
+        results[index] = {
+            'status': HttpStatus.created_201.value,
+            'notification': serializers.dump(
+                notification_schema, notification)}
+    ResourceAddUpdateDelete.commit(changed_tables=[
+        Notification.__table__, NotificationCategory.__table__])
+    return results
+
+def get_or_create_notification_categories(names):
+    """Returns a dictionary with the notification categories for the received
+    names, retrieved with a single query. The categories that don't exist
+    yet are added to the session."""
+    names = set(names)
+    notification_categories = {
+        notification_category.name: notification_category
+        for notification_category in NotificationCategory.query
+            .filter(NotificationCategory.name.in_(names))}
+    for name in names.difference(notification_categories):
+        notification_category = NotificationCategory(name=name)
+        db.session.add(notification_category)
+        notification_categories[name] = notification_category
+    db.session.flush()
+    return notification_categories
+
+def filter_notifications(query, selection):
+    """Filters the query with the conditions of the dictionary loaded with
+    NotificationFilterSchema or any of its subclasses. The indexes declared
+    by Notification cover the combinations of these conditions."""
+    if 'ids' in selection:
+        query = query.filter(Notification.id.in_(selection['ids']))
+    if 'category' in selection:
+        query = query.filter(
+            Notification.notification_category_id == selection['category'])
+    if 'displayed_once' in selection:
+        query = query.filter(
+            Notification.displayed_once == selection['displayed_once'])
+    if 'min_ttl' in selection:
+        query = query.filter(Notification.ttl >= selection['min_ttl'])
+    if 'max_ttl' in selection:
+        query = query.filter(Notification.ttl <= selection['max_ttl'])
+    if 'created_after' in selection:
+        query = query.filter(
+            Notification.creation_date >= selection['created_after'])
+    if 'created_before' in selection:
+        query = query.filter(
+            Notification.creation_date < selection['created_before'])
+    return query
+
+def select_notifications(selection):
+    """Returns a query for the notifications selected by the dictionary
+    loaded with NotificationSelectionSchema."""
+    return filter_notifications(Notification.query, selection)
+
+def get_notification_order(sort):
+    """Returns the column and the direction (descending or not) of a sort
+    argument validated by NotificationListSchema."""
+    if sort is None:
+        return Notification.id, False
+    descending = sort.startswith('-')
+    return getattr(Notification, sort.lstrip('-')), descending
+
+def update_notifications(selection, changes):
+    """Applies the changes to all the selected notifications with a single
+    UPDATE statement and returns the number of affected rows."""
+    changes = dict(changes)
+    # Statements don't maintain the versions like the instances do
+    changes['version'] = Notification.version + 1
+    changes['modification_date'] = utc_timestamp()
+    if 'ttl' in changes:
+        changes['expiration_date'] = add_seconds(
+            Notification.creation_date, changes['ttl'])
+    affected_rows = select_notifications(selection)\
+        .update(changes, synchronize_session=False)
+    ResourceAddUpdateDelete.commit(changed_tables=[Notification.__table__])
+    return affected_rows
+
+def delete_notifications(selection):
+    """Deletes all the selected notifications with a single DELETE statement
+    and returns the number of affected rows."""
+    affected_rows = select_notifications(selection)\
+        .delete(synchronize_session=False)
+    ResourceAddUpdateDelete.commit(changed_tables=[Notification.__table__])
+    return affected_rows
+
+def mark_notifications_displayed(increments):
+    """Adds the number of times each notification was displayed to its
+    counter and marks it as displayed once, unless it expired.
+
+    The counters are incremented by the database, so concurrent requests
+    never overwrite each other's increments, with a single executemany
+    UPDATE statement for all the notifications.
+
+    Args:
+        increments (dict): The number of displays by notification id
+    Returns:
+        The number of affected rows
+    """
+    table = Notification.__table__
+    statement = table.update()\
+        .where(table.c.id == bindparam('notification_id'))\
+        .where(table.c.expiration_date > utc_timestamp())\
+        .values(
+            displayed_times=table.c.displayed_times + bindparam('increment'),
+            displayed_once=True,
+            version=table.c.version + 1,
+            modification_date=utc_timestamp())
+    result = db.session.execute(statement, [
+        {'notification_id': notification_id, 'increment': increment}
+        for notification_id, increment in increments.items()])
+    ResourceAddUpdateDelete.commit(changed_tables=[table])
+    return result.rowcount
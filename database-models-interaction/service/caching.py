@@ -0,0 +1,365 @@
+"""
+This module contains the in-process caches used by the API to avoid repeating
+expensive work, such as hashing passwords, on every request.
+"""
+import hashlib
+import hmac
+import os
+import threading
+import time
+
+from collections import OrderedDict
+from datetime import timezone
+from functools import wraps
+
+from flask import current_app, make_response, request
+from werkzeug.http import is_resource_modified
+
+from database import REPLICA_ENVIRON_KEY
+from http_status import HttpStatus
+
+# The earliest time (in seconds since the epoch) at which the response being
+# computed changes on its own, e.g. because a notification in it expires
+EXPIRATION_ENVIRON_KEY = 'service.response_expiration'
+# The generations of the cached tables read at the start of the request
+GENERATIONS_ENVIRON_KEY = 'service.table_generations'
+
+
+class CredentialCache():
+    """Remembers the credentials that were recently verified.
+
+    Entries are keyed by an HMAC digest of the user name and password computed
+    with a random per-process key, so neither the plaintext password nor a
+    reusable hash is ever kept in memory. The cache is bounded (least recently
+    used entries are evicted first) and every entry expires after a TTL.
+    """
+    def __init__(self, max_size=1024, ttl=300):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._key = os.urandom(32)
+        self._entries = OrderedDict()
+        self._keys_by_user_id = {}
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.max_size = app.config.get('CREDENTIAL_CACHE_MAX_SIZE',
+                                       self.max_size)
+        self.ttl = app.config.get('CREDENTIAL_CACHE_TTL', self.ttl)
+        self.clear()
+
+    def _digest(self, name, password):
+        message = '{0}\x00{1}'.format(name, password).encode('utf-8')
+        return hmac.new(self._key, message, hashlib.sha256).digest()
+
+    def get(self, name, password):
+        """Returns the id of the user that owns the credentials or None if
+        the credentials haven't been verified recently."""
+        key = self._digest(name, password)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                user_id, expires_at = entry
+                if expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return user_id
+                self._remove(key)
+            self.misses += 1
+            return None
+
+    def set(self, name, password, user_id):
+        if self.max_size <= 0:
+            return
+        key = self._digest(name, password)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (user_id, time.monotonic() + self.ttl)
+            self._keys_by_user_id.setdefault(user_id, set()).add(key)
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate_user(self, user_id):
+        """Forgets every verified credential that belongs to the user."""
+        with self._lock:
+            for key in self._keys_by_user_id.pop(user_id, ()):
+                self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._keys_by_user_id.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def _remove(self, key):
+        user_id, _ = self._entries.pop(key)
+        keys = self._keys_by_user_id.get(user_id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_user_id[user_id]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+
+class CountCache():
+    """Keeps the total number of rows of the paginated queries for a TTL.
+
+    Each count is registered along with the tables it was computed from, so
+    the writes to any of those tables invalidate it immediately.
+    """
+    def __init__(self, max_size=1024, ttl=30):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.ttl = app.config.get('PAGINATION_COUNT_CACHE_TTL', self.ttl)
+        self.clear()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                count, _, expires_at = entry
+                if expires_at > time.monotonic():
+                    self.hits += 1
+                    return count
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def set(self, key, table_names, count):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (
+                count, frozenset(table_names), time.monotonic() + self.ttl)
+            # Dictionaries keep the insertion order, so the oldest goes first
+            while len(self._entries) > self.max_size:
+                del self._entries[next(iter(self._entries))]
+
+    def invalidate_tables(self, table_names):
+        with self._lock:
+            for key in [key for key, (_, tables, _) in self._entries.items()
+                        if not tables.isdisjoint(table_names)]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+
+class LRUCacheBackend():
+    """Stores the cached responses in process memory, evicting the least
+    recently used entries once max_size is exceeded.
+
+    Any object with the same methods can replace it, e.g. to share the cached
+    responses between processes through a key-value store: get(key),
+    set(key, value), get_generation(name), increment_generation(name),
+    clear() and size(). The values are tuples of the response and the time
+    until which it is served.
+    """
+    def __init__(self, max_size=512):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._generations = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def get_generation(self, name):
+        return self._generations.get(name, 0)
+
+    def increment_generation(self, name):
+        with self._lock:
+            self._generations[name] = self._generations.get(name, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._generations.clear()
+
+    def size(self):
+        return len(self._entries)
+
+
+class ResponseCache():
+    """Caches the successful responses of the GET methods of the resources.
+
+    The responses are keyed by endpoint, view and query arguments, host and
+    representation (Accept header), along with the current generation of
+    each table the response was read from. Writing to a table increments
+    its generation, so the responses that depend on it are never served
+    again and age out of the backend. The responses that change with time,
+    like the ones that include notifications that expire, are served until
+    the date passed to expire_at while computing them, and the responses
+    read from a replica for RESPONSE_CACHE_REPLICA_TTL seconds at most.
+
+    Only the writes of the processes that share the backend increment the
+    generations, so every response is also served for RESPONSE_CACHE_TTL
+    seconds at most, the delay after which the writes of the other
+    processes, such as the import-notifications command, are visible.
+    """
+    def __init__(self, backend=None):
+        self.backend = backend or LRUCacheBackend()
+        self.table_names = set()
+        self.hits = 0
+        self.misses = 0
+
+    def init_app(self, app):
+        backend = app.config.get('RESPONSE_CACHE_BACKEND')
+        if backend is None:
+            backend = LRUCacheBackend(
+                app.config.get('RESPONSE_CACHE_MAX_SIZE', 512))
+        self.backend = backend
+        app.before_request(self.read_generations)
+        self.clear()
+
+    def cached(self, *table_names):
+        """Decorates a resource method whose response is computed from the
+        given tables."""
+        self.table_names.update(table_names)
+        def decorator(f):
+            @wraps(f)
+            def decorated(*args, **kwargs):
+                if not self.is_enabled():
+                    return f(*args, **kwargs)
+                key = self.make_key(table_names)
+                entry = self.backend.get(key)
+                if entry is not None:
+                    cached_response, expires_at = entry
+                    # Wall clock time, comparable between the processes that
+                    # share a backend
+                    if expires_at is None or expires_at > time.time():
+                        self.hits += 1
+                        return self.revalidate(cached_response)
+                self.misses += 1
+                request.environ.pop(EXPIRATION_ENVIRON_KEY, None)
+                request.environ.pop(REPLICA_ENVIRON_KEY, None)
+                response = f(*args, **kwargs)
+                if isinstance(response, tuple) and \
+                        response[1] == HttpStatus.ok_200.value:
+                    self.store(key, response)
+                elif isinstance(response, (dict, list)):
+                    self.store(key, (response, HttpStatus.ok_200.value, {}))
+                return response
+            return decorated
+        return decorator
+
+    def is_enabled(self):
+        return bool(current_app.config.get('RESPONSE_CACHE_ENABLED'))
+
+    def expire_at(self, expiration_date):
+        """Stops serving the response that is being computed at the given
+        date (naive, in UTC), if it's earlier than the previous ones."""
+        if expiration_date is None:
+            return
+        expires_at = expiration_date.replace(tzinfo=timezone.utc).timestamp()
+        previous = request.environ.get(EXPIRATION_ENVIRON_KEY)
+        if previous is None or expires_at < previous:
+            request.environ[EXPIRATION_ENVIRON_KEY] = expires_at
+
+    def store(self, key, response):
+        now = time.time()
+        deadlines = [request.environ.get(EXPIRATION_ENVIRON_KEY)]
+        ttl = current_app.config.get('RESPONSE_CACHE_TTL')
+        if ttl is not None:
+            deadlines.append(now + ttl)
+        if request.environ.get(REPLICA_ENVIRON_KEY):
+            # The replica may lag behind the generations of the tables
+            deadlines.append(now + current_app.config.get(
+                'RESPONSE_CACHE_REPLICA_TTL', 5))
+        deadlines = [deadline for deadline in deadlines
+                     if deadline is not None]
+        expires_at = min(deadlines) if deadlines else None
+        if expires_at is None or expires_at > now:
+            self.backend.set(key, (response, expires_at))
+
+    def read_generations(self):
+        """Reads the generations of the cached tables before the request
+        runs its first query, e.g. to authenticate the user. The rows read
+        by the request may miss the writes committed after its first query,
+        which increment the generations afterwards, so the response is
+        stored under the previous generations and never served after
+        them."""
+        if request.method in ('GET', 'HEAD') and self.is_enabled():
+            request.environ[GENERATIONS_ENVIRON_KEY] = {
+                table_name: self.backend.get_generation(table_name)
+                for table_name in self.table_names}
+
+    def make_key(self, table_names):
+        generations = request.environ.get(GENERATIONS_ENVIRON_KEY, {})
+        return repr((
+            request.endpoint,
+            sorted(request.view_args.items()),
+            sorted(request.args.items(multi=True)),
+            request.host_url,
+            request.headers.get('Accept'),
+            [(table_name, generations[table_name]
+              if table_name in generations
+              else self.backend.get_generation(table_name))
+             for table_name in table_names]))
+
+    def revalidate(self, cached_response):
+        _, _, headers = cached_response
+        if request.method in ('GET', 'HEAD') and \
+                not is_resource_modified(
+                    request.environ,
+                    etag=headers.get('ETag'),
+                    last_modified=headers.get('Last-Modified')):
+            response = make_response('', HttpStatus.not_modified_304.value)
+            response.headers.extend(headers)
+            return response
+        return cached_response
+
+    def invalidate_tables(self, table_names):
+        for table_name in table_names:
+            self.backend.increment_generation(table_name)
+
+    def clear(self):
+        self.backend.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        requests = self.hits + self.misses
+        return {
+            'size': self.backend.size(),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / requests if requests else 0.0
+        }
@@ -29,5 +29,86 @@ else:
         addr=DATABASE_ADDR,
         db_prod=DATABASE_PROD)
 
+# Signs the bearer tokens, which must remain valid across the processes and
+# the restarts, so it is required unless the configuration is the testing one
+SECRET_KEY = os.environ.get('SECRET_KEY')
+if not SECRET_KEY:
+    if not DATABASE_DEV:
+        raise RuntimeError('Please, set the SECRET_KEY environment variable.')
+    # The tokens signed by the tests don't outlive their process
+    SECRET_KEY = os.urandom(32)
+
+# Connection pool (ignored by SQLite, which doesn't use a queue pool)
+SQLALCHEMY_POOL_SIZE = int(os.environ.get('DATABASE_POOL_SIZE', 10))
+SQLALCHEMY_MAX_OVERFLOW = int(os.environ.get('DATABASE_MAX_OVERFLOW', 10))
+SQLALCHEMY_POOL_TIMEOUT = int(os.environ.get('DATABASE_POOL_TIMEOUT', 30))
+# Recycle the connections before MySQL's wait_timeout closes them
+SQLALCHEMY_POOL_RECYCLE = int(os.environ.get('DATABASE_POOL_RECYCLE', 3600))
+SQLALCHEMY_POOL_PRE_PING = os.environ.get(
+    'DATABASE_POOL_PRE_PING', 'true').lower() in ('1', 'true', 'yes')
+
+# Comma separated URIs of the read replicas that serve the GET requests
+SQLALCHEMY_REPLICA_URIS = [
+    uri for uri in os.environ.get('DATABASE_REPLICA_URIS', '').split(',')
+    if uri]
+# Seconds between the health checks of each replica
+REPLICA_HEALTH_CHECK_INTERVAL = 30
+
 PAGINATION_PAGE_SIZE = 4
+PAGINATION_MAX_PAGE_SIZE = 100
 PAGINATION_PAGE_ARGUMENT_NAME = 'page'
+PAGINATION_PAGE_SIZE_ARGUMENT_NAME = 'page_size'
+PAGINATION_CURSOR_ARGUMENT_NAME = 'cursor'
+# One of 'exact', 'cached', 'estimated' or 'none' (see helpers.py)
+PAGINATION_COUNT_STRATEGY = os.environ.get(
+    'PAGINATION_COUNT_STRATEGY', 'exact')
+PAGINATION_COUNT_CACHE_TTL = 30
+
+# The responses of the GET methods are cached in process memory unless a
+# shared RESPONSE_CACHE_BACKEND is set (see caching.LRUCacheBackend)
+RESPONSE_CACHE_ENABLED = True
+RESPONSE_CACHE_MAX_SIZE = 512
+RESPONSE_CACHE_BACKEND = None
+# Seconds the responses are cached at most, since the writes of the processes
+# that don't share the backend, such as the other workers with their own
+# in-process backend or the import-notifications command, don't invalidate
+# them (None caches them until a write of this process)
+RESPONSE_CACHE_TTL = 10
+# Seconds the responses read from a replica are cached, since a lagging
+# replica may return rows older than the writes that invalidated the cache
+# (0 doesn't cache them)
+RESPONSE_CACHE_REPLICA_TTL = 5
+
+# Maximum number of items processed by a bulk request
+BULK_MAX_ITEMS = 1000
+
+# Number of rows fetched and written at once by the exports
+EXPORT_BATCH_SIZE = 1000
+# Number of rows validated and inserted at once by the imports
+IMPORT_BATCH_SIZE = 500
+
+# Number of notifications embedded in each notification category
+EMBEDDED_NOTIFICATIONS_LIMIT = 4
+
+# Aggregate the displays of the notifications in memory and write them in
+# batches every DISPLAY_COUNTER_FLUSH_INTERVAL seconds, or as soon as
+# DISPLAY_COUNTER_MAX_PENDING notifications have pending displays
+DISPLAY_COUNTER_BUFFERED = os.environ.get(
+    'DISPLAY_COUNTER_BUFFERED', 'false').lower() in ('1', 'true', 'yes')
+DISPLAY_COUNTER_FLUSH_INTERVAL = 5
+DISPLAY_COUNTER_MAX_PENDING = 1000
+
+# Dump the resources with the functions that serializers compiles for each
+# schema instead of dumping them field by field with marshmallow
+COMPILED_SERIALIZERS = True
+
+# Seconds between the runs of the thread that deletes the expired
+# notifications, 0 to schedule the reap-notifications command instead
+NOTIFICATION_REAPER_INTERVAL = int(
+    os.environ.get('NOTIFICATION_REAPER_INTERVAL', 0))
+NOTIFICATION_REAPER_BATCH_SIZE = 1000
+
+CREDENTIAL_CACHE_MAX_SIZE = 1024
+CREDENTIAL_CACHE_TTL = 300
+
+TOKEN_EXPIRATION_SECONDS = 600
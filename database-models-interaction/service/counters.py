@@ -0,0 +1,106 @@
+"""
+This module contains the buffer that aggregates the displays of the
+notifications in memory and writes them to the database in periodic batches,
+so the notifications displayed very often don't serialize the requests on
+the lock of their rows.
+"""
+import logging
+import threading
+import time
+
+from sqlalchemy.exc import SQLAlchemyError
+
+from bulk import mark_notifications_displayed
+from models import db
+
+logger = logging.getLogger(__name__)
+
+
+class DisplayCounterBuffer():
+    """Accumulates the displays of each notification until the flush
+    interval elapses, or until max_pending notifications have pending
+    displays, and then writes them all with mark_notifications_displayed.
+
+    A daemon thread flushes the buffer periodically once the first display
+    is added, so the displays also reach the database when the API is idle.
+    The displays that a failed flush couldn't write are kept for the next
+    one; the ones pending when the process stops are lost.
+    """
+    def __init__(self, flush_interval=5, max_pending=1000):
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.flushes = 0
+        self._app = None
+        self._pending = {}
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def init_app(self, app):
+        self.flush_interval = app.config.get(
+            'DISPLAY_COUNTER_FLUSH_INTERVAL', self.flush_interval)
+        self.max_pending = app.config.get(
+            'DISPLAY_COUNTER_MAX_PENDING', self.max_pending)
+        self._app = app
+        with self._lock:
+            self._pending.clear()
+            self.flushes = 0
+
+    def add(self, notification_id, count=1):
+        with self._lock:
+            self._pending[notification_id] = \
+                self._pending.get(notification_id, 0) + count
+            flush_now = len(self._pending) >= self.max_pending or \
+                time.monotonic() - self._last_flush >= self.flush_interval
+            self._start_thread()
+        if flush_now:
+            self.flush()
+
+    def flush(self):
+        """Writes the pending displays and returns the number of updated
+        notifications. Requires an application context."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._last_flush = time.monotonic()
+        if not pending:
+            return 0
+        try:
+            affected_rows = mark_notifications_displayed(pending)
+        except SQLAlchemyError:
+            db.session.rollback()
+            logger.exception('Cannot write the displays of %d notifications',
+                             len(pending))
+            with self._lock:
+                for notification_id, count in pending.items():
+                    self._pending[notification_id] = \
+                        self._pending.get(notification_id, 0) + count
+            return 0
+        with self._lock:
+            self.flushes += 1
+        return affected_rows
+
+    def pending(self):
+        with self._lock:
+            return sum(self._pending.values())
+
+    def _start_thread(self):
+        # Called with the lock held
+        if self._thread is None and self._app is not None:
+            self._thread = threading.Thread(
+                target=self._flush_periodically,
+                name='display-counter-flush', daemon=True)
+            self._thread.start()
+
+    def _flush_periodically(self):
+        while True:
+            time.sleep(self.flush_interval)
+            with self._app.app_context():
+                self.flush()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'pending_notifications': len(self._pending),
+                'pending_displays': sum(self._pending.values()),
+                'flushes': self.flushes
+            }
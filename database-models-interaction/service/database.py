@@ -0,0 +1,276 @@
+"""
+This module customizes the Flask-SQLAlchemy integration: it applies the
+connection pool settings from the configuration, instruments the pool to
+publish its health metrics (checkouts, wait times, overflow and invalidated
+connections), sets the session time zone of the connections to UTC and
+routes the reads of the GET and HEAD requests to the read replicas.
+"""
+import itertools
+import threading
+import time
+
+from flask import has_request_context, request
+from flask_sqlalchemy import SQLAlchemy, SignallingSession, get_state
+from sqlalchemy import create_engine, event, orm, select
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.pool import Pool, QueuePool
+
+# The options of the queue pool, which the SQLite pools don't accept
+QUEUE_POOL_OPTIONS = ('pool_size', 'max_overflow', 'pool_timeout')
+# The methods whose requests only read, so they can read from a replica
+READ_ONLY_METHODS = ('GET', 'HEAD')
+# Marks the requests that wrote and therefore keep reading from the primary
+PRIMARY_ENVIRON_KEY = 'service.read_from_primary'
+# Marks the requests that read from a replica
+REPLICA_ENVIRON_KEY = 'service.read_from_replica'
+# The replica engine chosen for the request (None if none was available), so
+# all its reads see the same replication lag
+REPLICA_ENGINE_ENVIRON_KEY = 'service.replica_engine'
+# The connection arguments that set the session time zone to UTC, by driver,
+# so CURRENT_TIMESTAMP (the server defaults) and the TIMESTAMP values read
+# use the same clock as the UTC dates generated by the application
+UTC_CONNECT_ARGS = {
+    'mysql+mysqlconnector': {'time_zone': '+00:00'},
+    'mysql+mysqldb': {'init_command': "SET time_zone = '+00:00'"},
+    'mysql+pymysql': {'init_command': "SET time_zone = '+00:00'"},
+    'postgresql+psycopg2': {'options': '-c timezone=UTC'}
+}
+
+
+def get_utc_connect_args(info):
+    """Returns the connection arguments that set the session time zone of
+    the database URL to UTC (SQLite has no time zone, it always uses UTC)."""
+    drivername = info.drivername
+    if '+' not in drivername:
+        drivername = '{0}+{1}'.format(drivername, info.get_dialect().driver)
+    return dict(UTC_CONNECT_ARGS.get(drivername, {}))
+
+
+class PoolMetrics():
+    """Accumulates the events of the connection pools of the process."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.connections = 0
+            self.checkouts = 0
+            self.checkins = 0
+            self.invalidations = 0
+            self.waits = 0
+            self.wait_time = 0.0
+            self.max_wait_time = 0.0
+            self.max_overflow_used = 0
+
+    def record(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def record_wait(self, wait_time, overflow):
+        with self._lock:
+            self.waits += 1
+            self.wait_time += wait_time
+            self.max_wait_time = max(self.max_wait_time, wait_time)
+            self.max_overflow_used = max(self.max_overflow_used, overflow)
+
+    def stats(self, pool=None):
+        with self._lock:
+            stats = {
+                'connections': self.connections,
+                'checkouts': self.checkouts,
+                'checkins': self.checkins,
+                'invalidations': self.invalidations,
+                'average_wait_time': self.wait_time / self.waits
+                                     if self.waits else 0.0,
+                'max_wait_time': self.max_wait_time,
+                'max_overflow_used': self.max_overflow_used
+            }
+        if isinstance(pool, QueuePool):
+            stats.update({
+                'size': pool.size(),
+                'checked_in': pool.checkedin(),
+                'checked_out': pool.checkedout(),
+                'overflow': max(pool.overflow(), 0)
+            })
+        return stats
+
+pool_metrics = PoolMetrics()
+
+
+class InstrumentedQueuePool(QueuePool):
+    """A QueuePool that measures how long each checkout waits for a
+    connection and how many overflow connections are in use."""
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            pool_metrics.record_wait(
+                time.perf_counter() - start, max(self.overflow(), 0))
+
+
+@event.listens_for(Pool, 'connect')
+def record_connect(dbapi_connection, connection_record):
+    pool_metrics.record('connections')
+
+@event.listens_for(Pool, 'checkout')
+def record_checkout(dbapi_connection, connection_record, connection_proxy):
+    pool_metrics.record('checkouts')
+
+@event.listens_for(Pool, 'checkin')
+def record_checkin(dbapi_connection, connection_record):
+    pool_metrics.record('checkins')
+
+@event.listens_for(Pool, 'invalidate')
+def record_invalidate(dbapi_connection, connection_record, exception):
+    pool_metrics.record('invalidations')
+
+
+class Replica():
+    """A read replica, checked at most once per health check interval."""
+    def __init__(self, engine, health_check_interval):
+        self.engine = engine
+        self.health_check_interval = health_check_interval
+        self.healthy = True
+        self.next_check = 0
+        event.listen(engine, 'handle_error', self.handle_error)
+
+    def is_available(self):
+        now = time.monotonic()
+        if now >= self.next_check:
+            self.next_check = now + self.health_check_interval
+            try:
+                with self.engine.connect() as connection:
+                    connection.scalar(select([1]))
+                self.healthy = True
+            except SQLAlchemyError:
+                self.healthy = False
+        return self.healthy
+
+    def handle_error(self, context):
+        # Stop using a replica that lost its connection until it recovers
+        if context.is_disconnect:
+            self.healthy = False
+            self.next_check = time.monotonic() + self.health_check_interval
+
+    def stats(self):
+        return {'url': repr(self.engine.url), 'healthy': self.healthy}
+
+
+class ReplicaSet():
+    """Hands out the available replicas in round-robin order."""
+    def __init__(self, uris, replicas):
+        self.uris = uris
+        self.replicas = replicas
+        self._positions = itertools.cycle(range(len(replicas)))
+        self._lock = threading.Lock()
+
+    def get_engine(self):
+        """Returns the engine of the next available replica or None when
+        none is available."""
+        for _ in self.replicas:
+            with self._lock:
+                replica = self.replicas[next(self._positions)]
+            if replica.is_available():
+                return replica.engine
+        return None
+
+    def dispose(self):
+        for replica in self.replicas:
+            replica.engine.dispose()
+
+    def stats(self):
+        return [replica.stats() for replica in self.replicas]
+
+
+class RoutingSession(SignallingSession):
+    """Reads from a replica while serving a GET or HEAD request that hasn't
+    written anything; everything else, flushes included, uses the primary.
+    The replica is chosen by the first read of the request and used by the
+    rest of them.
+    """
+    def __init__(self, db, **options):
+        self.db = db
+        super().__init__(db, **options)
+
+    def get_bind(self, mapper=None, clause=None):
+        if self.reads_from_replica():
+            engine = self.get_replica_engine()
+            if engine is not None:
+                request.environ[REPLICA_ENVIRON_KEY] = True
+                return engine
+        return super().get_bind(mapper, clause)
+
+    def reads_from_replica(self):
+        if not has_request_context() or \
+                request.method not in READ_ONLY_METHODS:
+            return False
+        if self._flushing:
+            # Read what this request writes from the primary from now on
+            request.environ[PRIMARY_ENVIRON_KEY] = True
+        return not request.environ.get(PRIMARY_ENVIRON_KEY)
+
+    def get_replica_engine(self):
+        if REPLICA_ENGINE_ENVIRON_KEY not in request.environ:
+            request.environ[REPLICA_ENGINE_ENVIRON_KEY] = \
+                self.db.get_replica_set(self.app).get_engine()
+        return request.environ[REPLICA_ENGINE_ENVIRON_KEY]
+
+
+class ServiceSQLAlchemy(SQLAlchemy):
+    """Flask-SQLAlchemy with the connection pool configured by the
+    SQLALCHEMY_POOL_* settings (including SQLALCHEMY_POOL_PRE_PING),
+    instrumented with InstrumentedQueuePool, and with the reads routed to
+    the SQLALCHEMY_REPLICA_URIS databases by RoutingSession. Every connection
+    uses the UTC session time zone."""
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def get_replica_set(self, app=None):
+        app = self.get_app(app)
+        state = get_state(app)
+        uris = tuple(app.config.get('SQLALCHEMY_REPLICA_URIS') or ())
+        replica_set = getattr(state, 'replica_set', None)
+        if replica_set is not None and replica_set.uris == uris:
+            return replica_set
+        with self._engine_lock:
+            replica_set = getattr(state, 'replica_set', None)
+            if replica_set is None or replica_set.uris != uris:
+                if replica_set is not None:
+                    replica_set.dispose()
+                interval = app.config.get('REPLICA_HEALTH_CHECK_INTERVAL', 30)
+                replica_set = state.replica_set = ReplicaSet(
+                    uris,
+                    [Replica(self.create_replica_engine(app, uri), interval)
+                     for uri in uris])
+            return replica_set
+
+    def create_replica_engine(self, app, uri):
+        # Configured just like Flask-SQLAlchemy configures the primary
+        info = make_url(uri)
+        options = {'convert_unicode': True}
+        self.apply_pool_defaults(app, options)
+        self.apply_driver_hacks(app, info, options)
+        if app.config['SQLALCHEMY_ECHO']:
+            options['echo'] = True
+        return create_engine(info, **options)
+
+    def apply_pool_defaults(self, app, options):
+        super().apply_pool_defaults(app, options)
+        if app.config.get('SQLALCHEMY_POOL_PRE_PING'):
+            # Test each connection before using it, so the connections that
+            # the server closed are replaced instead of failing the request
+            options['pool_pre_ping'] = True
+
+    def apply_driver_hacks(self, app, info, options):
+        if info.drivername.startswith('sqlite'):
+            for option in QUEUE_POOL_OPTIONS:
+                options.pop(option, None)
+        super().apply_driver_hacks(app, info, options)
+        options.setdefault('poolclass', InstrumentedQueuePool)
+        connect_args = get_utc_connect_args(info)
+        connect_args.update(options.get('connect_args', {}))
+        if connect_args:
+            options['connect_args'] = connect_args
@@ -0,0 +1,113 @@
+"""
+This module contains the reaper that deletes the expired notifications, whose
+creation date plus ttl seconds has passed. The reads already exclude them, so
+the reaper only has to keep the table from growing forever: it deletes them in
+bounded batches, each one in its own short transaction, found through the
+index on the expiration date.
+"""
+import logging
+import threading
+import time
+
+import click
+
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy.exc import SQLAlchemyError
+
+from models import db, Notification, ResourceAddUpdateDelete, utc_timestamp
+
+logger = logging.getLogger(__name__)
+
+
+def delete_expired_notifications(batch_size=1000, max_batches=None):
+    """Deletes the expired notifications, batch_size at a time, and returns
+    the number of deleted notifications.
+
+    Args:
+        batch_size (int): The maximum number of notifications deleted by
+            each DELETE statement
+        max_batches (int): Stops after this number of batches, even if
+            there are more expired notifications (all of them if None)
+    """
+    deleted = 0
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        ids = [id for id, in db.session.query(Notification.id)
+               .filter(Notification.expiration_date <= utc_timestamp())
+               .order_by(Notification.expiration_date)
+               .limit(batch_size)]
+        if not ids:
+            break
+        Notification.query\
+            .filter(Notification.id.in_(ids))\
+            .delete(synchronize_session=False)
+        ResourceAddUpdateDelete.commit(
+            changed_tables=[Notification.__table__])
+        deleted += len(ids)
+        batches += 1
+        if len(ids) < batch_size:
+            break
+    return deleted
+
+
+class NotificationReaper():
+    """Runs delete_expired_notifications in a daemon thread every interval
+    seconds. An interval of 0 disables the thread, e.g. to schedule the
+    reap-notifications command instead."""
+    def __init__(self, interval=0, batch_size=1000):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.runs = 0
+        self.deleted = 0
+        self._app = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.interval = app.config.get(
+            'NOTIFICATION_REAPER_INTERVAL', self.interval)
+        self.batch_size = app.config.get(
+            'NOTIFICATION_REAPER_BATCH_SIZE', self.batch_size)
+        self._app = app
+        with self._lock:
+            if self.interval and self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._reap_periodically,
+                    name='notification-reaper', daemon=True)
+                self._thread.start()
+
+    def reap(self):
+        """Deletes the expired notifications and returns their number.
+        Requires an application context."""
+        try:
+            deleted = delete_expired_notifications(self.batch_size)
+        except SQLAlchemyError:
+            db.session.rollback()
+            logger.exception('Cannot delete the expired notifications')
+            return 0
+        with self._lock:
+            self.runs += 1
+            self.deleted += deleted
+        return deleted
+
+    def _reap_periodically(self):
+        while True:
+            time.sleep(self.interval)
+            with self._app.app_context():
+                self.reap()
+
+    def stats(self):
+        with self._lock:
+            return {'runs': self.runs, 'deleted': self.deleted}
+
+
+@click.command('reap-notifications')
+@click.option('--batch-size', type=int,
+              help='Defaults to the NOTIFICATION_REAPER_BATCH_SIZE setting.')
+@with_appcontext
+def reap_notifications_command(batch_size):
+    """Deletes the expired notifications."""
+    deleted = delete_expired_notifications(
+        batch_size or current_app.config['NOTIFICATION_REAPER_BATCH_SIZE'])
+    click.echo('Deleted {0} expired notifications.'.format(deleted))
@@ -1,50 +1,395 @@
 """
 This module illustrates a Pagination Helper. It creates a pagination class
 object that will be used by the API.
+
+Besides the page number based pagination, the helper supports an opt-in
+keyset (cursor) pagination mode, enabled by the cursor query argument, that
+seeks through an indexed column instead of using OFFSET and doesn't count the
+rows of the whole query. Both modes sort the rows by the order_by column, in
+ascending or descending order, and then by the primary key.
+
+The total count included in the page number based responses is computed
+according to the PAGINATION_COUNT_STRATEGY setting:
+
+* exact: runs a SELECT COUNT(*) for every page.
+* cached: keeps the exact count for PAGINATION_COUNT_CACHE_TTL seconds or
+  until a write to any of the counted tables is committed.
+* estimated: reads the number of rows from the table statistics when the
+  query isn't filtered, and falls back to the exact count otherwise. The
+  estimated_count_query passed to the helper, if any, replaces the query for
+  this check, e.g. the notifications without the condition that excludes the
+  expired ones, which the statistics can't apply.
+* none: omits the count from the responses.
+
+The module also builds the eager loading options that a query needs so that
+dumping its results with a schema doesn't lazy load a relationship per row,
+and the conditional responses (ETag, Last-Modified and their preconditions)
+of the resources.
 """
+import json
+
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from binascii import Error as DecodingError
+from datetime import datetime
+
 from flask import url_for
-from flask import current_app
+from flask import current_app, make_response, request
+from flask_restful import abort
+from marshmallow import fields
+from sqlalchemy import and_, or_, inspect, text
+from sqlalchemy.orm import Load
+from werkzeug.http import generate_etag, http_date, is_resource_modified, \
+        quote_etag
+from sqlalchemy.sql.util import find_tables
+
+from caching import CountCache
+from http_status import HttpStatus
+from serializers import dump
+
+COUNT_STRATEGIES = ('exact', 'cached', 'estimated', 'none')
+
+count_cache = CountCache()
+
+# Queries that read the approximate number of rows of a table, by dialect
+ESTIMATED_COUNT_QUERIES = {
+    'mysql': text('SELECT table_rows FROM information_schema.tables '
+                  'WHERE table_schema = DATABASE() AND table_name = :table'),
+    'postgresql': text('SELECT reltuples::bigint FROM pg_class '
+                       'WHERE relname = :table'),
+}
+
+def get_serialized_relationship_paths(model, schema):
+    """Returns the paths of the relationships, starting at the model, that
+    the schema serializes with nested fields."""
+    mapper = inspect(model)
+    paths = []
+    # The schema fields already honor the only and exclude options
+    for field_name, field in schema.fields.items():
+        if not isinstance(field, fields.Nested):
+            continue
+        relationship = mapper.relationships.get(field.attribute or field_name)
+        # Dynamic relationships are queries, they can't be loaded eagerly
+        if relationship is None or relationship.lazy == 'dynamic':
+            continue
+        nested_paths = get_serialized_relationship_paths(
+            relationship.mapper.class_, field.schema)
+        paths.append([relationship])
+        paths.extend([relationship] + path for path in nested_paths)
+    return paths
+
+def eager_loading_options(model, schema):
+    """Returns the query options that load every relationship serialized by
+    the schema along with the model: a JOIN for many-to-one relationships and
+    a single additional SELECT ... IN for one-to-many relationships."""
+    options = []
+    for path in get_serialized_relationship_paths(model, schema):
+        option = Load(model)
+        for relationship in path:
+            attribute = getattr(relationship.parent.class_, relationship.key)
+            if relationship.uselist:
+                option = option.selectinload(attribute)
+            else:
+                option = option.joinedload(attribute)
+        options.append(option)
+    return options
+
+def get_versioned_objects(obj, schema):
+    """Returns the versioned objects whose state is dumped by the schema: the
+    object itself and the objects of its serialized many-to-one
+    relationships. Returns None when the representation depends on anything
+    else, e.g. collections, so that its version can't tell if it changed."""
+    mapper = inspect(type(obj))
+    if mapper.version_id_col is None:
+        return None
+    versioned_objects = [obj]
+    for field_name, field in schema.fields.items():
+        if not isinstance(field, fields.Nested):
+            continue
+        relationship = mapper.relationships.get(field.attribute or field_name)
+        if relationship is None or relationship.uselist:
+            return None
+        related_object = getattr(obj, relationship.key)
+        if related_object is not None:
+            related_versioned_objects = get_versioned_objects(
+                related_object, field.schema)
+            if related_versioned_objects is None:
+                return None
+            versioned_objects.extend(related_versioned_objects)
+    return versioned_objects
+
+def get_entity_tag(obj, schema, dumped_object=None):
+    """Returns the strong ETag of the representation of the object and the
+    date of its last modification, if known. The ETag is computed from the
+    row versions without dumping the object when possible, or from the
+    dumped object otherwise."""
+    versioned_objects = get_versioned_objects(obj, schema)
+    if versioned_objects is None:
+        if dumped_object is None:
+            dumped_object = dump(schema, obj)
+        return get_payload_entity_tag(dumped_object), None
+    versions = []
+    for versioned_object in versioned_objects:
+        mapper = inspect(type(versioned_object))
+        version_property = mapper.get_property_by_column(
+            mapper.version_id_col)
+        versions.append((
+            mapper.local_table.name,
+            mapper.primary_key_from_instance(versioned_object),
+            getattr(versioned_object, version_property.key)))
+    last_modified = max(
+        versioned_object.modification_date
+        for versioned_object in versioned_objects)
+    return quote_etag(generate_etag(repr(versions).encode('utf-8'))), \
+        last_modified
+
+def get_payload_entity_tag(dumped_object):
+    payload = json.dumps(dumped_object, sort_keys=True)
+    return quote_etag(generate_etag(payload.encode('utf-8')))
+
+def is_not_modified(entity_tag, last_modified=None):
+    # Other methods, e.g. a PATCH that returns the updated resource, always
+    # include the representation
+    if request.method not in ('GET', 'HEAD'):
+        return False
+    # If-None-Match takes precedence over If-Modified-Since
+    return not is_resource_modified(
+        request.environ, etag=entity_tag, last_modified=last_modified)
+
+def not_modified_response(headers):
+    response = make_response('', HttpStatus.not_modified_304.value)
+    response.headers.extend(headers)
+    return response
+
+def conditional_response(obj, schema):
+    """Returns the dumped object along with its ETag and Last-Modified
+    headers, or a 304 response without dumping the object when the copy of
+    the client is still current."""
+    entity_tag, last_modified = get_entity_tag(obj, schema)
+    headers = {'ETag': entity_tag}
+    if last_modified is not None:
+        headers['Last-Modified'] = http_date(last_modified)
+    if is_not_modified(entity_tag, last_modified):
+        return not_modified_response(headers)
+    return dump(schema, obj), HttpStatus.ok_200.value, headers
+
+def conditional_payload_response(dumped_object):
+    """Returns the already dumped object, e.g. a page, along with its ETag,
+    or a 304 response when the copy of the client is still current."""
+    headers = {'ETag': get_payload_entity_tag(dumped_object)}
+    if is_not_modified(headers['ETag']):
+        return not_modified_response(headers)
+    return dumped_object, HttpStatus.ok_200.value, headers
+
+def precondition_failed(obj, schema):
+    """Returns True when the request includes an If-Match header that
+    doesn't match the current ETag of the object."""
+    if not request.if_match:
+        return False
+    entity_tag, _ = get_entity_tag(obj, schema)
+    return not request.if_match.contains(entity_tag.strip('"'))
 
 class PaginationHelper():
-    def __init__(self, request, query, resource_for_url, key_name, schema):
+    def __init__(self, request, query, resource_for_url, key_name, schema,
+                 order_by=None, descending=False, count_strategy=None,
+                 estimated_count_query=None):
         self.request = request
         self.query = query
+        self.estimated_count_query = estimated_count_query
         self.resource_for_url = resource_for_url
         self.key_name = key_name
         self.schema = schema
-        self.page_size = current_app.config['PAGINATION_PAGE_SIZE']
         self.page_argument_name = current_app.\
                 config['PAGINATION_PAGE_ARGUMENT_NAME']
+        self.page_size_argument_name = current_app.\
+                config['PAGINATION_PAGE_SIZE_ARGUMENT_NAME']
+        self.cursor_argument_name = current_app.\
+                config['PAGINATION_CURSOR_ARGUMENT_NAME']
+        self.page_size = self.get_page_size()
+        self.count_strategy = count_strategy or current_app.\
+                config['PAGINATION_COUNT_STRATEGY']
+        if self.count_strategy not in COUNT_STRATEGIES:
+            raise ValueError('Unknown count strategy <{0}>'.format(
+                self.count_strategy))
+        # The keyset columns: the sort column followed by the primary key,
+        # which breaks the ties between rows with the same sort value
+        entity = query.column_descriptions[0]['entity']
+        self.primary_key = getattr(
+            entity, inspect(entity).primary_key[0].name)
+        self.order_by = order_by if order_by is not None else \
+                self.primary_key
+        self.descending = descending
+
+    def get_page_size(self):
+        # Clients can request smaller or bigger pages up to the maximum size
+        page_size = self.request.args.get(
+            self.page_size_argument_name,
+            current_app.config['PAGINATION_PAGE_SIZE'],
+            type=int)
+        return max(1, min(page_size,
+                          current_app.config['PAGINATION_MAX_PAGE_SIZE']))
+
+    def build_url(self, **args):
+        url_args = self.request.args.to_dict()
+        url_args.update(args)
+        return url_for(self.resource_for_url, _external=True, **url_args)
 
     def paginate_query(self):
+        if self.cursor_argument_name in self.request.args:
+            return self.paginate_query_with_cursor()
+
         # Assumes page number 1 if page not specified
-        page_number = self.request.args.get(self.page_argument_name, 1, type=int)
-        paginated_objects = self.query.paginate(
-            page_number,
-            per_page=self.page_size,
-            error_out=False)
-        objects = paginated_objects.items
-
-        if paginated_objects.has_prev:
-            previous_page_url = url_for(
-                self.resource_for_url,
-                page=page_number-1,
-                _external=True)
+        page_number = max(
+            self.request.args.get(self.page_argument_name, 1, type=int), 1)
+        # Fetching one extra row tells us whether there is a next page, so
+        # the count is only needed if the response includes it
+        objects = self.query\
+            .order_by(None)\
+            .order_by(*self.order_by_clauses(reverse=False))\
+            .limit(self.page_size + 1)\
+            .offset((page_number - 1) * self.page_size)\
+            .all()
+        has_next = len(objects) > self.page_size
+        objects = objects[:self.page_size]
+
+        if page_number > 1:
+            previous_page_url = self.build_url(
+                **{self.page_argument_name: page_number-1})
         else:
             previous_page_url = None
 
-        if paginated_objects.has_next:
-            next_page_url = url_for(
-                self.resource_for_url,
-                page=page_number+1,
-                _external=True)
+        if has_next:
+            next_page_url = self.build_url(
+                **{self.page_argument_name: page_number+1})
         else:
             next_page_url = None
 
-        dumped_objects = self.schema.dump(objects, many=True).data
+        dumped_objects = dump(self.schema, objects, many=True)
+        result = {
+            self.key_name: dumped_objects,
+            'previous': previous_page_url,
+            'next': next_page_url
+        }
+        if self.count_strategy != 'none':
+            result['count'] = self.count()
+        return result
+
+    def count(self):
+        count_query = self.query.order_by(None)
+        if self.count_strategy == 'estimated':
+            estimated_count = self.estimated_count(
+                count_query if self.estimated_count_query is None
+                else self.estimated_count_query.order_by(None))
+            if estimated_count is not None:
+                return estimated_count
+        elif self.count_strategy == 'cached':
+            statement = count_query.statement
+            compiled_statement = statement.compile()
+            key = (str(compiled_statement),
+                   repr(sorted(compiled_statement.params.items())))
+            count = count_cache.get(key)
+            if count is None:
+                count = count_query.count()
+                count_cache.set(
+                    key,
+                    {table.name for table in find_tables(statement)},
+                    count)
+            return count
+        return count_query.count()
+
+    def estimated_count(self, query):
+        # The table statistics only describe unfiltered queries
+        if query.whereclause is not None:
+            return None
+        tables = find_tables(query.statement)
+        if len(tables) != 1:
+            return None
+        dialect_name = query.session.get_bind().dialect.name
+        estimated_count_query = ESTIMATED_COUNT_QUERIES.get(dialect_name)
+        if estimated_count_query is None:
+            return None
+        estimated_count = query.session.execute(
+            estimated_count_query, {'table': tables[0].name}).scalar()
+        if estimated_count is None:
+            return None
+        return int(estimated_count)
+
+    def paginate_query_with_cursor(self):
+        # An empty cursor requests the first page
+        cursor = self.request.args.get(self.cursor_argument_name)
+        if cursor:
+            key, backwards = self.decode_cursor(cursor)
+        else:
+            key, backwards = None, False
+
+        query = self.query.order_by(None)
+        if key is not None:
+            query = query.filter(self.seek_condition(key, backwards))
+        query = query.order_by(*self.order_by_clauses(reverse=backwards))
+        # Fetching one extra row tells us whether there is another page
+        objects = query.limit(self.page_size + 1).all()
+        has_more = len(objects) > self.page_size
+        objects = objects[:self.page_size]
+        if backwards:
+            objects.reverse()
+
+        previous_page_url = None
+        next_page_url = None
+        if objects:
+            if (has_more if backwards else key is not None):
+                previous_page_url = self.build_url(**{
+                    self.cursor_argument_name:
+                        self.encode_cursor(objects[0], backwards=True)})
+            if (key is not None if backwards else has_more):
+                next_page_url = self.build_url(**{
+                    self.cursor_argument_name:
+                        self.encode_cursor(objects[-1], backwards=False)})
+
+        dumped_objects = dump(self.schema, objects, many=True)
         return ({
             self.key_name: dumped_objects,
             'previous': previous_page_url,
-            'next': next_page_url,
-            'count': paginated_objects.total
+            'next': next_page_url
         })
+
+    def order_by_clauses(self, reverse):
+        descending = self.descending != reverse
+        columns = [self.order_by]
+        if self.order_by is not self.primary_key:
+            columns.append(self.primary_key)
+        return [column.desc() if descending else column.asc()
+                for column in columns]
+
+    def seek_condition(self, key, backwards):
+        sort_value, primary_key_value = key
+        # Seek the rows that follow the key in the direction of the page
+        if self.descending != backwards:
+            def follows(column, value):
+                return column < value
+        else:
+            def follows(column, value):
+                return column > value
+        if self.order_by is self.primary_key:
+            return follows(self.primary_key, primary_key_value)
+        return or_(
+            follows(self.order_by, sort_value),
+            and_(self.order_by == sort_value,
+                 follows(self.primary_key, primary_key_value)))
+
+    def encode_cursor(self, obj, backwards):
+        sort_value = getattr(obj, self.order_by.key)
+        if isinstance(sort_value, datetime):
+            sort_value = sort_value.isoformat()
+        primary_key_value = getattr(obj, self.primary_key.key)
+        data = json.dumps([sort_value, primary_key_value, backwards])
+        return urlsafe_b64encode(data.encode('utf-8')).decode('ascii')
+
+    def decode_cursor(self, cursor):
+        try:
+            sort_value, primary_key_value, backwards = json.loads(
+                urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+            if self.order_by.type.python_type is datetime:
+                sort_value = datetime.fromisoformat(sort_value)
+        except (DecodingError, TypeError, ValueError):
+            abort(HttpStatus.bad_request_400.value,
+                  message='The cursor <{0}> is not valid'.format(cursor))
+        return (sort_value, primary_key_value), bool(backwards)
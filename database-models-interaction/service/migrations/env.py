@@ -1,6 +1,7 @@
 from __future__ import with_statement
 from alembic import context
 from sqlalchemy import engine_from_config, pool
+from sqlalchemy.engine.url import make_url
 from logging.config import fileConfig
 import logging
 
@@ -65,9 +66,14 @@ def run_migrations_online():
                 directives[:] = []
                 logger.info('No changes in schema detected.')
 
+    # The migrations use the UTC session time zone, like the application
+    from database import get_utc_connect_args
     engine = engine_from_config(config.get_section(config.config_ini_section),
                                 prefix='sqlalchemy.',
-                                poolclass=pool.NullPool)
+                                poolclass=pool.NullPool,
+                                connect_args=get_utc_connect_args(
+                                    make_url(config.get_main_option(
+                                        'sqlalchemy.url'))))
 
     connection = engine.connect()
     context.configure(connection=connection,
@@ -0,0 +1,31 @@
+"""Add version and modification_date columns
+
+Revision ID: 5f2c8e1d7b40
+Revises: a9639b93ac33
+Create Date: 2026-10-18 10:12:45.318204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5f2c8e1d7b40'
+down_revision = 'a9639b93ac33'
+branch_labels = None
+depends_on = None
+
+VERSIONED_TABLES = ('notification_category', 'notification', 'user')
+
+
+def upgrade():
+    for table_name in VERSIONED_TABLES:
+        op.add_column(table_name, sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+        op.add_column(table_name, sa.Column('modification_date', sa.TIMESTAMP(), server_default=sa.text('CURRENT_TIMESTAMP'), nullable=False))
+
+
+def downgrade():
+    for table_name in reversed(VERSIONED_TABLES):
+        with op.batch_alter_table(table_name) as batch_op:
+            batch_op.drop_column('modification_date')
+            batch_op.drop_column('version')
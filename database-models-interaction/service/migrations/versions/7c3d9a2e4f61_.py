@@ -0,0 +1,30 @@
+"""Add the indexes of the notification list filters
+
+Revision ID: 7c3d9a2e4f61
+Revises: 5f2c8e1d7b40
+Create Date: 2026-10-18 14:35:08.512093
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7c3d9a2e4f61'
+down_revision = '5f2c8e1d7b40'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_notification_category_creation_date', 'notification', ['notification_category_id', 'creation_date'], unique=False)
+    op.create_index('ix_notification_displayed_once_creation_date', 'notification', ['displayed_once', 'creation_date'], unique=False)
+    op.create_index('ix_notification_creation_date', 'notification', ['creation_date'], unique=False)
+    op.create_index('ix_notification_ttl', 'notification', ['ttl'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_notification_ttl', table_name='notification')
+    op.drop_index('ix_notification_creation_date', table_name='notification')
+    op.drop_index('ix_notification_displayed_once_creation_date', table_name='notification')
+    op.drop_index('ix_notification_category_creation_date', table_name='notification')
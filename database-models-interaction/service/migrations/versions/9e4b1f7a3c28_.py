@@ -0,0 +1,30 @@
+"""Add the expiration_date column to notification
+
+Revision ID: 9e4b1f7a3c28
+Revises: 7c3d9a2e4f61
+Create Date: 2026-10-18 16:02:51.204377
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9e4b1f7a3c28'
+down_revision = '7c3d9a2e4f61'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('notification', sa.Column('expiration_date', sa.TIMESTAMP(), nullable=True))
+    op.execute('UPDATE notification SET expiration_date = TIMESTAMPADD(SECOND, ttl, creation_date)')
+    with op.batch_alter_table('notification') as batch_op:
+        batch_op.alter_column('expiration_date', existing_type=sa.TIMESTAMP(), nullable=False)
+    op.create_index('ix_notification_expiration_date', 'notification', ['expiration_date'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_notification_expiration_date', table_name='notification')
+    with op.batch_alter_table('notification') as batch_op:
+        batch_op.drop_column('expiration_date')
@@ -3,38 +3,175 @@ This module contains the instances that will be used to represent and persist
 the users, the notification categories, the notifications and their relationship 
 in the MySQL database.
 """
+import itertools
 import re
 
+from datetime import datetime, timedelta
+
 from marshmallow import Schema, fields, pre_load
 from marshmallow import validate
 
-from flask_sqlalchemy import SQLAlchemy
+from flask import current_app
 from flask_marshmallow import Marshmallow
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.ext.declarative import declared_attr
+from sqlalchemy.sql.expression import FunctionElement
 
 from passlib.apps import custom_app_context as password_context
 
-db = SQLAlchemy()
+from database import ServiceSQLAlchemy
+from serializers import dump
+
+db = ServiceSQLAlchemy()
 ma = Marshmallow()
 
+def utc_now():
+    """The default for the timestamps. Generating them in the application,
+    besides the server defaults, lets a new instance be dumped right after
+    the INSERT, without reading the row back. The server defaults use the
+    same clock because the connections use the UTC session time zone."""
+    # TIMESTAMP columns don't store fractional seconds
+    return datetime.utcnow().replace(microsecond=0)
+
+class utc_timestamp(FunctionElement):
+    """The current UTC date and time according to the database. Unlike a
+    timestamp bound as a parameter, it doesn't change the SQL statement, so
+    the statements that use it can be cached."""
+    type = db.TIMESTAMP()
+    name = 'utc_timestamp'
+
+@compiles(utc_timestamp)
+def compile_utc_timestamp(element, compiler, **kw):
+    # SQLite's CURRENT_TIMESTAMP is already in UTC
+    return 'CURRENT_TIMESTAMP'
+
+@compiles(utc_timestamp, 'mysql')
+def compile_mysql_utc_timestamp(element, compiler, **kw):
+    return 'UTC_TIMESTAMP()'
+
+@compiles(utc_timestamp, 'postgresql')
+def compile_postgresql_utc_timestamp(element, compiler, **kw):
+    return "(CURRENT_TIMESTAMP AT TIME ZONE 'UTC')"
+
+class add_seconds(FunctionElement):
+    """Adds a number of seconds to a timestamp in the database."""
+    type = db.TIMESTAMP()
+    name = 'add_seconds'
+
+@compiles(add_seconds)
+def compile_add_seconds(element, compiler, **kw):
+    timestamp, seconds = [compiler.process(argument, **kw)
+                          for argument in element.clauses]
+    return "datetime({0}, '+' || ({1}) || ' seconds')".format(
+        timestamp, seconds)
+
+@compiles(add_seconds, 'mysql')
+def compile_mysql_add_seconds(element, compiler, **kw):
+    timestamp, seconds = [compiler.process(argument, **kw)
+                          for argument in element.clauses]
+    return 'TIMESTAMPADD(SECOND, {1}, {0})'.format(timestamp, seconds)
+
+@compiles(add_seconds, 'postgresql')
+def compile_postgresql_add_seconds(element, compiler, **kw):
+    timestamp, seconds = [compiler.process(argument, **kw)
+                          for argument in element.clauses]
+    return "({0} + ({1}) * INTERVAL '1 second')".format(timestamp, seconds)
+
 class ResourceAddUpdateDelete:
+    # Callables that receive the names of the tables changed by each commit,
+    # so that the data cached from those tables can be invalidated
+    write_listeners = []
 
     def add(self, resource):
         db.session.add(resource)
-        return db.session.commit()
+        return self.commit()
+
+    def add_and_dump(self, resource, schema):
+        """Adds the resource and returns it dumped with the schema. The
+        resource is dumped after the INSERT, but before the commit expires
+        its attributes, so the new row doesn't have to be read back."""
+        db.session.add(resource)
+        db.session.flush()
+        dumped_resource = dump(schema, resource)
+        self.commit()
+        return dumped_resource
 
     def update(self):
-        return db.session.commit()
+        return self.commit()
 
     def delete(self, resource):
         db.session.delete(resource)
-        return db.session.commit()
+        return self.commit()
+
+    @classmethod
+    def commit(cls, changed_tables=()):
+        """Commits the session and notifies the write listeners. The tables
+        changed through statements instead of instances must be provided in
+        the changed_tables argument."""
+        session = db.session
+        session.flush()
+        changed_tables = set(changed_tables)
+        changed_tables.update(session.info.pop('changed_tables', ()))
+        result = session.commit()
+        cls.notify_write({table.name for table in changed_tables})
+        return result
+
+    @classmethod
+    def register_write_listener(cls, listener):
+        cls.write_listeners.append(listener)
+        return listener
 
-class User(db.Model, ResourceAddUpdateDelete):
+    @classmethod
+    def notify_write(cls, table_names):
+        for listener in cls.write_listeners:
+            listener(table_names)
+
+def get_changed_tables(session):
+    """Returns the tables changed by the pending instances of the session."""
+    changed_tables = {
+        instance.__table__ for instance in
+        itertools.chain(session.new, session.dirty, session.deleted)}
+    # Deleting a row also deletes the rows that reference it on cascade
+    deleted_tables = {instance.__table__ for instance in session.deleted}
+    for table in db.metadata.sorted_tables:
+        if any(foreign_key.column.table in deleted_tables
+               for foreign_key in table.foreign_keys):
+            changed_tables.add(table)
+    return changed_tables
+
+@db.event.listens_for(db.session, 'before_flush')
+def record_changed_tables(session, flush_context, instances):
+    # The flushed instances are no longer pending when the session commits
+    session.info.setdefault('changed_tables', set()).update(
+        get_changed_tables(session))
+
+@db.event.listens_for(db.session, 'after_soft_rollback')
+def forget_changed_tables(session, previous_transaction):
+    session.info.pop('changed_tables', None)
+
+class VersionedResource:
+    """Adds a version, incremented by every update, and the date of the
+    last modification to the model. The version is also checked by the
+    UPDATE statements, so concurrent modifications raise StaleDataError."""
+    version = db.Column(db.Integer, nullable=False, server_default='1')
+    modification_date = db.Column(
+        db.TIMESTAMP,
+        default=utc_now,
+        server_default=db.func.current_timestamp(),
+        onupdate=utc_timestamp(),
+        nullable=False)
+
+    @declared_attr
+    def __mapper_args__(cls):
+        return {'version_id_col': cls.version}
+
+class User(db.Model, ResourceAddUpdateDelete, VersionedResource):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(50), unique= True, nullable=False)
     password_hash = db.Column(db.String(255), nullable=False)
     creation_date = db.Column(
         db.TIMESTAMP,
+        default=utc_now,
         server_default=db.func.current_timestamp(),
         nullable=False)
 
@@ -67,11 +204,12 @@ class User(db.Model, ResourceAddUpdateDelete):
     def __init__(self, name):
         self.name = name
 
-class Notification(db.Model, ResourceAddUpdateDelete):
+class Notification(db.Model, ResourceAddUpdateDelete, VersionedResource):
     id = db.Column(db.Integer,primary_key=True)
     message = db.Column(db.String(250), unique=True, nullable=False)
     ttl = db.Column(db.Integer, nullable=False)
     creation_date = db.Column(db.TIMESTAMP,
+        default=utc_now,
         server_default=db.func.current_timestamp(),
         nullable=False)
     notification_category_id = db.Column(db.Integer,
@@ -81,9 +219,23 @@ class Notification(db.Model, ResourceAddUpdateDelete):
         backref=db.backref('notifications', lazy='dynamic',
         order_by='Notification.message'))
     displayed_times = db.Column(db.Integer, nullable=False,
-        server_default='0')
+        default=0, server_default='0')
     displayed_once = db.Column(db.Boolean, nullable=False,
-        server_default='0')
+        default=False, server_default='0')
+    # creation_date plus ttl seconds, maintained by set_expiration_date
+    expiration_date = db.Column(db.TIMESTAMP, nullable=False)
+    # Support the filters and sort orders of the notification lists. InnoDB
+    # appends the primary key to every secondary index, so they also cover
+    # the tie-breaker of the keyset pagination.
+    __table_args__ = (
+        db.Index('ix_notification_category_creation_date',
+                 'notification_category_id', 'creation_date'),
+        db.Index('ix_notification_displayed_once_creation_date',
+                 'displayed_once', 'creation_date'),
+        db.Index('ix_notification_creation_date', 'creation_date'),
+        db.Index('ix_notification_ttl', 'ttl'),
+        db.Index('ix_notification_expiration_date', 'expiration_date'),
+    )
 
     def __init__(self, message, ttl, notification_category):
         self.message = message
@@ -93,6 +245,12 @@ class Notification(db.Model, ResourceAddUpdateDelete):
     def __repr__(self):
         return '<Notification %r>' % self.message
 
+    @classmethod
+    def not_expired(cls):
+        """The condition that the notifications that can still be read
+        meet, until the reaper deletes the expired ones."""
+        return cls.expiration_date > utc_timestamp()
+
     @classmethod
     def is_message_unique(cls, id, message):
         existing_notification = cls.query.filter_by(message=message).first()
@@ -104,16 +262,74 @@ class Notification(db.Model, ResourceAddUpdateDelete):
             else:
                 return False
 
-class NotificationCategory(db.Model, ResourceAddUpdateDelete):
+@db.event.listens_for(Notification, 'before_insert')
+@db.event.listens_for(Notification, 'before_update')
+def set_expiration_date(mapper, connection, notification):
+    if notification.creation_date is None:
+        notification.creation_date = utc_now()
+    if notification.expiration_date is None or \
+            db.inspect(notification).attrs.ttl.history.has_changes():
+        notification.expiration_date = notification.creation_date + \
+            timedelta(seconds=notification.ttl)
+
+class NotificationCategory(db.Model, ResourceAddUpdateDelete,
+                           VersionedResource):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(150), unique=True, nullable=False)
 
     def __init__(self, name):
         self.name = name
+        # A new category doesn't have notifications yet
+        self._embedded_notifications = []
 
     def __repr__(self):
         return '<NotificationCategory %r>' % self.name
 
+    @property
+    def embedded_notifications(self):
+        """The first notifications of the category, as many as the
+        EMBEDDED_NOTIFICATIONS_LIMIT setting, that are embedded in the
+        category representation."""
+        if '_embedded_notifications' not in self.__dict__:
+            self._embedded_notifications = self.notifications\
+                .filter(Notification.not_expired())\
+                .limit(current_app.config['EMBEDDED_NOTIFICATIONS_LIMIT'])\
+                .all()
+        return self._embedded_notifications
+
+    @classmethod
+    def load_embedded_notifications(cls, notification_categories, limit=None):
+        """Loads the embedded notifications of all the categories with a
+        single query, numbering the notifications of each category in the
+        order of the relationship and keeping the first ones."""
+        if limit is None:
+            limit = current_app.config['EMBEDDED_NOTIFICATIONS_LIMIT']
+        embedded_notifications = {
+            notification_category.id: []
+            for notification_category in notification_categories}
+        if embedded_notifications:
+            row_number = db.func.row_number().over(
+                partition_by=Notification.notification_category_id,
+                order_by=Notification.message).label('row_number')
+            numbered_notifications = db.session\
+                .query(Notification.id, row_number)\
+                .filter(Notification.notification_category_id.in_(
+                    embedded_notifications.keys()))\
+                .filter(Notification.not_expired())\
+                .subquery()
+            notifications = Notification.query\
+                .join(numbered_notifications,
+                      Notification.id == numbered_notifications.c.id)\
+                .filter(numbered_notifications.c.row_number <= limit)\
+                .order_by(Notification.message)
+            for notification in notifications:
+                embedded_notifications[
+                    notification.notification_category_id].append(notification)
+        for notification_category in notification_categories:
+            notification_category._embedded_notifications = \
+                    embedded_notifications[notification_category.id]
+        return notification_categories
+
     @classmethod
     def is_name_unique(cls, id, name):
         existing_notification_category = cls.query.filter_by(name=name).first()
@@ -135,7 +351,13 @@ class NotificationCategorySchema(ma.Schema):
     notifications = fields.Nested(
         'NotificationSchema',
         many=True,
-        exclude=('notification_category',))
+        exclude=('notification_category',),
+        attribute='embedded_notifications',
+        dump_only=True)
+    notifications_url = ma.URLFor(
+        'service.notificationlistresource',
+        category='<id>',
+        _external=True)
 
 class NotificationSchema(ma.Schema):
     id = fields.Integer(dump_only=True)
@@ -148,6 +370,7 @@ class NotificationSchema(ma.Schema):
         required=True)
     displayed_times = fields.Integer()
     displayed_once = fields.Boolean()
+    expiration_date = fields.DateTime(dump_only=True)
     url = ma.URLFor(
         'service.notificationresource',
         id='<id>',
@@ -0,0 +1,215 @@
+"""
+This module compiles the marshmallow schemas into specialized dump functions.
+
+marshmallow dumps each object field by field through several layers of
+generic calls, and each URLFor field calls url_for for every object. The
+function generated for a schema (one for each only/exclude variant) reads the
+attributes and formats the values inline, and builds the URLs from templates
+generated with a single url_for call per endpoint and dump. The output is the
+same as schema.dump(obj, many=many).data; whenever the compiled function
+can't produce it, e.g. when a value is invalid, the dump falls back to
+marshmallow.
+"""
+import itertools
+import re
+
+from flask import current_app, url_for
+from flask_marshmallow.fields import URLFor, _tpl
+from marshmallow import fields, Schema
+from marshmallow.decorators import POST_DUMP, PRE_DUMP
+from marshmallow.utils import ensure_text_type, isoformat, missing
+
+# The placeholders of the integer URL arguments in the URL templates, big
+# enough not to appear anywhere else in the URLs
+URL_PLACEHOLDER_BASE = 7316094852000
+ISO_DATE_FORMATS = (None, 'iso', 'iso8601')
+
+# The compiled functions by schema variant, None if it can't be compiled
+_compiled_functions = {}
+_function_numbers = itertools.count()
+
+
+class URLTemplates():
+    """Builds the URLs of the URLFor fields during a dump, from templates
+    generated with a url_for call per field, in the request context of the
+    dump."""
+    def __init__(self):
+        self._templates = {}
+
+    def build(self, field, values):
+        if any(value is missing for value in values):
+            raise AttributeError(
+                'A URL attribute is missing, marshmallow reports it')
+        template = self._templates.get(field)
+        if template is None:
+            template = self._templates[field] = self.get_template(field)
+        # The placeholders only stand for the integers, formatted by str
+        if not template or any(type(value) is not int for value in values):
+            return url_for(field.endpoint, **self.get_arguments(field, values))
+        parts, positions = template
+        url = [parts[0]]
+        for position, part in zip(positions, parts[1:]):
+            url.append(str(values[position]))
+            url.append(part)
+        return ''.join(url)
+
+    def get_arguments(self, field, values):
+        values = iter(values)
+        return {name: next(values) if _tpl(str(value)) else value
+                for name, value in field.params.items()}
+
+    def get_template(self, field):
+        """Returns the constant parts of the URL and the positions of the
+        values that go between them, or None when the URL doesn't include
+        each value once."""
+        placeholders = [
+            str(URL_PLACEHOLDER_BASE + position)
+            for position in range(len(get_url_attributes(field)))]
+        url = url_for(field.endpoint, **self.get_arguments(
+            field, [int(placeholder) for placeholder in placeholders]))
+        pieces = re.split('({0})'.format('|'.join(placeholders)), url) \
+            if placeholders else [url]
+        positions = [placeholders.index(piece) for piece in pieces[1::2]]
+        if sorted(positions) != list(range(len(placeholders))):
+            return None
+        return pieces[0::2], positions
+
+
+def get_url_attributes(field):
+    """Returns the names of the attributes that a URLFor field reads."""
+    return [_tpl(str(value)) for value in field.params.values()
+            if _tpl(str(value))]
+
+def is_compilable(schema):
+    """Whether the schema dumps the fields as they are, from the attributes
+    of the objects."""
+    if schema.prefix or schema.dict_class is not dict or \
+            type(schema).get_attribute is not Schema.get_attribute:
+        return False
+    return not any(names for (tag, _), names in schema.__processors__.items()
+                   if tag in (PRE_DUMP, POST_DUMP))
+
+def get_schema_key(schema):
+    # The only, exclude and load_only options of the instances change the
+    # fields that are dumped
+    return type(schema), tuple(sorted(
+        (name, field.load_only) for name, field in schema.fields.items()))
+
+def compile_schema(schema):
+    """Returns the dump function of the schema variant, which receives an
+    object and a URLTemplates instance, or None when the schema uses
+    features that the compiled functions don't support."""
+    key = get_schema_key(schema)
+    if key in _compiled_functions:
+        return _compiled_functions[key]
+    # Stops the recursion of schemas that nest themselves
+    _compiled_functions[key] = None
+    if is_compilable(schema):
+        _compiled_functions[key] = generate_function(schema)
+    return _compiled_functions[key]
+
+def generate_function(schema):
+    function_name = 'dump_{0}_{1}'.format(
+        type(schema).__name__, next(_function_numbers))
+    namespace = {
+        'missing': missing,
+        'ensure_text_type': ensure_text_type,
+        'isoformat': isoformat
+    }
+    # marshmallow reads the items of the mappings (and of anything else
+    # that has items) before their attributes, which is left to it
+    lines = ['def {0}(obj, urls):'.format(function_name),
+             "    if hasattr(type(obj), '__getitem__'):",
+             "        raise TypeError('Dumped by marshmallow')",
+             '    result = {}']
+    for number, (name, field) in enumerate(schema.fields.items()):
+        if field.load_only:
+            continue
+        key = field.dump_to or name
+        field_name = 'field_{0}'.format(number)
+        namespace[field_name] = field
+        if type(field) is URLFor:
+            attributes = get_url_attributes(field)
+            if any('.' in attribute for attribute in attributes):
+                return None
+            for position, attribute in enumerate(attributes):
+                lines.extend(get_attribute_lines(attribute))
+                lines.append('    {0}_{1} = value'.format(
+                    field_name, position))
+            lines.append('    result[{0!r}] = urls.build({1}, ({2}))'.format(
+                key, field_name, ''.join(
+                    '{0}_{1}, '.format(field_name, position)
+                    for position in range(len(attributes)))))
+            continue
+        attribute = field.attribute or name
+        expression = get_field_expression(field, field_name, namespace)
+        if expression is None or callable(field.default) or \
+                '.' in attribute:
+            return None
+        default_name = 'default_{0}'.format(number)
+        namespace[default_name] = field.default
+        lines.extend(get_attribute_lines(attribute))
+        lines.extend([
+            '    if value is not missing:',
+            '        result[{0!r}] = {1}'.format(key, expression),
+            '    elif {0} is not missing:'.format(default_name),
+            '        result[{0!r}] = {1}'.format(key, default_name)])
+    lines.append('    return result')
+    exec('\n'.join(lines), namespace)
+    return namespace[function_name]
+
+def get_attribute_lines(attribute):
+    """Returns the lines that read an attribute like marshmallow does."""
+    return ['    value = getattr(obj, {0!r}, missing)'.format(attribute),
+            '    if callable(value):',
+            '        value = value()']
+
+def get_field_expression(field, field_name, namespace):
+    """Returns the expression that formats the value of the field like its
+    _serialize method, or None when the field isn't supported."""
+    field_type = type(field)
+    if field_type is fields.Integer and not field.as_string:
+        return 'None if value is None else int(value)'
+    if field_type is fields.String:
+        return 'value if type(value) is str else ' \
+               'None if value is None else ensure_text_type(value)'
+    if field_type is fields.Boolean:
+        return ('value if type(value) is bool else '
+                'None if value is None else '
+                'True if value in {0}.truthy else '
+                'False if value in {0}.falsy else '
+                'bool(value)').format(field_name)
+    if field_type is fields.DateTime and not field.localtime and \
+            field.dateformat in ISO_DATE_FORMATS:
+        return 'None if value is None else isoformat(value)'
+    if field_type is fields.Nested and not isinstance(field.only, str):
+        nested_function = compile_schema(field.schema)
+        if nested_function is None:
+            return None
+        nested_name = '{0}_dump'.format(field_name)
+        namespace[nested_name] = nested_function
+        if field.many:
+            return 'None if value is None else ' \
+                   '[{0}(item, urls) for item in value]'.format(nested_name)
+        return 'None if value is None else {0}(value, urls)'.format(
+            nested_name)
+    return None
+
+def dump(schema, obj, many=None):
+    """Returns the same as schema.dump(obj, many=many).data, through the
+    compiled function of the schema unless the COMPILED_SERIALIZERS setting
+    is disabled."""
+    many = schema.many if many is None else many
+    function = None
+    if current_app.config.get('COMPILED_SERIALIZERS', True):
+        function = compile_schema(schema)
+    if function is not None:
+        urls = URLTemplates()
+        try:
+            if many:
+                return [function(item, urls) for item in obj]
+            return function(obj, urls)
+        except (TypeError, ValueError, AttributeError):
+            # marshmallow reports the invalid values (or raises the error)
+            pass
+    return schema.dump(obj, many=many).data
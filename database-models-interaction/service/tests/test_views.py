@@ -2,10 +2,21 @@
 This module contains code that tests the API using pytest module.
 """
 import pytest
+import time
 from base64 import b64encode
+from contextlib import contextmanager
+from datetime import timedelta
+from sqlalchemy import event, text
+from caching import LRUCacheBackend
+from expiry import delete_expired_notifications
+from helpers import ESTIMATED_COUNT_QUERIES
 from http_status import HttpStatus
 from flask import current_app, json, url_for
-from models import db, NotificationCategory, Notification, User
+from models import db, NotificationCategory, NotificationCategorySchema, \
+        Notification, NotificationSchema, User, UserSchema
+from serializers import URLTemplates, compile_schema, dump
+from views import credential_cache, count_cache, response_cache, \
+        display_counter_buffer
 
 TEST_USER_NAME = 'testuser'
 TEST_USER_PASS = 'T3stP4ss#'
@@ -23,6 +34,34 @@ def get_authentication_headers(username, password):
         b64encode((username + ':' + password).encode('utf-8')).decode('utf-8')
     return authentication_headers
 
+def get_token_authentication_headers(token):
+    authentication_headers = get_accept_content_type_headers()
+    authentication_headers['Authorization'] = 'Bearer ' + token
+    return authentication_headers
+
+@contextmanager
+def assert_num_queries(expected_count):
+    """
+    Ensure the code run within the context executes exactly the expected
+    number of SQL statements.
+    """
+    statements = []
+    def record_statement(conn, cursor, statement, *args):
+        statements.append(statement)
+    event.listen(db.engine, 'before_cursor_execute', record_statement)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record_statement)
+    assert len(statements) == expected_count, '\n'.join(statements)
+
+def get_token(client, username, password):
+    url = url_for('service.tokenresource', _external=True)
+    response = client.post(
+        url,
+        headers=get_authentication_headers(username, password))
+    return json.loads(response.get_data(as_text=True))['token']
+
 def create_user(client, name, password):
     url = url_for('service.userlistresource', _external=True)
     data = {'name': name, 'password': password}
@@ -365,3 +404,1348 @@ def test_update_notification(client):
 
     get_response_data = json.loads(get_response.get_data(as_text=True))
     assert get_response_data['displayed_times'] == new_displayed_times
+
+def test_verified_credentials_are_cached(client):
+    """
+    Ensure repeated requests with the same credentials are served from the
+    credential cache instead of verifying the password hash again
+    """
+    create_user_response = create_user(client, TEST_USER_NAME, TEST_USER_PASS)
+    assert create_user_response.status_code == HttpStatus.created_201.value
+
+    url = url_for('service.notificationlistresource', _external=True)
+    for _ in range(3):
+        get_response = client.get(
+            url,
+            headers=get_authentication_headers(TEST_USER_NAME, TEST_USER_PASS))
+        assert get_response.status_code == HttpStatus.ok_200.value
+    assert credential_cache.stats()['misses'] == 1
+    assert credential_cache.stats()['hits'] == 2
+
+    wrong_password_response = client.get(
+        url,
+        headers=get_authentication_headers(TEST_USER_NAME, 'Wr0ngP4ss#'))
+    assert wrong_password_response.status_code == \
+        HttpStatus.unauthorized_401.value
+    assert credential_cache.stats()['size'] == 1
+
+def test_password_change_invalidates_cached_credentials(client):
+    """
+    Ensure cached credentials stop being accepted once the password changes
+    """
+    create_user_response = create_user(client, TEST_USER_NAME, TEST_USER_PASS)
+    assert create_user_response.status_code == HttpStatus.created_201.value
+
+    url = url_for('service.notificationlistresource', _external=True)
+    get_response = client.get(
+        url,
+        headers=get_authentication_headers(TEST_USER_NAME, TEST_USER_PASS))
+    assert get_response.status_code == HttpStatus.ok_200.value
+
+    new_password = 'N3wT3stP4ss#'
+    user = User.query.filter_by(name=TEST_USER_NAME).first()
+    error_message, password_ok = user.check_password_strength_and_hash_if_ok(
+        new_password)
+    assert password_ok
+    user.update()
+
+    old_password_response = client.get(
+        url,
+        headers=get_authentication_headers(TEST_USER_NAME, TEST_USER_PASS))
+    assert old_password_response.status_code == \
+        HttpStatus.unauthorized_401.value
+    new_password_response = client.get(
+        url,
+        headers=get_authentication_headers(TEST_USER_NAME, new_password))
+    assert new_password_response.status_code == HttpStatus.ok_200.value
+
+def test_create_token_and_authenticate_with_it(client):
+    """
+    Ensure we can exchange the user credentials for a bearer token and then
+    use the token to access the resources that require authentication
+    """
+    create_user_response = create_user(client, TEST_USER_NAME, TEST_USER_PASS)
+    assert create_user_response.status_code == HttpStatus.created_201.value
+
+    url = url_for('service.tokenresource', _external=True)
+    post_response = client.post(
+        url,
+        headers=get_authentication_headers(TEST_USER_NAME, TEST_USER_PASS))
+    assert post_response.status_code == HttpStatus.created_201.value
+    post_response_data = json.loads(post_response.get_data(as_text=True))
+    assert post_response_data['duration'] == \
+        current_app.config['TOKEN_EXPIRATION_SECONDS']
+    token = post_response_data['token']
+
+    for resource in ('service.notificationlistresource',
+                     'service.notificationcategorylistresource'):
+        get_response = client.get(
+            url_for(resource, _external=True),
+            headers=get_token_authentication_headers(token))
+        assert get_response.status_code == HttpStatus.ok_200.value
+
+    invalid_token_response = client.get(
+        url_for('service.notificationlistresource', _external=True),
+        headers=get_token_authentication_headers(token + 'x'))
+    assert invalid_token_response.status_code == \
+        HttpStatus.unauthorized_401.value
+
+def test_create_token_requires_credentials(client):
+    """
+    Ensure we cannot obtain a token without valid credentials or by
+    presenting another token
+    """
+    create_user_response = create_user(client, TEST_USER_NAME, TEST_USER_PASS)
+    assert create_user_response.status_code == HttpStatus.created_201.value
+
+    url = url_for('service.tokenresource', _external=True)
+    post_response = client.post(
+        url,
+        headers=get_authentication_headers(TEST_USER_NAME, 'Wr0ngP4ss#'))
+    assert post_response.status_code == HttpStatus.unauthorized_401.value
+
+    token_response = client.post(
+        url,
+        headers=get_authentication_headers(TEST_USER_NAME, TEST_USER_PASS))
+    token = json.loads(token_response.get_data(as_text=True))['token']
+    renew_response = client.post(
+        url,
+        headers=get_token_authentication_headers(token))
+    assert renew_response.status_code == HttpStatus.unauthorized_401.value
+
+def test_retrieve_notifications_list_with_cursor(client):
+    """
+    Ensure we can walk the notifications list forwards and backwards with
+    the keyset pagination cursors and a custom page size
+    """
+    create_user_response = create_user(client, TEST_USER_NAME, TEST_USER_PASS)
+    assert create_user_response.status_code == HttpStatus.created_201.value
+
+    messages = ['Cursor notification number {0}'.format(i) for i in range(5)]
+    for message in messages:
+        post_response = create_notification(client, message, 15, 'Information')
+        assert post_response.status_code == HttpStatus.created_201.value
+
+    headers = get_authentication_headers(TEST_USER_NAME, TEST_USER_PASS)
+    first_page_response = client.get(
+        url_for('service.notificationlistresource', cursor='', page_size=2),
+        headers=headers)
+    assert first_page_response.status_code == HttpStatus.ok_200.value
+    first_page_data = json.loads(first_page_response.get_data(as_text=True))
+    assert [n['message'] for n in first_page_data['results']] == messages[:2]
+    assert first_page_data['previous'] is None
+    assert 'count' not in first_page_data
+
+    second_page_data = json.loads(client.get(
+        first_page_data['next'], headers=headers).get_data(as_text=True))
+    assert [n['message'] for n in second_page_data['results']] == \
+        messages[2:4]
+
+    third_page_data = json.loads(client.get(
+        second_page_data['next'], headers=headers).get_data(as_text=True))
+    assert [n['message'] for n in third_page_data['results']] == messages[4:]
+    assert third_page_data['next'] is None
+
+    previous_page_data = json.loads(client.get(
+        third_page_data['previous'], headers=headers).get_data(as_text=True))
+    assert [n['message'] for n in previous_page_data['results']] == \
+        messages[2:4]
+    assert previous_page_data['previous'] is not None
+    assert previous_page_data['next'] is not None
+
+    invalid_cursor_response = client.get(
+        url_for('service.notificationlistresource', cursor='invalid'),
+        headers=headers)
+    assert invalid_cursor_response.status_code == \
+        HttpStatus.bad_request_400.value
+
+def test_retrieve_notifications_list_with_page_size(client):
+    """
+    Ensure the clients can choose the page size up to the configured maximum
+    """
+    create_user_response = create_user(client, TEST_USER_NAME, TEST_USER_PASS)
+    assert create_user_response.status_code == HttpStatus.created_201.value
+
+    for i in range(6):
+        post_response = create_notification(
+            client, 'Page size notification number {0}'.format(i), 15, 'Error')
+        assert post_response.status_code == HttpStatus.created_201.value
+
+    current_app.config['PAGINATION_MAX_PAGE_SIZE'] = 5
+    get_response = client.get(
+        url_for('service.notificationlistresource', page_size=50),
+        headers=get_authentication_headers(TEST_USER_NAME, TEST_USER_PASS))
+    get_response_data = json.loads(get_response.get_data(as_text=True))
+    assert len(get_response_data['results']) == 5
+    assert get_response_data['count'] == 6
+
+    next_page_response = client.get(
+        get_response_data['next'],
+        headers=get_authentication_headers(TEST_USER_NAME, TEST_USER_PASS))
+    next_page_response_data = json.loads(
+        next_page_response.get_data(as_text=True))
+    assert len(next_page_response_data['results']) == 1
+    assert next_page_response_data['next'] is None
+
+def test_retrieve_notifications_list_with_cached_count(client):
+    """
+    Ensure the cached count is reused between pages and invalidated by the
+    writes committed through the models
+    """
+    create_user_response = create_user(client, TEST_USER_NAME, TEST_USER_PASS)
+    assert create_user_response.status_code == HttpStatus.created_201.value
+    current_app.config['PAGINATION_COUNT_STRATEGY'] = 'cached'
+    # Cached pages would hide whether the count itself was cached
+    current_app.config['RESPONSE_CACHE_ENABLED'] = False
+
+    url = url_for('service.notificationlistresource', _external=True)
+    headers = get_authentication_headers(TEST_USER_NAME, TEST_USER_PASS)
+    post_response = create_notification(
+        client, 'The cached count notification', 15, 'Information')
+    assert post_response.status_code == HttpStatus.created_201.value
+    get_response_data = json.loads(
+        client.get(url, headers=headers).get_data(as_text=True))
+    assert get_response_data['count'] == 1
+
+    # Writes that bypass the models are not seen until the count expires
+    db.session.execute(Notification.__table__.delete())
+    db.session.commit()
+    get_response_data = json.loads(
+        client.get(url, headers=headers).get_data(as_text=True))
+    assert get_response_data['count'] == 1
+    assert count_cache.stats()['hits'] == 1
+
+    post_response = create_notification(
+        client, 'Another cached count notification', 15, 'Information')
+    assert post_response.status_code == HttpStatus.created_201.value
+    get_response_data = json.loads(
+        client.get(url, headers=headers).get_data(as_text=True))
+    assert get_response_data['count'] == 1
+    assert len(get_response_data['results']) == 1
+
+def test_retrieve_notifications_list_without_count(client):
+    """
+    Ensure the count can be omitted from the paginated responses
+    """
+    create_user_response = create_user(client, TEST_USER_NAME, TEST_USER_PASS)
+    assert create_user_response.status_code == HttpStatus.created_201.value
+    current_app.config['PAGINATION_COUNT_STRATEGY'] = 'none'
+
+    for i in range(5):
+        post_response = create_notification(
+            client, 'Uncounted notification number {0}'.format(i), 15, 'Error')
+        assert post_response.status_code == HttpStatus.created_201.value
+    get_response = client.get(
+        url_for('service.notificationlistresource', _external=True),
+        headers=get_authentication_headers(TEST_USER_NAME, TEST_USER_PASS))
+    get_response_data = json.loads(get_response.get_data(as_text=True))
+    assert 'count' not in get_response_data
+    assert len(get_response_data['results']) == 4
+    assert get_response_data['next'] is not None
+
+def test_retrieve_notifications_list_with_estimated_count(client,
+                                                          monkeypatch):
+    """
+    Ensure the estimated count reads the table statistics even though the
+    list excludes the expired notifications, and falls back to the exact
+    count for the filtered lists
+    """
+    create_user_response = create_user(client, TEST_USER_NAME, TEST_USER_PASS)
+    assert create_user_response.status_code == HttpStatus.created_201.value
+    current_app.config['PAGINATION_COUNT_STRATEGY'] = 'estimated'
+    # SQLite has no table statistics, stand in for them
+    monkeypatch.setitem(
+        ESTIMATED_COUNT_QUERIES, 'sqlite',
+        text("SELECT 1000 WHERE :table = 'notification'"))
+    for i in range(5):
+        post_response = create_notification(
+            client, 'Estimated notification number {0}'.format(i), 15,
+            'Error' if i else 'Warning')
+        assert post_response.status_code == HttpStatus.created_201.value
+    headers = get_authentication_headers(TEST_USER_NAME, TEST_USER_PASS)
+    get_response_data = json.loads(client.get(
+        url_for('service.notificationlistresource', _external=True),
+        headers=headers).get_data(as_text=True))
+    assert get_response_data['count'] == 1000
+    get_response_data = json.loads(client.get(
+        url_for('service.notificationlistresource', category=2,
+                _external=True),
+        headers=headers).get_data(as_text=True))
+    assert get_response_data['count'] == 4
+
+def test_notifications_are_dumped_without_lazy_loading(client):
+    """
+    Ensure the notifications list and detail load the nested notification
+    categories along with the notifications instead of once per row
+    """
+    create_user_response = create_user(client, TEST_USER_NAME, TEST_USER_PASS)
+    assert create_user_response.status_code == HttpStatus.created_201.value
+    for i in range(4):
+        post_response = create_notification(
+            client,
+            'Eager loading notification number {0}'.format(i),
+            15,
+            'Category number {0}'.format(i))
+        assert post_response.status_code == HttpStatus.created_201.value
+    headers = get_token_authentication_headers(
+        get_token(client, TEST_USER_NAME, TEST_USER_PASS))
+    db.session.remove()
+
+    # One query for the page and another one for the count
+    current_app.config['RESPONSE_CACHE_ENABLED'] = False
+    with assert_num_queries(2):
+        get_response = client.get(
+            url_for('service.notificationlistresource', _external=True),
+            headers=headers)
+    get_response_data = json.loads(get_response.get_data(as_text=True))
+    assert [n['notification_category']['name']
+            for n in get_response_data['results']] == \
+        ['Category number {0}'.format(i) for i in range(4)]
+
+    with assert_num_queries(1):
+        get_response = client.get(
+            get_response_data['results'][0]['url'],
+            headers=headers)
+    assert get_response.status_code == HttpStatus.ok_200.value
+
+def test_notification_categories_embed_a_bounded_number_of_notifications(
+        client):
+    """
+    Ensure the notification categories embed their first notifications,
+    loaded with a single query, and link to the rest of them
+    """
+    create_user_response = create_user(client, TEST_USER_NAME, TEST_USER_PASS)
+    assert create_user_response.status_code == HttpStatus.created_201.value
+    limit = current_app.config['EMBEDDED_NOTIFICATIONS_LIMIT']
+    messages = ['Embedded notification number {0}'.format(i)
+                for i in range(limit + 2)]
+    for message in messages:
+        post_response = create_notification(client, message, 15, 'Information')
+        assert post_response.status_code == HttpStatus.created_201.value
+    post_response = create_notification(
+        client, 'The only warning notification', 15, 'Warning')
+    assert post_response.status_code == HttpStatus.created_201.value
+    headers = get_token_authentication_headers(
+        get_token(client, TEST_USER_NAME, TEST_USER_PASS))
+
+    # One query for the categories and another one for their notifications
+    with assert_num_queries(2):
+        get_response = client.get(
+            url_for('service.notificationcategorylistresource',
+                    _external=True),
+            headers=headers)
+    assert get_response.status_code == HttpStatus.ok_200.value
+    information, warning = json.loads(get_response.get_data(as_text=True))
+    assert [n['message'] for n in information['notifications']] == \
+        messages[:limit]
+    assert [n['message'] for n in warning['notifications']] == \
+        ['The only warning notification']
+
+    notifications_response = client.get(
+        information['notifications_url'] + '&page_size=10',
+        headers=headers)
+    notifications_response_data = json.loads(
+        notifications_response.get_data(as_text=True))
+    assert notifications_response_data['count'] == len(messages)
+    assert sorted(n['message'] for n in
+                  notifications_response_data['results']) == messages
+
+def test_bulk_create_notifications(client):
+    """
+    Ensure we can create many notifications with a single request that
+    reports a result for each item and rejects the invalid ones
+    """
+    create_user_response = create_user(client, TEST_USER_NAME, TEST_USER_PASS)
+    assert create_user_response.status_code == HttpStatus.created_201.value
+    post_response = create_notification(
+        client, 'An existing notification', 15, 'Information')
+    assert post_response.status_code == HttpStatus.created_201.value
+    headers = get_token_authentication_headers(
+        get_token(client, TEST_USER_NAME, TEST_USER_PASS))
+
+    data = [
+        {'message': 'First bulk notification', 'ttl': 10,
+         'notification_category': 'Information'},
+        {'message': 'Second bulk notification', 'ttl': 20,
+         'notification_category': 'Bulk'},
+        {'message': 'An existing notification', 'ttl': 30,
+         'notification_category': 'Information'},
+        {'message': 'First bulk notification', 'ttl': 40,
+         'notification_category': 'Bulk'},
+        {'message': 'No category', 'ttl': 50},
+    ]
+    # Check the messages, resolve the categories, insert the new category
+    # and the notifications and read them back
+    with assert_num_queries(5):
+        post_response = client.post(
+            url_for('service.notificationbulkresource', _external=True),
+            headers=headers,
+            data=json.dumps(data))
+    assert post_response.status_code == HttpStatus.multi_status_207.value
+    post_response_data = json.loads(post_response.get_data(as_text=True))
+    assert post_response_data['created'] == 2
+    assert post_response_data['rejected'] == 3
+    assert [result['status'] for result in post_response_data['results']] == \
+        [201, 201, 400, 400, 400]
+    second_notification = post_response_data['results'][1]['notification']
+    assert second_notification['notification_category']['name'] == 'Bulk'
+    assert Notification.query.count() == 3
+    assert NotificationCategory.query.count() == 2
+
+    get_response = client.get(second_notification['url'], headers=headers)
+    assert get_response.status_code == HttpStatus.ok_200.value
+
+def test_bulk_create_notifications_from_ndjson(client):
+    """
+    Ensure we can create many notifications from newline delimited JSON
+    """
+    create_user_response = create_user(client, TEST_USER_NAME, TEST_USER_PASS)
+    assert create_user_response.status_code == HttpStatus.created_201.value
+    headers = get_token_authentication_headers(
+        get_token(client, TEST_USER_NAME, TEST_USER_PASS))
+    headers['Content-Type'] = 'application/x-ndjson'
+
+    lines = [
+        json.dumps({'message': 'First NDJSON notification', 'ttl': 10,
+                    'notification_category': 'Information'}),
+        '{"message": "Broken',
+        json.dumps({'message': 'Second NDJSON notification', 'ttl': 20,
+                    'notification_category': 'Information'}),
+    ]
+    post_response = client.post(
+        url_for('service.notificationbulkresource', _external=True),
+        headers=headers,
+        data='\n'.join(lines))
+    assert post_response.status_code == HttpStatus.multi_status_207.value
+    post_response_data = json.loads(post_response.get_data(as_text=True))
+    assert [result['status'] for result in post_response_data['results']] == \
+        [201, 400, 201]
+    assert Notification.query.count() == 2
+
+def test_bulk_update_and_delete_notifications(client):
+    """
+    Ensure we can update and delete the notifications selected by their ids
+    or by a filter with a single statement each
+    """
+    create_user_response = create_user(client, TEST_USER_NAME, TEST_USER_PASS)
+    assert create_user_response.status_code == HttpStatus.created_201.value
+    ids = []
+    for i, category in enumerate(['Information', 'Information', 'Error']):
+        post_response = create_notification(
+            client, 'Bulk change notification number {0}'.format(i), 15,
+            category)
+        ids.append(json.loads(post_response.get_data(as_text=True))['id'])
+    information_id = NotificationCategory.query\
+        .filter_by(name='Information').first().id
+    headers = get_token_authentication_headers(
+        get_token(client, TEST_USER_NAME, TEST_USER_PASS))
+    url = url_for('service.notificationbulkresource', _external=True)
+
+    with assert_num_queries(1):
+        patch_response = client.patch(
+            url,
+            headers=headers,
+            data=json.dumps({
+                'selection': {'category': information_id},
+                'changes': {'displayed_once': True, 'displayed_times': 3}}))
+    assert patch_response.status_code == HttpStatus.ok_200.value
+    assert json.loads(patch_response.get_data(as_text=True))['affected'] == 2
+    assert Notification.query.filter_by(displayed_once=True).count() == 2
+
+    invalid_response = client.patch(
+        url,
+        headers=headers,
+        data=json.dumps({'selection': {}, 'changes': {'ttl': 'long'}}))
+    assert invalid_response.status_code == HttpStatus.bad_request_400.value
+    invalid_response_data = json.loads(
+        invalid_response.get_data(as_text=True))
+    assert 'selection' in invalid_response_data
+    assert 'changes' in invalid_response_data
+    for invalid_body in (['selection', 'changes'], 'selection',
+                         {'selection': [information_id], 'changes': {}},
+                         {'selection': {'ids': ids}, 'changes': 'ttl'}):
+        invalid_response = client.patch(
+            url, headers=headers, data=json.dumps(invalid_body))
+        assert invalid_response.status_code == \
+            HttpStatus.bad_request_400.value
+    for invalid_body in ([ids[0]], 'selection', {'selection': 'ids'}):
+        invalid_response = client.delete(
+            url, headers=headers, data=json.dumps(invalid_body))
+        assert invalid_response.status_code == \
+            HttpStatus.bad_request_400.value
+
+    with assert_num_queries(1):
+        delete_response = client.delete(
+            url,
+            headers=headers,
+            data=json.dumps({
+                'selection': {'ids': ids[1:], 'displayed_once': True}}))
+    assert delete_response.status_code == HttpStatus.ok_200.value
+    assert json.loads(delete_response.get_data(as_text=True))['affected'] == 1
+    assert [n.id for n in Notification.query.order_by(Notification.id)] == \
+        [ids[0], ids[2]]
+
+def test_conditional_requests_for_notifications(client):
+    """
+    Ensure the notifications include ETag and Last-Modified headers, the
+    conditional GET requests are answered with 304 while the representation
+    doesn't change and If-Match prevents lost updates
+    """
+    create_user_response = create_user(client, TEST_USER_NAME, TEST_USER_PASS)
+    assert create_user_response.status_code == HttpStatus.created_201.value
+    post_response = create_notification(
+        client, 'A conditional notification', 15, 'Information')
+    assert post_response.status_code == HttpStatus.created_201.value
+    post_response_data = json.loads(post_response.get_data(as_text=True))
+    url = post_response_data['url']
+    headers = get_token_authentication_headers(
+        get_token(client, TEST_USER_NAME, TEST_USER_PASS))
+
+    get_response = client.get(url, headers=headers)
+    assert get_response.status_code == HttpStatus.ok_200.value
+    etag = get_response.headers['ETag']
+    last_modified = get_response.headers['Last-Modified']
+
+    not_modified_response = client.get(
+        url, headers=dict(headers, **{'If-None-Match': etag}))
+    assert not_modified_response.status_code == \
+        HttpStatus.not_modified_304.value
+    assert not_modified_response.get_data() == b''
+    assert not_modified_response.headers['ETag'] == etag
+    not_modified_response = client.get(
+        url, headers=dict(headers, **{'If-Modified-Since': last_modified}))
+    assert not_modified_response.status_code == \
+        HttpStatus.not_modified_304.value
+
+    patch_response = client.patch(
+        url,
+        headers=dict(headers, **{'If-Match': etag}),
+        data=json.dumps({'displayed_times': 1}))
+    assert patch_response.status_code == HttpStatus.ok_200.value
+    new_etag = patch_response.headers['ETag']
+    assert new_etag != etag
+
+    stale_patch_response = client.patch(
+        url,
+        headers=dict(headers, **{'If-Match': etag}),
+        data=json.dumps({'displayed_times': 2}))
+    assert stale_patch_response.status_code == \
+        HttpStatus.precondition_failed_412.value
+    modified_response = client.get(
+        url, headers=dict(headers, **{'If-None-Match': etag}))
+    assert modified_response.status_code == HttpStatus.ok_200.value
+    assert json.loads(
+        modified_response.get_data(as_text=True))['displayed_times'] == 1
+
+    # Renaming the category changes the representation of the notification
+    category_url = post_response_data['notification_category']['url']
+    category_patch_response = client.patch(
+        category_url,
+        headers=headers,
+        data=json.dumps({'name': 'Information renamed'}))
+    assert category_patch_response.status_code == HttpStatus.ok_200.value
+    renamed_response = client.get(
+        url, headers=dict(headers, **{'If-None-Match': new_etag}))
+    assert renamed_response.status_code == HttpStatus.ok_200.value
+
+    stale_delete_response = client.delete(
+        url, headers=dict(headers, **{'If-Match': etag}))
+    assert stale_delete_response.status_code == \
+        HttpStatus.precondition_failed_412.value
+    current_etag = renamed_response.headers['ETag']
+    delete_response = client.delete(
+        url, headers=dict(headers, **{'If-Match': current_etag}))
+    assert delete_response.status_code == HttpStatus.no_content_204.value
+    assert Notification.query.count() == 0
+
+def test_conditional_requests_for_lists(client):
+    """
+    Ensure the lists include an ETag and are answered with 304 while they
+    don't change
+    """
+    create_user_response = create_user(client, TEST_USER_NAME, TEST_USER_PASS)
+    assert create_user_response.status_code == HttpStatus.created_201.value
+    post_response = create_notification(
+        client, 'A listed conditional notification', 15, 'Information')
+    assert post_response.status_code == HttpStatus.created_201.value
+    headers = get_token_authentication_headers(
+        get_token(client, TEST_USER_NAME, TEST_USER_PASS))
+
+    etags = {}
+    for resource in ('service.notificationlistresource',
+                     'service.notificationcategorylistresource',
+                     'service.userlistresource'):
+        url = url_for(resource, _external=True)
+        get_response = client.get(url, headers=headers)
+        assert get_response.status_code == HttpStatus.ok_200.value
+        etag = etags[resource] = get_response.headers['ETag']
+        not_modified_response = client.get(
+            url, headers=dict(headers, **{'If-None-Match': etag}))
+        assert not_modified_response.status_code == \
+            HttpStatus.not_modified_304.value
+
+    post_response = create_notification(
+        client, 'Another listed conditional notification', 15, 'Information')
+    etag = etags['service.notificationlistresource']
+    modified_response = client.get(
+        url_for('service.notificationlistresource', _external=True),
+        headers=dict(headers, **{'If-None-Match': etag}))
+    assert modified_response.status_code == HttpStatus.ok_200.value
+
+def test_responses_are_cached_until_a_write(client):
+    """
+    Ensure the GET responses are served from the response cache until a
+    write, including a bulk one, changes the tables they depend on
+    """
+    create_user_response = create_user(client, TEST_USER_NAME, TEST_USER_PASS)
+    assert create_user_response.status_code == HttpStatus.created_201.value
+    post_response = create_notification(
+        client, 'A cached notification', 15, 'Information')
+    assert post_response.status_code == HttpStatus.created_201.value
+    headers = get_token_authentication_headers(
+        get_token(client, TEST_USER_NAME, TEST_USER_PASS))
+    url = url_for('service.notificationlistresource', _external=True)
+
+    first_response = client.get(url, headers=headers)
+    with assert_num_queries(0):
+        second_response = client.get(url, headers=headers)
+    assert second_response.get_data() == first_response.get_data()
+    assert second_response.headers['ETag'] == first_response.headers['ETag']
+    assert response_cache.stats()['hits'] == 1
+    assert response_cache.stats()['misses'] == 1
+    assert response_cache.stats()['hit_ratio'] == 0.5
+
+    # A different representation or query is cached separately
+    client.get(url_for('service.notificationlistresource', page=2,
+                       _external=True), headers=headers)
+    assert response_cache.stats()['misses'] == 2
+
+    patch_response = client.patch(
+        url_for('service.notificationbulkresource', _external=True),
+        headers=headers,
+        data=json.dumps({
+            'selection': {'displayed_once': False},
+            'changes': {'displayed_once': True}}))
+    assert patch_response.status_code == HttpStatus.ok_200.value
+    get_response_data = json.loads(
+        client.get(url, headers=headers).get_data(as_text=True))
+    assert get_response_data['results'][0]['displayed_once'] is True
+
+    # Renaming the category changes the nested category of the notifications
+    category_url = get_response_data['results'][0]['notification_category']\
+        ['url']
+    client.patch(
+        category_url,
+        headers=headers,
+        data=json.dumps({'name': 'Information renamed'}))
+    get_response_data = json.loads(
+        client.get(url, headers=headers).get_data(as_text=True))
+    assert get_response_data['results'][0]['notification_category']\
+        ['name'] == 'Information renamed'
+
+def test_cached_responses_expire_with_their_notifications(client):
+    """
+    Ensure the cached responses that include a notification stop being
+    served when it expires, without any write
+    """
+    create_user_response = create_user(client, TEST_USER_NAME, TEST_USER_PASS)
+    assert create_user_response.status_code == HttpStatus.created_201.value
+    create_notification(client, 'A lasting notification', 3600, 'Information')
+    post_response = create_notification(
+        client, 'A fleeting notification', 1, 'Information')
+    post_response_data = json.loads(post_response.get_data(as_text=True))
+    headers = get_token_authentication_headers(
+        get_token(client, TEST_USER_NAME, TEST_USER_PASS))
+    urls = [
+        post_response_data['url'],
+        url_for('service.notificationlistresource', _external=True),
+        post_response_data['notification_category']['url'],
+        url_for('service.notificationcategorylistresource', _external=True)]
+    for url in urls:
+        assert client.get(url, headers=headers).status_code == \
+            HttpStatus.ok_200.value
+    with assert_num_queries(0):
+        for url in urls:
+            client.get(url, headers=headers)
+
+    time.sleep(2.5)
+    get_response = client.get(urls[0], headers=headers)
+    assert get_response.status_code == HttpStatus.not_found_404.value
+    list_response_data = json.loads(
+        client.get(urls[1], headers=headers).get_data(as_text=True))
+    assert list_response_data['count'] == 1
+    assert [notification['message'] for notification in
+            list_response_data['results']] == ['A lasting notification']
+    category_response_data = json.loads(
+        client.get(urls[2], headers=headers).get_data(as_text=True))
+    assert [notification['message'] for notification in
+            category_response_data['notifications']] == \
+        ['A lasting notification']
+    categories_response_data = json.loads(
+        client.get(urls[3], headers=headers).get_data(as_text=True))
+    assert len(categories_response_data[0]['notifications']) == 1
+
+def test_cached_responses_expire_after_the_ttl(client):
+    """
+    Ensure the cached responses stop being served after RESPONSE_CACHE_TTL
+    seconds, even though the writes of another process didn't invalidate
+    them
+    """
+    current_app.config['RESPONSE_CACHE_TTL'] = 1
+    create_user_response = create_user(client, TEST_USER_NAME, TEST_USER_PASS)
+    assert create_user_response.status_code == HttpStatus.created_201.value
+    create_notification(client, 'A cached notification', 3600, 'Information')
+    headers = get_token_authentication_headers(
+        get_token(client, TEST_USER_NAME, TEST_USER_PASS))
+    url = url_for('service.notificationlistresource', _external=True)
+    assert client.get(url, headers=headers).status_code == \
+        HttpStatus.ok_200.value
+
+    # Another process changes the notification without invalidating the
+    # cache of this one
+    db.session.execute(
+        text("UPDATE notification SET message = 'Changed elsewhere'"))
+    db.session.commit()
+    get_response_data = json.loads(
+        client.get(url, headers=headers).get_data(as_text=True))
+    assert get_response_data['results'][0]['message'] == \
+        'A cached notification'
+
+    time.sleep(1.5)
+    get_response_data = json.loads(
+        client.get(url, headers=headers).get_data(as_text=True))
+    assert get_response_data['results'][0]['message'] == 'Changed elsewhere'
+
+def test_response_cache_reads_the_generations_before_the_first_query(client):
+    """
+    Ensure a response isn't cached under the generations incremented by a
+    write committed after the first query of the request, since the rows it
+    reads may not include the write
+    """
+    create_user_response = create_user(client, TEST_USER_NAME, TEST_USER_PASS)
+    assert create_user_response.status_code == HttpStatus.created_201.value
+    create_notification(client, 'A cached notification', 3600, 'Information')
+    # The password is verified with a query before the response is computed
+    credential_cache.clear()
+    headers = get_authentication_headers(TEST_USER_NAME, TEST_USER_PASS)
+    url = url_for('service.notificationlistresource', _external=True)
+    writes = []
+    def write_concurrently(conn, cursor, statement, *args):
+        if 'FROM user' in statement.replace('"', '') and not writes:
+            writes.append(statement)
+            response_cache.invalidate_tables(['notification'])
+    event.listen(db.engine, 'before_cursor_execute', write_concurrently)
+    try:
+        assert client.get(url, headers=headers).status_code == \
+            HttpStatus.ok_200.value
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', write_concurrently)
+    assert writes
+
+    assert client.get(url, headers=headers).status_code == \
+        HttpStatus.ok_200.value
+    assert response_cache.stats()['hits'] == 0
+    assert response_cache.stats()['misses'] == 2
+
+def test_response_cache_evicts_least_recently_used_responses(application):
+    """
+    Ensure the in-process backend keeps no more responses than its size
+    """
+    backend = LRUCacheBackend(max_size=2)
+    backend.set('first', 1)
+    backend.set('second', 2)
+    assert backend.get('first') == 1
+    backend.set('third', 3)
+    assert backend.get('second') is None
+    assert backend.get('first') == 1
+    assert backend.get('third') == 3
+    assert backend.size() == 2
+
+def test_create_notification_with_a_concurrently_created_category(client):
+    """
+    Ensure a notification rejected because a concurrent request created its
+    new category isn't reported as a duplicated message
+    """
+    create_user_response = create_user(client, TEST_USER_NAME, TEST_USER_PASS)
+    assert create_user_response.status_code == HttpStatus.created_201.value
+    inserted = []
+    def insert_category_concurrently(conn, cursor, statement, *args):
+        if statement.startswith('INSERT INTO notification_category') and \
+                not inserted:
+            inserted.append(statement)
+            with db.engine.connect() as other_connection:
+                other_connection.execute(
+                    NotificationCategory.__table__.insert(),
+                    name='Information')
+    event.listen(db.engine, 'before_cursor_execute',
+                 insert_category_concurrently)
+    try:
+        post_response = create_notification(
+            client, 'A notification with a new category', 15, 'Information')
+    finally:
+        event.remove(db.engine, 'before_cursor_execute',
+                     insert_category_concurrently)
+    assert inserted
+    assert post_response.status_code == HttpStatus.bad_request_400.value
+    assert json.loads(post_response.get_data(as_text=True)) == {
+        'error': 'A notification category with the name <Information> was'
+                 ' created at the same time, please retry'}
+    assert Notification.query.count() == 0
+    post_response = create_notification(
+        client, 'A notification with a new category', 15, 'Information')
+    assert post_response.status_code == HttpStatus.created_201.value
+    duplicated_response = create_notification(
+        client, 'A notification with a new category', 15, 'Information')
+    assert json.loads(duplicated_response.get_data(as_text=True)) == {
+        'error': 'A notification with the message <A notification with a new'
+                 ' category> already exists'}
+
+def test_create_resources_without_reading_them_back(client):
+    """
+    Ensure creating a resource relies on the unique constraints and dumps
+    the new instance instead of checking for duplicates and reading the new
+    row back
+    """
+    with assert_num_queries(1):
+        create_user_response = create_user(
+            client, TEST_USER_NAME, TEST_USER_PASS)
+    assert create_user_response.status_code == HttpStatus.created_201.value
+    duplicated_user_response = create_user(
+        client, TEST_USER_NAME, TEST_USER_PASS)
+    assert duplicated_user_response.status_code == \
+        HttpStatus.bad_request_400.value
+    assert json.loads(duplicated_user_response.get_data(as_text=True)) == {
+        'user': 'An user with the name <{0}> already exists'.format(
+            TEST_USER_NAME)}
+    # Warm up the credential cache
+    create_notification_category(client, 'Warning')
+
+    # Look up the category, insert the new category and the notification
+    with assert_num_queries(3):
+        post_response = create_notification(
+            client, 'A notification created at once', 15, 'Information')
+    assert post_response.status_code == HttpStatus.created_201.value
+    post_response_data = json.loads(post_response.get_data(as_text=True))
+    assert post_response_data['creation_date'] is not None
+    assert post_response_data['displayed_times'] == 0
+    assert post_response_data['displayed_once'] is False
+    get_response = client.get(
+        post_response_data['url'],
+        headers=get_authentication_headers(TEST_USER_NAME, TEST_USER_PASS))
+    assert json.loads(get_response.get_data(as_text=True)) == \
+        post_response_data
+
+    with assert_num_queries(1):
+        post_response = create_notification_category(client, 'Error')
+    assert post_response.status_code == HttpStatus.created_201.value
+    assert json.loads(post_response.get_data(as_text=True))\
+        ['notifications'] == []
+    duplicated_response = create_notification_category(client, 'Error')
+    assert duplicated_response.status_code == HttpStatus.bad_request_400.value
+    assert NotificationCategory.query.count() == 3
+
+def test_retrieve_metrics(client):
+    """
+    Ensure the metrics report the connection pool and cache statistics and
+    require authentication
+    """
+    url = url_for('service.metricsresource', _external=True)
+    unauthenticated_response = client.get(
+        url, headers=get_accept_content_type_headers())
+    assert unauthenticated_response.status_code == \
+        HttpStatus.unauthorized_401.value
+    create_user(client, TEST_USER_NAME, TEST_USER_PASS)
+    create_notification(client, 'A measured notification', 15, 'Information')
+    headers = get_authentication_headers(TEST_USER_NAME, TEST_USER_PASS)
+    get_response = client.get(url, headers=headers)
+    assert get_response.status_code == HttpStatus.ok_200.value
+    get_response_data = json.loads(get_response.get_data(as_text=True))
+    assert get_response_data['pool']['checkouts'] > 0
+    assert get_response_data['pool']['checkins'] > 0
+    assert get_response_data['pool']['invalidations'] == 0
+    assert get_response_data['credential_cache']['hits'] >= 1
+    assert set(get_response_data) == {
+        'pool', 'replicas', 'credential_cache', 'count_cache',
+        'response_cache', 'display_counter_buffer', 'notification_reaper'}
+    # The metrics are never cached
+    second_response = client.get(url, headers=headers)
+    second_response_data = json.loads(second_response.get_data(as_text=True))
+    assert second_response_data['credential_cache']['hits'] == \
+        get_response_data['credential_cache']['hits'] + 1
+
+def replicate(source_engine, replica_engine):
+    """
+    Copy every row of the source database to the replica, standing in for
+    the replication of the database server
+    """
+    db.Model.metadata.drop_all(replica_engine)
+    db.Model.metadata.create_all(replica_engine)
+    for table in db.Model.metadata.sorted_tables:
+        rows = [dict(row) for row in source_engine.execute(table.select())]
+        if rows:
+            replica_engine.execute(table.insert(), rows)
+
+def test_reads_are_routed_to_the_replicas(client, tmpdir):
+    """
+    Ensure the GET requests read from the available replicas while the
+    writes, and the reads that follow them, use the primary, and that the
+    responses read from a replica are only cached for a short time
+    """
+    application = client.application
+    application.config['RESPONSE_CACHE_REPLICA_TTL'] = 1
+    application.config['SQLALCHEMY_REPLICA_URIS'] = [
+        'sqlite:///' + str(tmpdir.join('missing', 'replica.db')),
+        'sqlite:///' + str(tmpdir.join('replica.db'))]
+    create_user(client, TEST_USER_NAME, TEST_USER_PASS)
+    create_notification(client, 'A replicated notification', 15, 'Information')
+    replica_set = db.get_replica_set()
+    replica_engine = replica_set.replicas[1].engine
+    replicate(db.engine, replica_engine)
+    # The replica lags behind the primary
+    post_response = create_notification(
+        client, 'A notification only in the primary', 15, 'Information')
+    assert post_response.status_code == HttpStatus.created_201.value
+    assert Notification.query.count() == 2
+
+    url = url_for('service.notificationlistresource', _external=True)
+    headers = get_authentication_headers(TEST_USER_NAME, TEST_USER_PASS)
+    get_response = client.get(url, headers=headers)
+    assert get_response.status_code == HttpStatus.ok_200.value
+    get_response_data = json.loads(get_response.get_data(as_text=True))
+    assert [notification['message']
+            for notification in get_response_data['results']] == \
+        ['A replicated notification']
+    # The replica whose database doesn't exist failed its health check
+    assert [replica['healthy'] for replica in replica_set.stats()] == \
+        [False, True]
+
+    # The replica catches up, but the stale response is cached for a while
+    replicate(db.engine, replica_engine)
+    with assert_num_queries(0):
+        get_response = client.get(url, headers=headers)
+    assert json.loads(get_response.get_data(as_text=True))['count'] == 1
+    time.sleep(1.5)
+    get_response_data = json.loads(
+        client.get(url, headers=headers).get_data(as_text=True))
+    assert [notification['message']
+            for notification in get_response_data['results']] == \
+        ['A replicated notification', 'A notification only in the primary']
+
+    with application.test_request_context(method='GET'):
+        assert NotificationCategory.query.count() == 1
+        db.session.add(NotificationCategory('Warning'))
+        # The query flushes the new category to the primary and reads it back
+        assert NotificationCategory.query.count() == 2
+        db.session.rollback()
+
+def test_a_request_reads_from_a_single_replica(client, tmpdir):
+    """
+    Ensure all the reads of a request go to the replica chosen by the first
+    one, so they see the same replication lag
+    """
+    application = client.application
+    application.config['RESPONSE_CACHE_ENABLED'] = False
+    application.config['SQLALCHEMY_REPLICA_URIS'] = [
+        'sqlite:///' + str(tmpdir.join('first_replica.db')),
+        'sqlite:///' + str(tmpdir.join('second_replica.db'))]
+    create_user(client, TEST_USER_NAME, TEST_USER_PASS)
+    create_notification(client, 'A replicated notification', 15, 'Information')
+    replica_engines = [replica.engine
+                       for replica in db.get_replica_set().replicas]
+    statements = []
+    for replica_engine in replica_engines:
+        replicate(db.engine, replica_engine)
+        event.listen(
+            replica_engine, 'before_cursor_execute',
+            lambda conn, *args, engine=replica_engine:
+                statements.append(engine))
+    url = url_for('service.notificationlistresource', _external=True)
+    headers = get_authentication_headers(TEST_USER_NAME, TEST_USER_PASS)
+    for _ in range(2):
+        del statements[:]
+        # The credentials, the page and the count are read
+        get_response = client.get(url, headers=headers)
+        assert get_response.status_code == HttpStatus.ok_200.value
+        assert len(statements) >= 2
+        assert len(set(statements)) == 1
+        credential_cache.clear()
+
+def test_export_notifications(client):
+    """
+    Ensure the notifications are exported as NDJSON or CSV, filtered by
+    category and creation date
+    """
+    create_user(client, TEST_USER_NAME, TEST_USER_PASS)
+    create_notification(client, 'An exported notification', 15, 'Information')
+    create_notification(client, 'Another exported notification', 30, 'Warning')
+    create_notification(client, 'A third exported notification', 45,
+                        'Information')
+    client.application.config['EXPORT_BATCH_SIZE'] = 2
+    headers = get_authentication_headers(TEST_USER_NAME, TEST_USER_PASS)
+    url = url_for('service.notificationexportresource', _external=True)
+
+    ndjson_response = client.get(url, headers=headers)
+    assert ndjson_response.status_code == HttpStatus.ok_200.value
+    assert ndjson_response.mimetype == 'application/x-ndjson'
+    rows = [json.loads(line) for line in
+            ndjson_response.get_data(as_text=True).splitlines()]
+    assert [row['message'] for row in rows] == [
+        'An exported notification',
+        'Another exported notification',
+        'A third exported notification']
+    assert rows[1]['notification_category'] == 'Warning'
+    assert rows[1]['ttl'] == 30
+    assert rows[1]['displayed_once'] is False
+
+    category_id = NotificationCategory.query.filter_by(
+        name='Information').first().id
+    csv_response = client.get(
+        url_for('service.notificationexportresource', format='csv',
+                category=category_id, _external=True),
+        headers=headers)
+    assert csv_response.status_code == HttpStatus.ok_200.value
+    assert csv_response.mimetype == 'text/csv'
+    lines = csv_response.get_data(as_text=True).splitlines()
+    assert lines[0] == 'id,message,ttl,creation_date,notification_category,' \
+        'displayed_times,displayed_once'
+    assert len(lines) == 3
+    assert lines[2].split(',')[1:3] == ['A third exported notification', '45']
+
+    future_response = client.get(
+        url_for('service.notificationexportresource',
+                created_after='2999-01-01T00:00:00', _external=True),
+        headers=headers)
+    assert future_response.get_data(as_text=True) == ''
+    invalid_response = client.get(
+        url_for('service.notificationexportresource', format='xml',
+                _external=True),
+        headers=headers)
+    assert invalid_response.status_code == HttpStatus.bad_request_400.value
+
+def test_import_notifications(client):
+    """
+    Ensure the notifications are imported from NDJSON or CSV in batches,
+    reporting the rejected rows without aborting the import
+    """
+    create_user(client, TEST_USER_NAME, TEST_USER_PASS)
+    create_notification(client, 'An existing notification', 15, 'Information')
+    client.application.config['IMPORT_BATCH_SIZE'] = 2
+    headers = get_authentication_headers(TEST_USER_NAME, TEST_USER_PASS)
+    url = url_for('service.notificationimportresource', _external=True)
+    ndjson_lines = [
+        {'message': 'An imported notification', 'ttl': 15,
+         'notification_category': 'Information'},
+        {'message': 'An existing notification', 'ttl': 15,
+         'notification_category': 'Information'},
+        'not json',
+        {'message': 'Another imported notification', 'ttl': 30,
+         'notification_category': {'name': 'Warning'}},
+        {'message': 'Bad', 'ttl': 30, 'notification_category': 'Warning'}]
+    headers['Content-Type'] = 'application/x-ndjson'
+    ndjson_response = client.post(
+        url,
+        headers=headers,
+        data='\n'.join(line if isinstance(line, str) else json.dumps(line)
+                       for line in ndjson_lines))
+    assert ndjson_response.status_code == HttpStatus.multi_status_207.value
+    summary = json.loads(ndjson_response.get_data(as_text=True))
+    assert summary['imported'] == 2
+    assert summary['rejected'] == 3
+    assert [row['line'] for row in summary['rejected_rows']] == [2, 3, 5]
+    assert 'message' in summary['rejected_rows'][2]['errors']
+    assert NotificationCategory.query.filter_by(name='Warning').count() == 1
+
+    headers['Content-Type'] = 'text/csv'
+    csv_response = client.post(
+        url,
+        headers=headers,
+        data='message,ttl,notification_category\n'
+             '"An imported, quoted notification",45,Error\n'
+             'A CSV notification,60,Information\n'
+             'A CSV notification without ttl,,Information\n')
+    summary = json.loads(csv_response.get_data(as_text=True))
+    assert summary['imported'] == 2
+    assert [row['line'] for row in summary['rejected_rows']] == [4]
+    notification = Notification.query.filter_by(
+        message='An imported, quoted notification').first()
+    assert notification.ttl == 45
+    assert notification.notification_category.name == 'Error'
+    assert Notification.query.count() == 5
+
+    headers['Content-Type'] = 'application/xml'
+    invalid_response = client.post(url, headers=headers, data='<xml/>')
+    assert invalid_response.status_code == \
+        HttpStatus.unsupported_media_type_415.value
+
+def test_import_notifications_stops_at_unreadable_data(client):
+    """
+    Ensure the import of data that can't be decoded or parsed stops with
+    400, reporting the rows imported until then
+    """
+    create_user(client, TEST_USER_NAME, TEST_USER_PASS)
+    client.application.config['IMPORT_BATCH_SIZE'] = 2
+    headers = get_authentication_headers(TEST_USER_NAME, TEST_USER_PASS)
+    url = url_for('service.notificationimportresource', _external=True)
+    headers['Content-Type'] = 'application/x-ndjson'
+    # The body is decoded in chunks, so the rows of the chunks before the
+    # invalid byte are imported
+    ndjson_response = client.post(
+        url,
+        headers=headers,
+        data=b''.join(json.dumps(
+            {'message': 'Readable notification {0}'.format(i), 'ttl': 15,
+             'notification_category': 'Information'}).encode('utf-8') + b'\n'
+            for i in range(300)) + b'\xff\xfe\n')
+    assert ndjson_response.status_code == HttpStatus.bad_request_400.value
+    summary = json.loads(ndjson_response.get_data(as_text=True))
+    imported = summary['imported']
+    assert 0 < imported < 300
+    assert 'after line {0} '.format(imported) in summary['error']
+    assert Notification.query.count() == imported
+
+    headers['Content-Type'] = 'text/csv'
+    csv_response = client.post(
+        url,
+        headers=headers,
+        data='message,ttl,notification_category\n'
+             'A readable CSV notification,60,Information\n'
+             'A CSV notification with a NUL\0,60,Information\n')
+    assert csv_response.status_code == HttpStatus.bad_request_400.value
+    summary = json.loads(csv_response.get_data(as_text=True))
+    assert summary['imported'] == 1
+    assert 'after line 2 ' in summary['error']
+    assert Notification.query.count() == imported + 1
+
+def test_import_notifications_command(application, tmpdir):
+    """
+    Ensure the flask CLI command imports the notifications of a file
+    """
+    path = tmpdir.join('notifications.ndjson')
+    path.write('\n'.join(json.dumps(
+        {'message': 'Imported notification {0}'.format(i), 'ttl': 15,
+         'notification_category': 'Information'}) for i in range(5)))
+    result = application.test_cli_runner().invoke(
+        args=['import-notifications', str(path), '--batch-size', '2'])
+    assert result.exit_code == 0, result.output
+    assert json.loads(result.output)['imported'] == 5
+    assert Notification.query.count() == 5
+
+def test_filter_and_sort_notifications_list(client):
+    """
+    Ensure the notifications list is filtered and sorted by the query
+    arguments, in both pagination modes
+    """
+    create_user(client, TEST_USER_NAME, TEST_USER_PASS)
+    for message, ttl, category in (
+            ('First notification', 10, 'Information'),
+            ('Second notification', 40, 'Warning'),
+            ('Third notification', 20, 'Information'),
+            ('Fourth notification', 30, 'Information'),
+            ('Fifth notification', 50, 'Information'),
+            ('Sixth notification', 60, 'Information')):
+        create_notification(client, message, ttl, category)
+    Notification.query.filter_by(message='Third notification')\
+        .update({'displayed_once': True})
+    db.session.commit()
+    category_id = NotificationCategory.query.filter_by(
+        name='Information').first().id
+    headers = get_authentication_headers(TEST_USER_NAME, TEST_USER_PASS)
+
+    def get_messages(**args):
+        response = client.get(
+            url_for('service.notificationlistresource', _external=True,
+                    **args),
+            headers=headers)
+        assert response.status_code == HttpStatus.ok_200.value
+        data = json.loads(response.get_data(as_text=True))
+        return [notification['message'] for notification in data['results']]
+
+    assert get_messages(category=category_id, min_ttl=20, max_ttl=50,
+                        sort='-ttl') == [
+        'Fifth notification', 'Fourth notification', 'Third notification']
+    assert get_messages(displayed_once='true') == ['Third notification']
+    assert get_messages(created_after='2999-01-01T00:00:00') == []
+    assert get_messages(sort='message', page=2) == [
+        'Sixth notification', 'Third notification']
+
+    # Walk the cursor pages in descending order and back
+    url = url_for('service.notificationlistresource', sort='-ttl',
+                  cursor='', page_size=4, _external=True)
+    first_page = json.loads(
+        client.get(url, headers=headers).get_data(as_text=True))
+    assert [notification['ttl'] for notification in first_page['results']] \
+        == [60, 50, 40, 30]
+    second_page = json.loads(client.get(
+        first_page['next'], headers=headers).get_data(as_text=True))
+    assert [notification['ttl'] for notification in second_page['results']] \
+        == [20, 10]
+    assert second_page['next'] is None
+    previous_page = json.loads(client.get(
+        second_page['previous'], headers=headers).get_data(as_text=True))
+    assert previous_page['results'] == first_page['results']
+
+    invalid_response = client.get(
+        url_for('service.notificationlistresource', sort='password',
+                _external=True),
+        headers=headers)
+    assert invalid_response.status_code == HttpStatus.bad_request_400.value
+
+def test_mark_notification_displayed(client):
+    """
+    Ensure marking a notification as displayed increments its counter in
+    the database, either at once or buffered and written in batches
+    """
+    create_user(client, TEST_USER_NAME, TEST_USER_PASS)
+    post_response = create_notification(
+        client, 'A displayed notification', 15, 'Information')
+    notification_url = json.loads(post_response.get_data(as_text=True))['url']
+    notification_id = Notification.query.first().id
+    headers = get_authentication_headers(TEST_USER_NAME, TEST_USER_PASS)
+    url = url_for('service.notificationdisplayresource', id=notification_id,
+                  _external=True)
+
+    for _ in range(2):
+        with assert_num_queries(1):
+            response = client.post(url, headers=headers)
+        assert response.status_code == HttpStatus.no_content_204.value
+    get_response_data = json.loads(client.get(
+        notification_url, headers=headers).get_data(as_text=True))
+    assert get_response_data['displayed_times'] == 2
+    assert get_response_data['displayed_once'] is True
+    missing_response = client.post(
+        url_for('service.notificationdisplayresource', id=notification_id + 1,
+                _external=True),
+        headers=headers)
+    assert missing_response.status_code == HttpStatus.not_found_404.value
+
+    client.application.config['DISPLAY_COUNTER_BUFFERED'] = True
+    display_counter_buffer.flush_interval = 3600
+    display_counter_buffer.max_pending = 2
+    with assert_num_queries(0):
+        for _ in range(3):
+            response = client.post(url, headers=headers)
+            assert response.status_code == HttpStatus.accepted_202.value
+    assert display_counter_buffer.pending() == 3
+    # Reaching max_pending notifications flushes the buffer
+    client.post(
+        url_for('service.notificationdisplayresource', id=notification_id + 1,
+                _external=True),
+        headers=headers)
+    assert display_counter_buffer.pending() == 0
+    assert display_counter_buffer.stats()['flushes'] == 1
+    get_response_data = json.loads(client.get(
+        notification_url, headers=headers).get_data(as_text=True))
+    assert get_response_data['displayed_times'] == 5
+
+def test_expired_notifications_are_hidden_and_reaped(client):
+    """
+    Ensure the notifications whose ttl has passed are excluded from the
+    reads and deleted by the reaper
+    """
+    create_user(client, TEST_USER_NAME, TEST_USER_PASS)
+    for message in ('A current notification', 'An expired notification',
+                    'Another expired notification'):
+        post_response = create_notification(client, message, 3600,
+                                            'Information')
+    post_response_data = json.loads(post_response.get_data(as_text=True))
+    creation_date = Notification.query.first().creation_date
+    assert Notification.query.first().expiration_date == \
+        creation_date + timedelta(seconds=3600)
+    headers = get_authentication_headers(TEST_USER_NAME, TEST_USER_PASS)
+    # Changing the ttl moves the expiration date
+    patch_response = client.patch(
+        post_response_data['url'],
+        headers=headers,
+        data=json.dumps({'ttl': 7200}))
+    assert json.loads(patch_response.get_data(as_text=True))\
+        ['expiration_date'] == \
+        (creation_date + timedelta(seconds=7200)).isoformat() + '+00:00'
+    client.patch(
+        url_for('service.notificationbulkresource', _external=True),
+        headers=headers,
+        data=json.dumps({
+            'selection': {'ids': [2, 3]},
+            'changes': {'ttl': 0}}))
+
+    list_response_data = json.loads(client.get(
+        url_for('service.notificationlistresource', _external=True),
+        headers=headers).get_data(as_text=True))
+    assert [notification['message'] for notification in
+            list_response_data['results']] == ['A current notification']
+    assert list_response_data['count'] == 1
+    get_response = client.get(post_response_data['url'], headers=headers)
+    assert get_response.status_code == HttpStatus.not_found_404.value
+    # The writes don't find the expired notifications either
+    patch_response = client.patch(
+        post_response_data['url'],
+        headers=headers,
+        data=json.dumps({'ttl': 7200}))
+    assert patch_response.status_code == HttpStatus.not_found_404.value
+    display_response = client.post(
+        url_for('service.notificationdisplayresource', id=3, _external=True),
+        headers=headers)
+    assert display_response.status_code == HttpStatus.not_found_404.value
+    delete_response = client.delete(post_response_data['url'], headers=headers)
+    assert delete_response.status_code == HttpStatus.not_found_404.value
+    assert Notification.query.get(3).ttl == 0
+    category_response_data = json.loads(client.get(
+        post_response_data['notification_category']['url'],
+        headers=headers).get_data(as_text=True))
+    assert len(category_response_data['notifications']) == 1
+    export_response = client.get(
+        url_for('service.notificationexportresource', _external=True),
+        headers=headers)
+    assert len(export_response.get_data(as_text=True).splitlines()) == 1
+
+    assert delete_expired_notifications(batch_size=1, max_batches=1) == 1
+    result = client.application.test_cli_runner().invoke(
+        args=['reap-notifications', '--batch-size', '1'])
+    assert result.exit_code == 0, result.output
+    assert 'Deleted 1 expired notifications' in result.output
+    assert [notification.message for notification in
+            Notification.query.all()] == ['A current notification']
+
+def test_compiled_serializers_dump_like_marshmallow(client):
+    """
+    Ensure the compiled dump functions produce the same output as the
+    schemas, for each only/exclude variant, and fall back to marshmallow
+    for the objects they can't dump
+    """
+    create_user(client, TEST_USER_NAME, TEST_USER_PASS)
+    create_notification(client, 'Notification about a warning', 15, 'Warning')
+    create_notification(client, 'Another warning', 30, 'Warning')
+    create_notification(client, 'An informative notification', 60,
+                        'Information')
+    notifications = Notification.query.all()
+    notification_categories = NotificationCategory.query.all()
+    users = User.query.all()
+    variants = [
+        (NotificationSchema(), notifications),
+        (NotificationSchema(only=('id', 'url', 'creation_date')),
+         notifications),
+        (NotificationSchema(exclude=('notification_category',)),
+         notifications),
+        (NotificationCategorySchema(), notification_categories),
+        (NotificationCategorySchema(exclude=('notifications',)),
+         notification_categories),
+        (UserSchema(), users)
+    ]
+    for schema, objects in variants:
+        dump_function = compile_schema(schema)
+        assert dump_function is not None
+        url_templates = URLTemplates()
+        assert [dump_function(obj, url_templates) for obj in objects] == \
+            schema.dump(objects, many=True).data
+        assert dump(schema, objects, many=True) == \
+            schema.dump(objects, many=True).data
+        assert dump(schema, objects[0]) == schema.dump(objects[0]).data
+    notification_schema = NotificationSchema()
+    # An invalid value and a mapping are dumped by marshmallow
+    notification = notifications[0]
+    notification.ttl = 'invalid'
+    assert dump(notification_schema, notification) == \
+        notification_schema.dump(notification).data
+    db.session.rollback()
+    notification_dict = {'id': 4, 'message': 'A dictionary', 'ttl': 5}
+    assert dump(notification_schema, notification_dict) == \
+        notification_schema.dump(notification_dict).data
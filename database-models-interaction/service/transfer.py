@@ -0,0 +1,207 @@
+"""
+This module contains the export and the import of the notifications as
+newline delimited JSON (NDJSON) or CSV. Both process the rows in batches as
+they are read, so the memory used doesn't depend on the number of
+notifications.
+"""
+import csv
+import io
+import json
+
+import click
+
+from flask import current_app
+from flask.cli import with_appcontext
+from marshmallow import fields, validate
+from sqlalchemy.exc import SQLAlchemyError
+
+from bulk import NotificationFilterSchema, create_notifications, \
+        filter_notifications
+from http_status import HttpStatus
+from models import db, Notification, NotificationCategory
+
+# The columns of the exported rows, in order
+EXPORT_FIELDS = ('id', 'message', 'ttl', 'creation_date',
+                 'notification_category', 'displayed_times', 'displayed_once')
+EXPORT_MIMETYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv'
+}
+
+class NotificationExportSchema(NotificationFilterSchema):
+    """The query arguments of an export."""
+    format = fields.String(
+        missing='ndjson', validate=validate.OneOf(list(EXPORT_MIMETYPES)))
+
+notification_export_schema = NotificationExportSchema()
+# Maximum number of rejected rows described by the summary of an import
+MAX_REPORTED_REJECTED_ROWS = 1000
+
+
+def export_query(arguments, batch_size):
+    """Returns a query for the rows to export, filtered by the arguments
+    loaded with NotificationExportSchema (see filter_notifications).
+
+    The query selects plain columns instead of instances, so no object is
+    kept in the session, and yields them in batches. The drivers that
+    support server side cursors stream the results; the default cursor of
+    MySQL Connector is unbuffered and fetches them incrementally as well.
+    """
+    query = db.session.query(
+            Notification.id,
+            Notification.message,
+            Notification.ttl,
+            Notification.creation_date,
+            NotificationCategory.name,
+            Notification.displayed_times,
+            Notification.displayed_once)\
+        .join(Notification.notification_category)\
+        .filter(Notification.not_expired())\
+        .order_by(Notification.id)
+    return filter_notifications(query, arguments)\
+        .execution_options(stream_results=True)\
+        .yield_per(batch_size)
+
+def export_notifications(arguments, batch_size=1000):
+    """Generates the chunks of the export, each one with up to batch_size
+    rows in the requested format."""
+    rows = export_query(arguments, batch_size)
+    if arguments['format'] == 'csv':
+        write_rows = write_csv_rows
+        yield ','.join(EXPORT_FIELDS) + '\n'
+    else:
+        write_rows = write_ndjson_rows
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == batch_size:
+            yield write_rows(batch)
+            batch = []
+    if batch:
+        yield write_rows(batch)
+
+def write_ndjson_rows(rows):
+    return ''.join(
+        json.dumps(dict(zip(EXPORT_FIELDS, format_row(row)))) + '\n'
+        for row in rows)
+
+def write_csv_rows(rows):
+    output = io.StringIO()
+    csv.writer(output, lineterminator='\n').writerows(
+        format_row(row) for row in rows)
+    return output.getvalue()
+
+def format_row(row):
+    id, message, ttl, creation_date, category_name, displayed_times, \
+        displayed_once = row
+    if hasattr(creation_date, 'isoformat'):
+        creation_date = creation_date.isoformat()
+    return (id, message, ttl, creation_date, category_name, displayed_times,
+            displayed_once)
+
+
+def get_format(mimetype_or_file_name):
+    """Returns the transfer format for a MIME type or a file name."""
+    for transfer_format, mimetype in EXPORT_MIMETYPES.items():
+        if mimetype_or_file_name == mimetype or \
+                mimetype_or_file_name.endswith('.' + transfer_format):
+            return transfer_format
+    return None
+
+def read_ndjson_rows(lines):
+    """Generates a (line number, row) tuple for each line. The row is None
+    when the line isn't valid JSON."""
+    for line_number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            yield line_number, json.loads(line)
+        except ValueError:
+            yield line_number, None
+
+def read_csv_rows(lines):
+    """Generates a (line number, row) tuple for each record after the
+    header. The empty columns are left out of the rows."""
+    reader = csv.DictReader(lines)
+    for row in reader:
+        yield reader.line_num, {
+            name: value for name, value in row.items()
+            if name is not None and value not in (None, '')}
+
+def import_notifications(lines, transfer_format, batch_size=500):
+    """Creates the notifications read from the lines of an NDJSON or CSV
+    file, batch_size rows at a time.
+
+    Each batch is validated and inserted by create_notifications and
+    committed on its own, so the rejected rows, and even a batch that fails
+    as a whole, don't abort the rest of the import.
+
+    The import stops at the data that can't be decoded as UTF-8 or parsed
+    by the CSV reader. The rows read until then, up to the chunk that fails
+    to decode, are imported, and the batches already committed stay
+    committed.
+
+    Returns:
+        A summary with the number of imported and rejected rows, and the
+        line numbers and errors of the first rejected rows. It also includes
+        an error when the import stopped before the end of the file
+    """
+    if transfer_format == 'csv':
+        rows = read_csv_rows(lines)
+    else:
+        rows = read_ndjson_rows(lines)
+    summary = {'imported': 0, 'rejected': 0, 'rejected_rows': []}
+    batch = []
+    line_number = 0
+    try:
+        for line_number, row in rows:
+            batch.append((line_number, row))
+            if len(batch) == batch_size:
+                import_batch(batch, summary)
+                batch = []
+    except (UnicodeDecodeError, csv.Error) as err:
+        summary['error'] = 'The data after line {0} can\'t be read: ' \
+            '{1}'.format(line_number, err)
+    if batch:
+        import_batch(batch, summary)
+    return summary
+
+def import_batch(batch, summary):
+    try:
+        results = create_notifications(
+            [row for _, row in batch], dump=False)
+    except SQLAlchemyError as err:
+        db.session.rollback()
+        results = [{'status': HttpStatus.bad_request_400.value,
+                    'errors': {'error': str(err)}}] * len(batch)
+    for (line_number, _), result in zip(batch, results):
+        if result['status'] == HttpStatus.created_201.value:
+            summary['imported'] += 1
+            continue
+        summary['rejected'] += 1
+        if len(summary['rejected_rows']) < MAX_REPORTED_REJECTED_ROWS:
+            summary['rejected_rows'].append(
+                {'line': line_number, 'errors': result['errors']})
+
+@click.command('import-notifications')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'transfer_format',
+              type=click.Choice(list(EXPORT_MIMETYPES)),
+              help='Defaults to the format of the file extension.')
+@click.option('--batch-size', type=int,
+              help='Defaults to the IMPORT_BATCH_SIZE setting.')
+@with_appcontext
+def import_notifications_command(path, transfer_format, batch_size):
+    """Imports the notifications of an NDJSON or CSV file."""
+    transfer_format = transfer_format or get_format(path)
+    if transfer_format is None:
+        raise click.UsageError(
+            'Please, provide the format of {0}.'.format(path))
+    with open(path, encoding='utf-8', newline='') as lines:
+        summary = import_notifications(
+            lines,
+            transfer_format,
+            batch_size or current_app.config['IMPORT_BATCH_SIZE'])
+    click.echo(json.dumps(summary, indent=2))
+    if 'error' in summary:
+        raise click.ClickException(summary['error'])
@@ -2,18 +2,45 @@
 This module contain code that creates the resources, authentication, users and 
 pagination that compose the building blocks for the RESTful API.
 """
-from flask import Blueprint, request, jsonify, make_response, g
-from flask_restful import Api, Resource
-from flask_httpauth import HTTPBasicAuth
+import io
+import json
 
-from helpers import PaginationHelper
+from flask import Blueprint, request, jsonify, make_response, g, current_app, \
+        Response, stream_with_context
+from flask_restful import Api, Resource
+from flask_httpauth import HTTPBasicAuth, HTTPTokenAuth, MultiAuth
+from itsdangerous import URLSafeTimedSerializer, BadSignature
+
+from bulk import create_notifications, update_notifications, \
+        delete_notifications, filter_notifications, get_notification_order, \
+        mark_notifications_displayed, \
+        notification_list_schema, notification_selection_schema, \
+        notification_changes_schema
+from caching import CredentialCache, ResponseCache
+from counters import DisplayCounterBuffer
+from database import pool_metrics
+from expiry import NotificationReaper
+from helpers import PaginationHelper, count_cache, eager_loading_options, \
+        conditional_response, conditional_payload_response, \
+        precondition_failed
 from http_status import HttpStatus
+from serializers import dump
+from transfer import EXPORT_MIMETYPES, export_notifications, \
+        notification_export_schema, get_format, import_notifications
 
 from models import db, NotificationCategory, NotificationCategorySchema, \
-        Notification, NotificationSchema, User, UserSchema
-from sqlalchemy.exc import SQLAlchemyError
-
-auth = HTTPBasicAuth()
+        Notification, NotificationSchema, User, UserSchema, \
+        ResourceAddUpdateDelete
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from sqlalchemy.orm.exc import StaleDataError
+
+basic_auth = HTTPBasicAuth()
+token_auth = HTTPTokenAuth('Bearer')
+auth = MultiAuth(basic_auth, token_auth)
+credential_cache = CredentialCache()
+response_cache = ResponseCache()
+display_counter_buffer = DisplayCounterBuffer()
+notification_reaper = NotificationReaper()
 service_blueprint = Blueprint('service', __name__)
 
 notification_category_schema = NotificationCategorySchema()
@@ -22,28 +49,66 @@ user_schema = UserSchema()
 
 service = Api(service_blueprint)
 
-@auth.verify_password
+ResourceAddUpdateDelete.register_write_listener(count_cache.invalidate_tables)
+ResourceAddUpdateDelete.register_write_listener(
+    response_cache.invalidate_tables)
+
+@basic_auth.verify_password
 def verify_user_password(name, password):
-    user = User.query.filter_by(name=name).first()
-    if not user or not user.verify_password(password):
+    # Skip both the query and the password hash for recently verified users
+    user_id = credential_cache.get(name, password)
+    if user_id is None:
+        user = User.query.filter_by(name=name).first()
+        if not user or not user.verify_password(password):
+            return False
+        user_id = user.id
+        credential_cache.set(name, password, user_id)
+    g.user_id = user_id
+    return True
+
+@db.event.listens_for(User, 'after_update')
+@db.event.listens_for(User, 'after_delete')
+def invalidate_user_credentials(mapper, connection, user):
+    credential_cache.invalidate_user(user.id)
+
+def get_token_serializer():
+    return URLSafeTimedSerializer(
+        current_app.config['SECRET_KEY'],
+        salt='service-token')
+
+@token_auth.verify_token
+def verify_user_token(token):
+    # The signature check alone authenticates the user, without any query
+    try:
+        user_id = get_token_serializer().loads(
+            token,
+            max_age=current_app.config['TOKEN_EXPIRATION_SECONDS'])
+    except BadSignature:
         return False
-    g.user = user
+    g.user_id = user_id
     return True
 
+def expire_with_embedded_notifications(notification_categories):
+    # The categories stop embedding their notifications when they expire
+    for notification_category in notification_categories:
+        for notification in notification_category.embedded_notifications:
+            response_cache.expire_at(notification.expiration_date)
+
 class AuthenticationRequiredResource(Resource):
 
     method_decorators = [auth.login_required]
 
 class UserResource(AuthenticationRequiredResource):
 
+    @response_cache.cached('user')
     def get(self, id):
         user = User.query.get_or_404(id)
-        result = user_schema.dump(user).data
-        return result
+        return conditional_response(user, user_schema)
 
 class UserListResource(Resource):
 
     @auth.login_required
+    @response_cache.cached('user')
     def get(self):
         pagination_helper = PaginationHelper(
             request,
@@ -52,7 +117,7 @@ class UserListResource(Resource):
             key_name='results',
             schema=user_schema)
         result = pagination_helper.paginate_query()
-        return result
+        return conditional_payload_response(result)
 
     def post(self):
         user_dict = request.get_json()
@@ -65,51 +130,70 @@ class UserListResource(Resource):
             return errors, HttpStatus.bad_request_400.value
 
         user_name = user_dict['name']
-        existing_user = User.query.filter_by(name=user_name).first()
-        if existing_user is not None:
-            response = {'user': 'An user with the name <{}> already'
-                                ' exists'.format(user_name)}
-            return response, HttpStatus.bad_request_400.value
-
         try:
             user = User(name=user_name)
             error_message, password_ok = user\
                 .check_password_strength_and_hash_if_ok(user_dict['password'])
             if password_ok:
-                user.add(user)
-                query = User.query.get(user.id)
-                dump_result = user_schema.dump(query).data
+                dump_result = user.add_and_dump(user, user_schema)
                 return dump_result, HttpStatus.created_201.value
             else:
                 return {'error': error_message}, HttpStatus.bad_request_400.value
+        except IntegrityError:
+            # The unique constraint of the name rejected the user
+            db.session.rollback()
+            response = {'user': 'An user with the name <{}> already'
+                                ' exists'.format(user_name)}
+            return response, HttpStatus.bad_request_400.value
         except SQLAlchemyError as err:
             db.session.rollback()
             response = {'error': str(err)}
             return response, HttpStatus.bad_request_400.value
 
+class TokenResource(Resource):
+
+    method_decorators = [basic_auth.login_required]
+
+    def post(self):
+        token = get_token_serializer().dumps(g.user_id)
+        response = {
+            'token': token,
+            'duration': current_app.config['TOKEN_EXPIRATION_SECONDS']}
+        return response, HttpStatus.created_201.value
 
 class NotificationResource(AuthenticationRequiredResource):
 
+    @response_cache.cached('notification', 'notification_category')
     def get(self, id):
-        notification = Notification.query.get_or_404(id)
-        dumped_notification = notification_schema.dump(notification).data
-        return dumped_notification
+        notification = Notification.query\
+            .options(*eager_loading_options(
+                Notification, notification_schema))\
+            .filter(Notification.id == id, Notification.not_expired())\
+            .first_or_404()
+        response_cache.expire_at(notification.expiration_date)
+        return conditional_response(notification, notification_schema)
 
     def patch(self, id):
-        notification = Notification.query.get_or_404(id)
+        notification = Notification.query\
+            .filter(Notification.id == id, Notification.not_expired())\
+            .first_or_404()
+        if precondition_failed(notification, notification_schema):
+            response = {'error': 'The notification has been modified'}
+            return response, HttpStatus.precondition_failed_412.value
         notification_dict = request.get_json(force=True)
 
         if 'message' in notification_dict and \
                 notification_dict['message'] is not None:
-            notification.message = notification_dict['messge']
+            notification_message = notification_dict['message']
             if not Notification.is_message_unique(
-                    id=0, message=notification_message):
+                    id=id, message=notification_message):
                 response = {'error': 'A notification with the message <{0}>'
                             ' already exists'.format(notification_message)}
                 return response, HttpStatus.bad_request_400.value
+            notification.message = notification_message
         if 'ttl' in notification_dict and \
-                notification['ttl'] is not None:
-            notification.duration = notification_dict['duration']
+                notification_dict['ttl'] is not None:
+            notification.ttl = notification_dict['ttl']
         if 'displayed_times' in notification_dict and \
                 notification_dict['displayed_times'] is not None:
             notification.displayed_times = notification_dict['displayed_times']
@@ -129,35 +213,91 @@ class NotificationResource(AuthenticationRequiredResource):
         try:
             notification.update()
             return self.get(id)
-        except SQLAlchemaError as err:
+        except StaleDataError:
+            # Another request updated the notification since it was read
+            db.session.rollback()
+            response = {'error': 'The notification has been modified'}
+            return response, HttpStatus.precondition_failed_412.value
+        except SQLAlchemyError as err:
             db.session.rollback()
             response = {"error": str(err)}
             return response, HttpStatus.bad_request_400.value
 
     def delete(self, id):
-        notification = Notification.query.get_or_404(id)
+        notification = Notification.query\
+            .filter(Notification.id == id, Notification.not_expired())\
+            .first_or_404()
+        if precondition_failed(notification, notification_schema):
+            response = {'error': 'The notification has been modified'}
+            return response, HttpStatus.precondition_failed_412.value
 
         try:
-            delete = notification.delete(notification)
-            response = make_response()
-            return response, HttpStatus.no_content_204.value
+            notification.delete(notification)
+            return make_response('', HttpStatus.no_content_204.value)
+        except StaleDataError:
+            db.session.rollback()
+            response = {'error': 'The notification has been modified'}
+            return response, HttpStatus.precondition_failed_412.value
         except SQLAlchemyError as err:
             db.session.rollback()
             response = {"error": str(err)}
             return response, HttpStatus.unauthorized_401.value
 
+class NotificationDisplayResource(AuthenticationRequiredResource):
+
+    def post(self, id):
+        # The buffered displays are written later, without checking that
+        # the notification exists
+        if current_app.config['DISPLAY_COUNTER_BUFFERED']:
+            display_counter_buffer.add(id)
+            return make_response('', HttpStatus.accepted_202.value)
+
+        try:
+            affected_rows = mark_notifications_displayed({id: 1})
+        except SQLAlchemyError as err:
+            db.session.rollback()
+            response = {'error': str(err)}
+            return response, HttpStatus.bad_request_400.value
+        if not affected_rows:
+            response = {'message': 'The notification {0} doesn\'t'
+                        ' exist'.format(id)}
+            return response, HttpStatus.not_found_404.value
+        return make_response('', HttpStatus.no_content_204.value)
+
 class NotificationListResource(AuthenticationRequiredResource):
 
+    @response_cache.cached('notification', 'notification_category')
     def get(self):
+        arguments, errors = notification_list_schema.load(request.args)
+        if errors:
+            return errors, HttpStatus.bad_request_400.value
+
+        notifications = filter_notifications(Notification.query, arguments)
+        query = notifications.filter(Notification.not_expired())
+        if response_cache.is_enabled():
+            # The count changes as soon as any of the notifications expires,
+            # and the earliest one is the first entry of the index
+            response_cache.expire_at(
+                query.with_entities(Notification.expiration_date)
+                .order_by(None).order_by(Notification.expiration_date)
+                .limit(1).scalar())
+        query = query.options(
+            *eager_loading_options(Notification, notification_schema))
+        order_by, descending = get_notification_order(arguments.get('sort'))
         pagination_helper = PaginationHelper(
             request,
-            query=Notification.query,
+            query=query,
             resource_for_url='service.notificationlistresource',
             key_name='results',
-            schema=notification_schema)
+            schema=notification_schema,
+            order_by=order_by,
+            descending=descending,
+            # The table statistics also count the expired notifications that
+            # the reaper hasn't deleted yet
+            estimated_count_query=notifications)
         pagination_result = pagination_helper.paginate_query()
 
-        return pagination_result
+        return conditional_payload_response(pagination_result)
 
     def post(self):
         notification_category_dict = request.get_json()
@@ -171,19 +311,16 @@ class NotificationListResource(AuthenticationRequiredResource):
             return errors, HttpStatus.bad_request_400.value
 
         notification_message = notification_category_dict['message']
-        if not Notification.is_message_unique(id=0, message=notification_message):
-            response = {'error': 'A notification with the message <{0}>'
-                        ' already exists'.format(notification_message)}
-            return response, HttpStatus.bad_request_400.value
-
+        notification_category_name = notification_category_dict\
+                ['notification_category']['name']
+        new_category = False
         try:
-            notification_category_name = notification_category_dict\
-                    ['notification_category']['name']
             notification_category = NotificationCategory.query\
                     .filter_by(name=notification_category_name).first()
 
             if notification_category is None:
                 # Create a new NotificationCategory
+                new_category = True
                 notification_category = NotificationCategory(
                     name=notification_category_name)
                 db.session.add(
@@ -194,26 +331,201 @@ class NotificationListResource(AuthenticationRequiredResource):
                 message=notification_message,
                 ttl=notification_category_dict['ttl'],
                 notification_category=notification_category)
-            notification.add(notification)
-
-            query = Notification.query.get(notification.id)
-            dump_result = notification_schema.dump(query).data
+            dump_result = notification.add_and_dump(
+                notification, notification_schema)
             return dump_result, HttpStatus.created_201.value
+        except IntegrityError as err:
+            db.session.rollback()
+            # Find the unique constraint that rejected the notification: the
+            # one of the message or, when a concurrent request created the
+            # same new category, the one of the category name
+            if Notification.query.filter_by(
+                    message=notification_message).first() is not None:
+                response = {'error': 'A notification with the message <{0}>'
+                            ' already exists'.format(notification_message)}
+            elif new_category and NotificationCategory.query.filter_by(
+                    name=notification_category_name).first() is not None:
+                response = {'error': 'A notification category with the name'
+                            ' <{0}> was created at the same time, please'
+                            ' retry'.format(notification_category_name)}
+            else:
+                response = {'error': str(err)}
+            return response, HttpStatus.bad_request_400.value
         except SQLAlchemyError as err:
             db.session.rollback()
             response = {"error": str(err)}
             return response, HttpStatus.bad_request_400.value
 
+def check_bulk_dict(bulk_dict, *names):
+    """Returns the errors of a bulk request body that isn't an object, or
+    whose members with the given names aren't objects."""
+    if not isinstance(bulk_dict, dict):
+        return {'message': 'Please, provide an object with the {0}'.format(
+            ' and the '.join(names))}
+    return {name: {'_schema': ['Please, provide an object.']}
+            for name in names
+            if not isinstance(bulk_dict.get(name) or {}, dict)}
+
+class NotificationBulkResource(AuthenticationRequiredResource):
+
+    def post(self):
+        # Accepts either a JSON array or newline delimited JSON (NDJSON)
+        if request.mimetype == 'application/x-ndjson':
+            notification_dicts = []
+            for line in request.get_data(as_text=True).splitlines():
+                if not line.strip():
+                    continue
+                try:
+                    notification_dicts.append(json.loads(line))
+                except ValueError:
+                    # The item is reported as invalid along with the others
+                    notification_dicts.append(None)
+        else:
+            notification_dicts = request.get_json(silent=True)
+            if not isinstance(notification_dicts, list):
+                response = {'message': 'Please, provide a list of'
+                            ' notifications'}
+                return response, HttpStatus.bad_request_400.value
+
+        if not notification_dicts:
+            response = {'message': 'No input data provided'}
+            return response, HttpStatus.bad_request_400.value
+        if len(notification_dicts) > current_app.config['BULK_MAX_ITEMS']:
+            response = {'message': 'Please, provide no more than {0}'
+                        ' notifications'.format(
+                            current_app.config['BULK_MAX_ITEMS'])}
+            return response, HttpStatus.request_entity_too_large_413.value
+
+        try:
+            results = create_notifications(notification_dicts)
+        except SQLAlchemyError as err:
+            db.session.rollback()
+            response = {'error': str(err)}
+            return response, HttpStatus.bad_request_400.value
+
+        created = sum(1 for result in results
+                      if result['status'] == HttpStatus.created_201.value)
+        response = {
+            'results': results,
+            'created': created,
+            'rejected': len(results) - created}
+        if created == len(results):
+            return response, HttpStatus.created_201.value
+        return response, HttpStatus.multi_status_207.value
+
+    def patch(self):
+        bulk_dict = request.get_json()
+        if not bulk_dict:
+            response = {'message': 'No input data provided'}
+            return response, HttpStatus.bad_request_400.value
+        errors = check_bulk_dict(bulk_dict, 'selection', 'changes')
+        if errors:
+            return errors, HttpStatus.bad_request_400.value
+
+        selection, selection_errors = notification_selection_schema.load(
+            bulk_dict.get('selection') or {})
+        changes, changes_errors = notification_changes_schema.load(
+            bulk_dict.get('changes') or {})
+        if selection_errors or changes_errors:
+            response = {}
+            if selection_errors:
+                response['selection'] = selection_errors
+            if changes_errors:
+                response['changes'] = changes_errors
+            return response, HttpStatus.bad_request_400.value
+
+        try:
+            affected_rows = update_notifications(selection, changes)
+            return {'affected': affected_rows}
+        except SQLAlchemyError as err:
+            db.session.rollback()
+            response = {'error': str(err)}
+            return response, HttpStatus.bad_request_400.value
+
+    def delete(self):
+        bulk_dict = request.get_json()
+        if not bulk_dict:
+            response = {'message': 'No input data provided'}
+            return response, HttpStatus.bad_request_400.value
+        errors = check_bulk_dict(bulk_dict, 'selection')
+        if errors:
+            return errors, HttpStatus.bad_request_400.value
+
+        selection, errors = notification_selection_schema.load(
+            bulk_dict.get('selection') or {})
+        if errors:
+            return {'selection': errors}, HttpStatus.bad_request_400.value
+
+        try:
+            affected_rows = delete_notifications(selection)
+            return {'affected': affected_rows}
+        except SQLAlchemyError as err:
+            db.session.rollback()
+            response = {'error': str(err)}
+            return response, HttpStatus.bad_request_400.value
+
+class NotificationExportResource(AuthenticationRequiredResource):
+
+    def get(self):
+        arguments, errors = notification_export_schema.load(request.args)
+        if errors:
+            return errors, HttpStatus.bad_request_400.value
+
+        chunks = export_notifications(
+            arguments, current_app.config['EXPORT_BATCH_SIZE'])
+        response = Response(
+            stream_with_context(chunks),
+            mimetype=EXPORT_MIMETYPES[arguments['format']])
+        response.headers['Content-Disposition'] = \
+            'attachment; filename=notifications.{0}'.format(
+                arguments['format'])
+        return response
+
+class NotificationImportResource(AuthenticationRequiredResource):
+
+    def post(self):
+        transfer_format = request.args.get('format') or \
+            get_format(request.mimetype)
+        if transfer_format not in EXPORT_MIMETYPES:
+            response = {'message': 'Please, provide NDJSON ({0}) or CSV'
+                        ' ({1}) data'.format(EXPORT_MIMETYPES['ndjson'],
+                                             EXPORT_MIMETYPES['csv'])}
+            return response, HttpStatus.unsupported_media_type_415.value
+
+        # Parse the body as it is received instead of loading it at once
+        lines = io.TextIOWrapper(request.stream, encoding='utf-8', newline='')
+        summary = import_notifications(
+            lines,
+            transfer_format,
+            current_app.config['IMPORT_BATCH_SIZE'])
+        if 'error' in summary:
+            # The batches imported before the error stay committed
+            return summary, HttpStatus.bad_request_400.value
+        if summary['rejected']:
+            return summary, HttpStatus.multi_status_207.value
+        return summary, HttpStatus.created_201.value
+
 class NotificationCategoryResource(AuthenticationRequiredResource):
 
+    @response_cache.cached('notification_category', 'notification')
     def get(self, id):
-        notification_category = NotificationCategory.query.get_or_404(id)
-        dump_result = notification_category_schema.dump(notification_category)\
-            .data
-        return dump_result
+        notification_category = NotificationCategory.query\
+            .options(*eager_loading_options(
+                NotificationCategory, notification_category_schema))\
+            .get_or_404(id)
+        NotificationCategory.load_embedded_notifications(
+            [notification_category])
+        expire_with_embedded_notifications([notification_category])
+        return conditional_response(
+            notification_category, notification_category_schema)
 
     def patch(self, id):
         notification_category = NotificationCategory.query.get_or_404(id)
+        if precondition_failed(
+                notification_category, notification_category_schema):
+            response = {'error': 'The notification category has been'
+                        ' modified'}
+            return response, HttpStatus.precondition_failed_412.value
         notification_category_dict = request.get_json()
 
         if not notification_category_dict:
@@ -234,9 +546,14 @@ class NotificationCategoryResource(AuthenticationRequiredResource):
                 else:
                     response = {'error': 'A category with the name <{0}> already'
                                 ' exists'.format(notification_category_name)}
-                    return HttpStatus.bad_request_400.value
+                    return response, HttpStatus.bad_request_400.value
             notification_category.update()
             return self.get(id)
+        except StaleDataError:
+            db.session.rollback()
+            response = {'error': 'The notification category has been'
+                        ' modified'}
+            return response, HttpStatus.precondition_failed_412.value
         except SQLAlchemyError as err:
             db.session.rollback()
             response = {'error': str(err)}
@@ -244,11 +561,20 @@ class NotificationCategoryResource(AuthenticationRequiredResource):
 
     def delete(self, id):
         notification_category = NotificationCategory.query.get_or_404(id)
+        if precondition_failed(
+                notification_category, notification_category_schema):
+            response = {'error': 'The notification category has been'
+                        ' modified'}
+            return response, HttpStatus.precondition_failed_412.value
 
         try:
             notification_category.delete(notification_category)
-            response = make_response()
-            return response, HttpStatus.no_content_204.value
+            return make_response('', HttpStatus.no_content_204.value)
+        except StaleDataError:
+            db.session.rollback()
+            response = {'error': 'The notification category has been'
+                        ' modified'}
+            return response, HttpStatus.precondition_failed_412.value
         except SQLAlchemyError as err:
             db.session.rollback()
             response = {'error': str(err)}
@@ -256,15 +582,20 @@ class NotificationCategoryResource(AuthenticationRequiredResource):
 
 class NotificationCategoryListResource(AuthenticationRequiredResource):
 
+    @response_cache.cached('notification_category', 'notification')
     def get(self):
-        notification_categories = NotificationCategory.query.all()
-        dump_results = notification_category_schema.dump(
-            notification_categories, many=True).data
-        return dump_results
+        notification_categories = NotificationCategory.query\
+            .options(*eager_loading_options(
+                NotificationCategory, notification_category_schema))\
+            .all()
+        NotificationCategory.load_embedded_notifications(
+            notification_categories)
+        expire_with_embedded_notifications(notification_categories)
+        dump_results = dump(
+            notification_category_schema, notification_categories, many=True)
+        return conditional_payload_response(dump_results)
 
     def post(self):
-        print("Processing")
-
         notification_category_dict = request.get_json()
         if not notification_category_dict:
             response = {'message': 'No input data provided'}
@@ -276,25 +607,37 @@ class NotificationCategoryListResource(AuthenticationRequiredResource):
             return errors, HttpStatus.bad_request_400.value
 
         notification_category_name = notification_category_dict['name']
-        if not NotificationCategory.is_name_unique(id=0, name=notification_category_name):
-            response = {'error': 'A notification category with the name'
-                        ' <{0}> already exists'.format(notification_category_name)}
-            return response, HttpStatus.bad_request_400.value
-
         try:
             notification_category = NotificationCategory(
                     notification_category_name)
-            notification_category.add(notification_category)
-            query = NotificationCategory.query.get(notification_category.id)
-            dump_result = notification_category_schema.dump(query).data
+            dump_result = notification_category.add_and_dump(
+                notification_category, notification_category_schema)
             return dump_result, HttpStatus.created_201.value
+        except IntegrityError:
+            # The unique constraint of the name rejected the category
+            db.session.rollback()
+            response = {'error': 'A notification category with the name'
+                        ' <{0}> already exists'.format(notification_category_name)}
+            return response, HttpStatus.bad_request_400.value
         except SQLAlchemyError as err:
-            print("Error")
-            print(err)
             db.session.rollback()
             response = {"error": str(err)}
             return response, HttpStatus.bad_request_400.value
 
+class MetricsResource(AuthenticationRequiredResource):
+
+    def get(self):
+        response = {
+            'pool': pool_metrics.stats(db.engine.pool),
+            'replicas': db.get_replica_set().stats(),
+            'credential_cache': credential_cache.stats(),
+            'count_cache': count_cache.stats(),
+            'response_cache': response_cache.stats(),
+            'display_counter_buffer': display_counter_buffer.stats(),
+            'notification_reaper': notification_reaper.stats()
+        }
+        return response, HttpStatus.ok_200.value
+
 service.add_resource(NotificationCategoryListResource,
         '/notification_categories/')
 service.add_resource(NotificationCategoryResource,
@@ -303,7 +646,19 @@ service.add_resource(NotificationListResource,
         '/notifications/')
 service.add_resource(NotificationResource,
         '/notifications/<int:id>')
+service.add_resource(NotificationDisplayResource,
+        '/notifications/<int:id>/displayed/')
+service.add_resource(NotificationBulkResource,
+        '/notifications/bulk/')
+service.add_resource(NotificationExportResource,
+        '/notifications/export/')
+service.add_resource(NotificationImportResource,
+        '/notifications/import/')
 service.add_resource(UserListResource,
         '/users/')
 service.add_resource(UserResource,
         '/users/<int:id>')
+service.add_resource(TokenResource,
+        '/tokens/')
+service.add_resource(MetricsResource,
+        '/metrics/')
@@ -0,0 +1,31 @@
+"""
+This package contains the benchmarks for the NotificationManager of the
+in-memory service. Each module can be run from the service directory, e.g.
+`python -m benchmarks.concurrency_benchmark`.
+"""
+import random
+
+from datetime import datetime
+
+from pytz import utc
+
+from models import NotificationModel
+
+CATEGORIES = ('Information', 'Warning', 'Error', 'Critical')
+
+
+def create_notification(i):
+    """Returns a new NotificationModel instance, numbered with i."""
+    return NotificationModel(
+        message='Benchmark notification {0}'.format(i),
+        ttl=3600,
+        creation_date=datetime.now(utc),
+        notification_category=random.choice(CATEGORIES))
+
+def report(title, header, rows):
+    print(title)
+    print('  ' + ''.join('{0:>16}'.format(name) for name in header))
+    for row in rows:
+        print('  ' + ''.join(
+            '{0:>16.1f}'.format(value) if isinstance(value, float)
+            else '{0:>16}'.format(value) for value in row))
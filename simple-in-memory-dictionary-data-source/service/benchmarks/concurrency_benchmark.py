@@ -0,0 +1,84 @@
+"""
+This module stresses a NotificationManager shared by 1, 4 and 16 threads that
+insert, read, list, update and delete notifications at the same time, checks
+that the ids are never duplicated and that no operation fails, and reports
+the operations per second.
+"""
+import argparse
+import random
+import threading
+import time
+
+from benchmarks import create_notification, report
+from service import NotificationManager
+
+THREAD_COUNTS = (1, 4, 16)
+
+
+def work(manager, operations, ids, errors):
+    inserted = []
+    try:
+        for i in range(operations):
+            operation = i % 10
+            if operation < 4 or not inserted:
+                notification = create_notification(i)
+                manager.insert_notification(notification)
+                inserted.append(notification.id)
+            elif operation < 7:
+                try:
+                    manager.get_notification(random.choice(inserted))
+                except KeyError:
+                    # Expired notifications are gone, which is expected
+                    pass
+            elif operation == 7:
+                # Iterate the whole list while the other threads change it
+                for notification in manager.list_notifications():
+                    notification.id
+            elif operation == 8:
+                try:
+                    manager.update_notification(
+                        random.choice(inserted), displayed_once=True)
+                except KeyError:
+                    pass
+            else:
+                manager.delete_notification(inserted.pop())
+    except Exception as err:
+        errors.append(err)
+    ids.extend(inserted)
+
+def run(operations, list_size):
+    rows = []
+    for thread_count in THREAD_COUNTS:
+        manager = NotificationManager()
+        # Give the lists something to iterate
+        for i in range(list_size):
+            manager.insert_notification(create_notification(i))
+        first_id = NotificationManager.last_id
+        ids = []
+        errors = []
+        threads = [
+            threading.Thread(
+                target=work,
+                args=(manager, operations // thread_count, ids, errors))
+            for _ in range(thread_count)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        assert not errors, errors
+        assert len(ids) == len(set(ids)), 'Duplicated ids'
+        allocated = NotificationManager.last_id - first_id
+        assert len(manager.notifications) == list_size + len(ids)
+        rows.append((thread_count, allocated,
+                     operations // thread_count * thread_count / elapsed))
+    report('NotificationManager under concurrent load',
+           ('threads', 'inserted', 'operations/s'), rows)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--operations', type=int, default=200000)
+    parser.add_argument('--list-size', type=int, default=1000)
+    arguments = parser.parse_args()
+    run(arguments.operations, arguments.list_size)
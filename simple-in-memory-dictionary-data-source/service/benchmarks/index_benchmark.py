@@ -0,0 +1,79 @@
+"""
+This module fills a NotificationManager with 1M notifications and compares
+the latency of the filtered queries answered by its secondary indexes with
+the same queries answered by scanning every notification.
+"""
+import argparse
+import time
+
+from datetime import timedelta
+
+from benchmarks import CATEGORIES, create_notification, report
+from service import NotificationManager
+
+
+def scan(manager, notification_category=None, displayed_once=None,
+         created_after=None, created_before=None, sort='creation_date'):
+    """The query without indexes: a full scan followed by a sort."""
+    notifications = [
+        notification for notification in manager.notifications.values()
+        if (notification_category is None or
+            notification.notification_category == notification_category) and
+           (displayed_once is None or
+            notification.displayed_once == displayed_once) and
+           (created_after is None or
+            notification.creation_date >= created_after) and
+           (created_before is None or
+            notification.creation_date < created_before)]
+    notifications.sort(key=lambda notification: notification.creation_date,
+                       reverse=sort == '-creation_date')
+    return notifications
+
+def measure(function, repetitions, **filters):
+    start = time.perf_counter()
+    for _ in range(repetitions):
+        result = function(**filters)
+    return (time.perf_counter() - start) * 1000 / repetitions, len(result)
+
+def run(count, repetitions):
+    manager = NotificationManager()
+    start = time.perf_counter()
+    for i in range(count):
+        manager.insert_notification(create_notification(i))
+    insert_rate = count / (time.perf_counter() - start)
+    print('Inserted {0} notifications, {1:.0f}/s'.format(count, insert_rate))
+    # Mark 1% of the notifications as displayed
+    for id in range(1, count + 1, 100):
+        manager.update_notification(id, displayed_once=True)
+    first = manager.notifications[1].creation_date
+    last = manager.notifications[count].creation_date
+    recent = last - (last - first) / 100 - timedelta(microseconds=1)
+
+    queries = (
+        ('category', {'notification_category': CATEGORIES[0]}),
+        ('displayed_once', {'displayed_once': True}),
+        ('last 1%', {'created_after': recent}),
+        ('category+last 1%', {'notification_category': CATEGORIES[0],
+                              'created_after': recent,
+                              'sort': '-creation_date'}),
+        ('category+shown', {'notification_category': CATEGORIES[0],
+                            'displayed_once': True}),
+    )
+    rows = []
+    for name, filters in queries:
+        indexed_ms, indexed_count = measure(
+            manager.query_notifications, repetitions, **filters)
+        scan_ms, scan_count = measure(
+            lambda **filters: scan(manager, **filters), repetitions,
+            **filters)
+        assert indexed_count == scan_count, (name, indexed_count, scan_count)
+        rows.append((name, indexed_count, indexed_ms, scan_ms))
+    report('Query latency with {0} notifications (ms)'.format(count),
+           ('query', 'results', 'indexed ms', 'scan ms'), rows)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--count', type=int, default=1000000)
+    parser.add_argument('--repetitions', type=int, default=5)
+    arguments = parser.parse_args()
+    run(arguments.count, arguments.repetitions)
@@ -0,0 +1,82 @@
+"""
+This module measures the memory used by each notification stored in a
+NotificationManager, comparing the compact NotificationModel with the former
+representation: a regular object with a __dict__, a datetime creation date
+and a separate category string for each notification, as parsed from each
+request.
+"""
+import argparse
+import gc
+import random
+import tracemalloc
+
+from datetime import datetime, timedelta
+
+from pytz import utc
+
+from benchmarks import CATEGORIES, report
+from models import NotificationModel
+from service import NotificationManager
+
+
+class DictNotificationModel:
+    """The former NotificationModel, with the same interface."""
+    def __init__(self, message, ttl, creation_date, notification_category):
+        self.id = 0
+        self.message = message
+        self.ttl = ttl
+        self.creation_date = creation_date
+        self.notification_category = notification_category
+        self.displayed_times = 0
+        self.displayed_once = False
+
+    @property
+    def creation_timestamp(self):
+        return self.creation_date.timestamp()
+
+    @property
+    def expiration_timestamp(self):
+        return self.creation_timestamp + self.ttl
+
+    @property
+    def expiration_date(self):
+        return self.creation_date + timedelta(seconds=self.ttl)
+
+
+def measure(model_class, count):
+    """Returns the bytes per notification of the model instances alone and
+    of the manager that stores them, indexes included."""
+    gc.collect()
+    tracemalloc.start()
+    notifications = []
+    for i in range(count):
+        # A new string for each notification, like the parsed requests
+        category = ''.join(random.choice(CATEGORIES))
+        notifications.append(model_class(
+            message='Benchmark notification {0}'.format(i),
+            ttl=3600,
+            creation_date=datetime.now(utc),
+            notification_category=category))
+    models_size, _ = tracemalloc.get_traced_memory()
+    manager = NotificationManager()
+    for notification in notifications:
+        manager.insert_notification(notification)
+    del notifications
+    gc.collect()
+    manager_size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return models_size / count, manager_size / count
+
+def run(count):
+    rows = []
+    for name, model_class in (('dict + datetime', DictNotificationModel),
+                              ('slots + epoch', NotificationModel)):
+        model_bytes, manager_bytes = measure(model_class, count)
+        rows.append((name, model_bytes, manager_bytes))
+    report('Bytes per notification with {0} notifications'.format(count),
+           ('model', 'instances', 'stored'), rows)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--count', type=int, default=200000)
+    run(parser.parse_args().count)
@@ -0,0 +1,61 @@
+"""
+This module measures the latency of the GET requests that list all the
+notifications: marshalling every notification for each request, as the list
+did before the representations were cached, and joining the cached
+representations, both right after they were invalidated (cold) and once they
+are cached (warm).
+"""
+import argparse
+import statistics
+import time
+
+from flask_restful import marshal_with, Resource
+
+from benchmarks import create_notification, report
+from service import app, notification_fields, notification_manager, service
+
+REPETITIONS = 5
+
+
+class MarshalledNotificationList(Resource):
+    """The former list, marshalled for each request."""
+    @marshal_with(notification_fields)
+    def get(self):
+        return list(notification_manager.list_notifications())
+
+service.add_resource(MarshalledNotificationList, '/benchmark/notifications/')
+
+
+def measure(client, url, invalidate=False):
+    """Returns the median milliseconds taken by a GET of the url."""
+    durations = []
+    for _ in range(REPETITIONS):
+        if invalidate:
+            for notification in notification_manager.list_notifications():
+                notification.representation = None
+        start = time.perf_counter()
+        response = client.get(url)
+        durations.append(time.perf_counter() - start)
+        assert response.status_code == 200
+    return statistics.median(durations) * 1000
+
+def run(counts):
+    client = app.test_client()
+    rows = []
+    for count in counts:
+        for i in range(count - len(notification_manager.notifications)):
+            notification_manager.insert_notification(create_notification(i))
+        rows.append((count,
+                     measure(client, '/benchmark/notifications/'),
+                     measure(client, '/service/notifications/',
+                             invalidate=True),
+                     measure(client, '/service/notifications/')))
+    report('Milliseconds per GET of the whole list',
+           ('notifications', 'marshalled', 'cached (cold)', 'cached (warm)'),
+           rows)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--counts', type=int, nargs='+',
+                        default=[10000, 100000])
+    run(parser.parse_args().counts)
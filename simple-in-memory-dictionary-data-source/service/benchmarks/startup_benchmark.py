@@ -0,0 +1,85 @@
+"""
+This module measures how long the NotificationManager takes to restore the
+notifications persisted by a NotificationStore: replaying the whole log,
+loading a snapshot, and loading a snapshot followed by a log with a tenth of
+the changes. It compares them with replaying the notifications as POST
+requests, measured with a sample and extrapolated to all of them.
+"""
+import argparse
+import shutil
+import tempfile
+import time
+
+from flask import json
+
+from benchmarks import CATEGORIES, create_notification, report
+from persistence import NotificationStore
+from service import app, NotificationManager
+
+POST_SAMPLE_SIZE = 10000
+
+
+def restore(directory):
+    """Returns the seconds taken to restore the notifications."""
+    store = NotificationStore(directory)
+    start = time.perf_counter()
+    manager = NotificationManager(store)
+    elapsed = time.perf_counter() - start
+    store.close()
+    return elapsed, len(manager.notifications)
+
+def replay_posts(count):
+    """Returns the seconds taken to POST count notifications."""
+    client = app.test_client()
+    start = time.perf_counter()
+    for i in range(count):
+        client.post(
+            '/service/notifications/',
+            data=json.dumps({
+                'message': 'Benchmark notification {0}'.format(i),
+                'ttl': 3600,
+                'notification_category': CATEGORIES[i % len(CATEGORIES)]}),
+            content_type='application/json')
+    return time.perf_counter() - start
+
+def run(count):
+    directory = tempfile.mkdtemp()
+    try:
+        store = NotificationStore(directory, fsync_batch_size=0)
+        manager = NotificationManager(store)
+        start = time.perf_counter()
+        for i in range(count):
+            manager.insert_notification(create_notification(i))
+        log_seconds = time.perf_counter() - start
+        store.close()
+        rows = [('write log', log_seconds, count)]
+        rows.append(('replay log',) + restore(directory))
+
+        store = NotificationStore(directory, fsync_batch_size=0)
+        manager = NotificationManager(store)
+        start = time.perf_counter()
+        manager.snapshot()
+        rows.append(('write snapshot', time.perf_counter() - start, count))
+        rows.append(('load snapshot',) + restore(directory))
+
+        ids = list(manager.notifications)
+        for id in ids[:count // 20]:
+            manager.update_notification(id, displayed_times=1,
+                                        displayed_once=True)
+        for id in ids[-(count // 20):]:
+            manager.delete_notification(id)
+        store.close()
+        rows.append(('snapshot + log',) + restore(directory))
+
+        sample = min(count, POST_SAMPLE_SIZE)
+        rows.append(('POST (estimated)',
+                     replay_posts(sample) * count / sample, count))
+        report('Seconds to restore {0} notifications'.format(count),
+               ('operation', 'seconds', 'notifications'), rows)
+    finally:
+        shutil.rmtree(directory)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--count', type=int, default=1000000)
+    run(parser.parse_args().count)
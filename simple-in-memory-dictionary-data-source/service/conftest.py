@@ -0,0 +1,29 @@
+"""
+This module declares the pytest fixture functions. These provide a fixed baseline
+to enable us to reliably and repeatedly execute tests.
+"""
+import pytest
+
+import service
+from persistence import NotificationStore
+from service import app, NotificationManager
+
+@pytest.fixture
+def notification_manager(monkeypatch):
+    # The ids are allocated by a class attribute, shared by the managers
+    monkeypatch.setattr(NotificationManager, 'last_id', 0)
+    notification_manager = NotificationManager()
+    # The resources use the manager of the module when they are called
+    monkeypatch.setattr(service, 'notification_manager', notification_manager)
+    return notification_manager
+
+@pytest.fixture
+def client(notification_manager):
+    return app.test_client()
+
+@pytest.fixture
+def notification_store(tmpdir, monkeypatch):
+    monkeypatch.setattr(NotificationManager, 'last_id', 0)
+    notification_store = NotificationStore(str(tmpdir))
+    yield notification_store
+    notification_store.close()
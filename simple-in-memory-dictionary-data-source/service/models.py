@@ -3,14 +3,91 @@ This module contains the NotifcationModel class that will be used to represent
 notifications. This model won't be persisting data in any database or file. It
 just provides the required attributes and no mapping information.
 """
+import sys
+
+from datetime import datetime
+
+from pytz import utc
+
 class NotificationModel:
-    """Represents all the necessary attributes to an RESTful in-memory API"""
+    """Represents all the necessary attributes to an RESTful in-memory API
+
+    The instances are compact, since the service keeps millions of them in
+    memory: the attributes are stored in slots instead of a per-instance
+    dictionary, the creation date as a POSIX timestamp instead of a datetime
+    and the category names are interned, so all the notifications of a
+    category share the same string. The creation_date and expiration_date
+    properties still provide timezone aware datetime instances.
+
+    The representation attribute caches the JSON rendered for the
+    notification by the service, until it changes."""
+    __slots__ = ('id', 'message', 'ttl', 'creation_timestamp',
+                 'notification_category', 'displayed_times', 'displayed_once',
+                 'representation')
+
     def __init__(self, message, ttl, creation_date, notification_category):
         # Id will be automatically generated
         self.id = 0
         self.message = message
         self.ttl = ttl
         self.creation_date = creation_date
-        self.notification_category = notification_category
+        self.notification_category = sys.intern(notification_category)
         self.displayed_times = 0
         self.displayed_once = False
+        self.representation = None
+
+    @classmethod
+    def from_record(cls, id, message, ttl, creation_timestamp,
+                    notification_category, displayed_times, displayed_once):
+        """Creates a notification from the attributes of a persisted record,
+        in the order of __slots__, without parsing a creation date."""
+        notification = cls.__new__(cls)
+        notification.id = id
+        notification.message = message
+        notification.ttl = ttl
+        notification.creation_timestamp = creation_timestamp
+        notification.notification_category = sys.intern(
+            notification_category)
+        notification.displayed_times = displayed_times
+        notification.displayed_once = displayed_once
+        notification.representation = None
+        return notification
+
+    def to_record(self):
+        """Returns the attributes in the order that from_record receives."""
+        return (self.id, self.message, self.ttl, self.creation_timestamp,
+                self.notification_category, self.displayed_times,
+                self.displayed_once)
+
+    def __marshallable__(self):
+        """The attributes that flask_restful marshals, since the slotted
+        instances don't have a __dict__."""
+        return {
+            'id': self.id,
+            'message': self.message,
+            'ttl': self.ttl,
+            'creation_date': self.creation_date,
+            'notification_category': self.notification_category,
+            'displayed_times': self.displayed_times,
+            'displayed_once': self.displayed_once
+        }
+
+    @property
+    def creation_date(self):
+        return datetime.fromtimestamp(self.creation_timestamp, utc)
+
+    @creation_date.setter
+    def creation_date(self, creation_date):
+        self.creation_timestamp = creation_date.timestamp()
+
+    @property
+    def expiration_timestamp(self):
+        """The POSIX timestamp when the notification expires, ttl seconds
+        after its creation."""
+        return self.creation_timestamp + self.ttl
+
+    @property
+    def expiration_date(self):
+        """The date when the notification expires, ttl seconds after its
+        creation."""
+        return datetime.fromtimestamp(self.expiration_timestamp, utc)
@@ -0,0 +1,268 @@
+"""
+This module contains the optional durability of the NotificationManager: an
+append-only log of the inserts, updates and deletes, and compact snapshots of
+all the notifications that replace the log whenever they are written. At
+startup the manager loads the last snapshot through a memory map and replays
+the log written after it.
+"""
+import json
+import logging
+import mmap
+import os
+import shutil
+import struct
+import threading
+import time
+
+from models import NotificationModel
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_FILE_NAME = 'notifications.snapshot'
+LOG_FILE_NAME = 'notifications.log'
+# The log replaced by the snapshot being written
+ROTATED_LOG_FILE_NAME = 'notifications.log.1'
+SNAPSHOT_MAGIC = b'NOTIFSN2'
+# Magic, last id, number of categories and number of notifications
+SNAPSHOT_HEADER = struct.Struct('<8sqIq')
+# Category name length, followed by the UTF-8 encoded name
+CATEGORY_HEADER = struct.Struct('<I')
+# Id, ttl, creation timestamp, displayed times, displayed once, category
+# number and message length, followed by the UTF-8 encoded message
+RECORD_HEADER = struct.Struct('<qqdq?II')
+# The category and record headers by snapshot version; the first one
+# limited the categories to 65535
+SNAPSHOT_FORMATS = {
+    b'NOTIFSN1': (struct.Struct('<H'), struct.Struct('<qqdq?HI')),
+    SNAPSHOT_MAGIC: (CATEGORY_HEADER, RECORD_HEADER)
+}
+# The log operations
+INSERT = 'i'
+UPDATE = 'u'
+DELETE = 'd'
+
+
+class NotificationStore():
+    """Persists the notifications of a NotificationManager in a directory.
+
+    Each change is appended to the log as a JSON line. The lines are handed
+    to the operating system right away, so they survive a crash of the
+    process, and fsync'ed every fsync_batch_size operations, so at most
+    fsync_batch_size - 1 operations are lost if the machine fails. A
+    fsync_batch_size of 1 syncs every operation and 0 only syncs when a
+    snapshot is written or the store is closed.
+
+    Writing a snapshot renames the log to notifications.log.1 and starts a
+    new one, both while the manager holds its lock, and deletes the renamed
+    log once the snapshot replaced the previous one. If the snapshot fails,
+    the next one appends the log to notifications.log.1 instead. Every
+    operation of the log sets absolute values, so when the process stops in
+    between, loading replays notifications.log.1 and then notifications.log
+    over whichever snapshot is found with the same result."""
+    def __init__(self, directory, fsync_batch_size=100):
+        self.directory = directory
+        self.fsync_batch_size = fsync_batch_size
+        self.snapshots = 0
+        self.last_snapshot_duration = 0.0
+        self._unsynced = 0
+        self._log = None
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, file_name):
+        return os.path.join(self.directory, file_name)
+
+    def load(self):
+        """Returns the last id and a dictionary with the NotificationModel
+        instances persisted by the snapshot and the logs, and opens the log
+        to append the next operations."""
+        last_id, notifications = self.read_snapshot()
+        for file_name in (ROTATED_LOG_FILE_NAME, LOG_FILE_NAME):
+            last_id = self.replay_log(
+                self.path(file_name), last_id, notifications)
+        self._log = self.open_log(LOG_FILE_NAME)
+        return last_id, notifications
+
+    def open_log(self, file_name):
+        """Opens a log to append operations, after the incomplete line that
+        a crash can leave at its end."""
+        log = open(self.path(file_name), 'a', encoding='utf-8')
+        if log.tell() and not self.ends_with_newline(file_name):
+            log.write('\n')
+        return log
+
+    def ends_with_newline(self, file_name):
+        with open(self.path(file_name), 'rb') as log:
+            log.seek(-1, os.SEEK_END)
+            return log.read(1) == b'\n'
+
+    def read_snapshot(self):
+        path = self.path(SNAPSHOT_FILE_NAME)
+        notifications = {}
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            return 0, notifications
+        from_record = NotificationModel.from_record
+        with open(path, 'rb') as snapshot, \
+                mmap.mmap(snapshot.fileno(), 0, access=mmap.ACCESS_READ) \
+                as data:
+            magic, last_id, category_count, count = \
+                SNAPSHOT_HEADER.unpack_from(data)
+            if magic not in SNAPSHOT_FORMATS:
+                raise ValueError('{0} is not a snapshot'.format(path))
+            category_header, record_header = SNAPSHOT_FORMATS[magic]
+            unpack_record = record_header.unpack_from
+            record_size = record_header.size
+            offset = SNAPSHOT_HEADER.size
+            categories = []
+            for _ in range(category_count):
+                length, = category_header.unpack_from(data, offset)
+                offset += category_header.size
+                categories.append(
+                    data[offset:offset + length].decode('utf-8'))
+                offset += length
+            for _ in range(count):
+                id, ttl, creation_timestamp, displayed_times, \
+                    displayed_once, category, length = \
+                    unpack_record(data, offset)
+                offset += record_size
+                notifications[id] = from_record(
+                    id, data[offset:offset + length].decode('utf-8'), ttl,
+                    creation_timestamp, categories[category],
+                    displayed_times, displayed_once)
+                offset += length
+        return last_id, notifications
+
+    def replay_log(self, path, last_id, notifications):
+        if not os.path.exists(path):
+            return last_id
+        with open(path, encoding='utf-8') as log:
+            for line in log:
+                try:
+                    operation = json.loads(line)
+                except ValueError:
+                    # The last line of a log can be cut by a crash
+                    logger.warning('Skipping an incomplete line of %s', path)
+                    continue
+                if operation[0] == INSERT:
+                    notification = NotificationModel.from_record(
+                        *operation[1:])
+                    notifications[notification.id] = notification
+                    last_id = max(last_id, notification.id)
+                elif operation[0] == UPDATE:
+                    # The notification can have expired in the meantime
+                    notification = notifications.get(operation[1])
+                    if notification is not None:
+                        for name, value in operation[2].items():
+                            setattr(notification, name, value)
+                elif operation[0] == DELETE:
+                    notifications.pop(operation[1], None)
+        return last_id
+
+    def log_insert(self, notification):
+        self.append([INSERT] + list(notification.to_record()))
+
+    def log_update(self, id, changes):
+        self.append([UPDATE, id, changes])
+
+    def log_delete(self, id):
+        self.append([DELETE, id])
+
+    def append(self, operation):
+        self._log.write(json.dumps(operation) + '\n')
+        self._log.flush()
+        self._unsynced += 1
+        if self.fsync_batch_size and self._unsynced >= self.fsync_batch_size:
+            self.sync()
+
+    def sync(self):
+        if self._log is not None and self._unsynced:
+            self._log.flush()
+            os.fsync(self._log.fileno())
+            self._unsynced = 0
+
+    def rotate_log(self):
+        """Replaces the log with an empty one. Called, holding the lock of
+        the manager, along with taking the records of a snapshot.
+
+        The rotated log of a failed snapshot is still needed, since no
+        snapshot includes its operations, so the log is appended to it."""
+        self.sync()
+        self._log.close()
+        log_path = self.path(LOG_FILE_NAME)
+        rotated_log_path = self.path(ROTATED_LOG_FILE_NAME)
+        if os.path.exists(rotated_log_path):
+            with open(log_path, 'rb') as log, \
+                    self.open_log(ROTATED_LOG_FILE_NAME) as rotated_log:
+                rotated_log.flush()
+                shutil.copyfileobj(log, rotated_log.buffer)
+                rotated_log.flush()
+                os.fsync(rotated_log.fileno())
+            os.remove(log_path)
+        else:
+            os.replace(log_path, rotated_log_path)
+        self._log = open(log_path, 'a', encoding='utf-8')
+
+    def write_snapshot(self, last_id, records):
+        """Writes a snapshot with the records returned by
+        NotificationModel.to_record and deletes the rotated log."""
+        start = time.perf_counter()
+        categories = {}
+        for record in records:
+            categories.setdefault(record[4], len(categories))
+        path = self.path(SNAPSHOT_FILE_NAME)
+        temporary_path = path + '.tmp'
+        pack_record = RECORD_HEADER.pack
+        with open(temporary_path, 'wb') as snapshot:
+            snapshot.write(SNAPSHOT_HEADER.pack(
+                SNAPSHOT_MAGIC, last_id, len(categories), len(records)))
+            for category in categories:
+                encoded_category = category.encode('utf-8')
+                snapshot.write(CATEGORY_HEADER.pack(len(encoded_category)))
+                snapshot.write(encoded_category)
+            for id, message, ttl, creation_timestamp, category, \
+                    displayed_times, displayed_once in records:
+                encoded_message = message.encode('utf-8')
+                snapshot.write(pack_record(
+                    id, ttl, creation_timestamp, displayed_times,
+                    bool(displayed_once), categories[category],
+                    len(encoded_message)))
+                snapshot.write(encoded_message)
+            snapshot.flush()
+            os.fsync(snapshot.fileno())
+        os.replace(temporary_path, path)
+        rotated_log_path = self.path(ROTATED_LOG_FILE_NAME)
+        if os.path.exists(rotated_log_path):
+            os.remove(rotated_log_path)
+        self.snapshots += 1
+        self.last_snapshot_duration = time.perf_counter() - start
+
+    def close(self):
+        if self._log is not None:
+            self.sync()
+            self._log.close()
+            self._log = None
+
+
+class SnapshotWriter():
+    """Calls the snapshot method of a NotificationManager in a daemon thread
+    every interval seconds, which keeps the log short and the startup fast.
+    An interval of 0 disables the thread."""
+    def __init__(self, manager, interval=0):
+        self.manager = manager
+        self.interval = interval
+        self._thread = None
+
+    def start(self):
+        if self.interval and self._thread is None:
+            self._thread = threading.Thread(
+                target=self._write_periodically,
+                name='notification-snapshots', daemon=True)
+            self._thread.start()
+
+    def _write_periodically(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.manager.snapshot()
+            except Exception:
+                # Keep the thread alive, the next snapshot may succeed
+                logger.exception('Cannot write the notifications snapshot')
@@ -3,20 +3,121 @@ This module contains the NotificationManager object that is used to persist the
 NotificationModel instances in an in-memory dictionary. It also contains the
 CRUD (create, read, update, delete) methods that will be used by the application.
 """
-from flask import Flask
-from flask_restful import abort, Api, fields, marshal_with, reqparse, Resource
+import bisect
+import gc
+import heapq
+import json
+import os
+import threading
+import uuid
+
+from flask import current_app, Flask, request, Response, \
+        stream_with_context, url_for
+from flask_restful import abort, Api, fields, inputs, marshal, marshal_with, \
+        reqparse, Resource
+from collections import OrderedDict
 from datetime import datetime
+from operator import attrgetter
 from models import NotificationModel
 from http_status import HttpStatus
+from persistence import NotificationStore, SnapshotWriter
 from pytz import utc
 
 class NotificationManager():
     """This object will be the manager that persist the NotificationInstance
-    in an in-memory dictionary"""
+    in an in-memory dictionary.
+
+    The manager can be shared by the threads of a threaded server: a lock
+    serializes the changes (id allocation included), while the reads don't
+    take it. The lists are served from an immutable snapshot of the
+    notifications, rebuilt by the first list after a change (copy-on-write),
+    so they are never affected by concurrent changes.
+
+    The manager also maintains secondary indexes that answer the filtered
+    queries without scanning every notification: the ids by category, the
+    ids by displayed_once value and the (creation timestamp, id) tuples
+    sorted by creation date.
+
+    When a NotificationStore is received, the manager restores the
+    notifications that it persisted and logs every change to it, so they
+    survive a restart."""
     last_id = 0
+    SORT_ORDERS = ('creation_date', '-creation_date')
 
-    def __init__(self):
+    def __init__(self, store=None):
         self.notifications = {}
+        # A min-heap of (expiration timestamp, id) tuples, so the next
+        # notification to expire is always the first one, along with the
+        # number of its entries that are outdated
+        self.expirations = []
+        self.outdated_expirations = 0
+        self.ids_by_category = {}
+        self.ids_by_displayed_once = {True: set(), False: set()}
+        self.creation_index = []
+        # The JSON settings of the cached representations
+        self.representation_settings = None
+        self._lock = threading.RLock()
+        self._snapshot = None
+        self.store = store
+        if store is not None:
+            self.restore()
+
+    def restore(self):
+        """Loads the notifications persisted by the store, leaving out the
+        expired ones, and builds the indexes in a single pass.
+
+        The garbage collector is paused meanwhile: the millions of objects
+        created would otherwise trigger many collections that find nothing
+        to collect."""
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            last_id, loaded_notifications = self.store.load()
+            now = datetime.now(utc).timestamp()
+            notifications = {}
+            expirations = []
+            ids_by_category = {}
+            ids_by_displayed_once = {True: set(), False: set()}
+            creation_index = []
+            for id, notification in loaded_notifications.items():
+                expiration = notification.expiration_timestamp
+                if expiration <= now:
+                    continue
+                notifications[id] = notification
+                expirations.append((expiration, id))
+                ids_by_category.setdefault(
+                    notification.notification_category, set()).add(id)
+                ids_by_displayed_once[bool(notification.displayed_once)]\
+                    .add(id)
+                creation_index.append((notification.creation_timestamp, id))
+            heapq.heapify(expirations)
+            # Already sorted, unless the clock went back during a run
+            creation_index.sort()
+            with self._lock:
+                self.__class__.last_id = max(self.__class__.last_id, last_id)
+                self.notifications = notifications
+                self.expirations = expirations
+                self.outdated_expirations = 0
+                self.ids_by_category = ids_by_category
+                self.ids_by_displayed_once = ids_by_displayed_once
+                self.creation_index = creation_index
+                self._snapshot = None
+        finally:
+            if gc_enabled:
+                gc.enable()
+
+    def snapshot(self):
+        """Writes a snapshot of the notifications to the store, which then
+        discards the log of the changes that the snapshot includes.
+
+        Only taking the records and starting a new log holds the lock; the
+        snapshot is written while the changes go on."""
+        with self._lock:
+            records = [notification.to_record()
+                       for notification in self.notifications.values()]
+            last_id = self.__class__.last_id
+            self.store.rotate_log()
+        self.store.write_snapshot(last_id, records)
 
     def insert_notification(self, notification):
         """Insert a Nofitication into an in-memory dictionary.
@@ -29,9 +130,103 @@ class NotificationManager():
         Args:
             notification (NotificationModel): A NotificationModel instance
         """
-        self.__class__.last_id += 1
-        notification.id = self.__class__.last_id
-        self.notifications[self.__class__.last_id] = notification
+        with self._lock:
+            self.__class__.last_id += 1
+            notification.id = self.__class__.last_id
+            self.notifications[notification.id] = notification
+            self.schedule_expiration(notification)
+            self._index(notification)
+            self._snapshot = None
+            if self.store is not None:
+                self.store.log_insert(notification)
+
+    def _index(self, notification, creation_date=True):
+        self.ids_by_category.setdefault(
+            notification.notification_category, set()).add(notification.id)
+        self.ids_by_displayed_once[bool(notification.displayed_once)].add(
+            notification.id)
+        if not creation_date:
+            return
+        entry = (notification.creation_timestamp, notification.id)
+        # The notifications are usually inserted in creation order
+        if not self.creation_index or entry > self.creation_index[-1]:
+            self.creation_index.append(entry)
+        else:
+            bisect.insort(self.creation_index, entry)
+
+    def _unindex(self, notification, creation_date=True):
+        ids = self.ids_by_category[notification.notification_category]
+        ids.discard(notification.id)
+        if not ids:
+            del self.ids_by_category[notification.notification_category]
+        self.ids_by_displayed_once[bool(notification.displayed_once)]\
+            .discard(notification.id)
+        if not creation_date:
+            return
+        entry = (notification.creation_timestamp, notification.id)
+        position = bisect.bisect_left(self.creation_index, entry)
+        if position < len(self.creation_index) and \
+                self.creation_index[position] == entry:
+            del self.creation_index[position]
+
+    def schedule_expiration(self, notification):
+        """Schedules the expiration of a Notification.
+
+        Must be called again whenever the ttl of the notification changes.
+        The entries of the previous expiration dates, like the ones of the
+        deleted notifications, are left in the heap and skipped when they
+        are popped, until they are half of the heap and it is rebuilt.
+
+        Args:
+            notification (NotificationModel): A NotificationModel instance
+        """
+        with self._lock:
+            heapq.heappush(
+                self.expirations,
+                (notification.expiration_timestamp, notification.id))
+
+    def remove_expired_notifications(self):
+        """Removes the Notifications whose ttl has passed.
+
+        Pops the expired entries from the heap, which costs O(log n) for
+        each expired notification instead of scanning the whole dictionary.
+
+        Returns:
+            The number of removed notifications
+        """
+        now = datetime.now(utc).timestamp()
+        # Peek without the lock, which is only needed to remove
+        expirations = self.expirations
+        if not expirations or expirations[0][0] > now:
+            return 0
+        removed = 0
+        with self._lock:
+            while self.expirations and self.expirations[0][0] <= now:
+                expiration, id = heapq.heappop(self.expirations)
+                notification = self.notifications.get(id)
+                # Skip the entries of deleted notifications and outdated ttls
+                if notification is not None and \
+                        notification.expiration_timestamp == expiration:
+                    del self.notifications[id]
+                    self._unindex(notification)
+                    removed += 1
+                elif self.outdated_expirations:
+                    self.outdated_expirations -= 1
+            if removed:
+                self._snapshot = None
+        return removed
+
+    def _discard_expiration(self):
+        """Counts an entry of the heap that became outdated, and rebuilds
+        the heap from the notifications once half of it is outdated, which
+        keeps it proportional to the notifications for O(1) amortized."""
+        self.outdated_expirations += 1
+        if self.outdated_expirations * 2 > len(self.expirations):
+            self.expirations = [
+                (notification.expiration_timestamp, id)
+                for id, notification in self.notifications.items()]
+            heapq.heapify(self.expirations)
+            self.outdated_expirations = 0
 
     def get_notification(self, id):
         """Gets a Notification by its id.
@@ -43,9 +238,153 @@ class NotificationManager():
             id (int): Notifications dictionary id
         Returns:
             A NofiticationModel instance
+        Raises:
+            KeyError: There is no notification with the id
         """
         return self.notifications[id]
 
+    def list_notifications(self):
+        """Lists all the Notifications.
+
+        Returns:
+            A tuple with the NotificationModel instances, sorted by id,
+            which the changes made after the call don't modify
+        """
+        return self.get_snapshot()[0]
+
+    def get_snapshot(self):
+        """Returns a tuple with the NotificationModel instances, sorted by
+        id, along with a tuple with their ids, to seek an id through a
+        binary search.
+
+        The dictionary keeps the notifications in insertion order, which is
+        also the order of their ids."""
+        snapshot = self._snapshot
+        if snapshot is None:
+            with self._lock:
+                if self._snapshot is None:
+                    self._snapshot = (tuple(self.notifications.values()),
+                                      tuple(self.notifications))
+                snapshot = self._snapshot
+        return snapshot
+
+    def query_notifications(self, notification_category=None,
+                            displayed_once=None, created_after=None,
+                            created_before=None, sort='creation_date'):
+        """Lists the Notifications that match all the received filters.
+
+        The category and displayed_once filters are answered by their
+        indexes and the creation date range by a binary search in the
+        creation index, which also provides the sort order. When the
+        filtered ids are much fewer than the notifications in the range,
+        only those ids are sorted instead.
+
+        Args:
+            notification_category (str): Notification category name
+            displayed_once (bool): Whether the notification was displayed
+            created_after (datetime): Inclusive minimum creation date
+            created_before (datetime): Exclusive maximum creation date
+            sort (str): One of the NotificationManager.SORT_ORDERS
+        Returns:
+            A list of NotificationModel instances
+        """
+        with self._lock:
+            ids = None
+            if notification_category is not None:
+                ids = self.ids_by_category.get(notification_category, set())
+            if displayed_once is not None:
+                displayed_once_ids = self.ids_by_displayed_once[
+                    bool(displayed_once)]
+                ids = displayed_once_ids if ids is None else \
+                    ids.intersection(displayed_once_ids)
+            start = 0
+            end = len(self.creation_index)
+            if created_after is not None:
+                start = bisect.bisect_left(
+                    self.creation_index, (created_after.timestamp(),))
+            if created_before is not None:
+                end = bisect.bisect_left(
+                    self.creation_index, (created_before.timestamp(),))
+            # Sorting an id costs about as much as checking 20 entries
+            if ids is not None and len(ids) * 20 < end - start:
+                entries = sorted(
+                    entry for entry in (
+                        (self.notifications[id].creation_timestamp, id)
+                        for id in ids)
+                    if (created_after is None or
+                        entry[0] >= created_after.timestamp()) and
+                       (created_before is None or
+                        entry[0] < created_before.timestamp()))
+            else:
+                entries = self.creation_index[start:end]
+                if ids is not None:
+                    entries = [entry for entry in entries if entry[1] in ids]
+            if sort == '-creation_date':
+                entries.reverse()
+            return [self.notifications[id] for _, id in entries]
+
+    def update_notification(self, id, **changes):
+        """Updates the attributes of a Notification at once.
+
+        Args:
+            id (int): Notifications dictionary id
+            **changes: The new values of the attributes to update
+        Returns:
+            The updated NotificationModel instance
+        Raises:
+            KeyError: There is no notification with the id
+        """
+        with self._lock:
+            notification = self.notifications[id]
+            # The creation date doesn't change, so its index is kept
+            self._unindex(notification, creation_date=False)
+            for name, value in changes.items():
+                setattr(notification, name, value)
+            notification.representation = None
+            self._index(notification, creation_date=False)
+            if 'ttl' in changes:
+                self.schedule_expiration(notification)
+                self._discard_expiration()
+            if self.store is not None:
+                self.store.log_update(id, changes)
+            return notification
+
+    def get_representation(self, notification, render, settings=None):
+        """Gets the cached representation of a Notification, rendering it
+        with the render function when it isn't cached yet.
+
+        The representation is rendered and cached holding the lock, so an
+        update can't change the notification in between and leave an
+        outdated representation in the cache. The representations rendered
+        with other settings are discarded first.
+
+        Args:
+            notification (NotificationModel): A NotificationModel instance
+            render (function): Returns the representation of a notification
+            settings (str): Identifies the settings the render function uses
+        Returns:
+            The cached representation
+        """
+        if settings != self.representation_settings:
+            self.discard_representations(settings)
+        representation = notification.representation
+        if representation is None:
+            with self._lock:
+                representation = notification.representation
+                if representation is None:
+                    representation = notification.representation = \
+                        render(notification)
+        return representation
+
+    def discard_representations(self, settings):
+        """Discards the cached representations of all the Notifications,
+        since the next ones are rendered with different settings."""
+        with self._lock:
+            if settings != self.representation_settings:
+                for notification in self.notifications.values():
+                    notification.representation = None
+                self.representation_settings = settings
+
     def delete_notification(self, id):
         """Deletes a Notification from an in-memory dictionary.
 
@@ -54,8 +393,16 @@ class NotificationManager():
 
         Args:
             id (int): Integer key number of the notifications dictionary
+        Raises:
+            KeyError: There is no notification with the id
         """
-        del self.notifications[id]
+        with self._lock:
+            notification = self.notifications.pop(id)
+            self._unindex(notification)
+            self._discard_expiration()
+            self._snapshot = None
+            if self.store is not None:
+                self.store.log_delete(id)
 
 notification_fields = {
     'id': fields.Integer,
@@ -68,7 +415,124 @@ notification_fields = {
     'displayed_once': fields.Boolean
 }
 
-notification_manager = NotificationManager()
+# The notifications are only kept in memory unless a directory is provided
+NOTIFICATIONS_DIRECTORY = os.environ.get('NOTIFICATIONS_DIRECTORY')
+NOTIFICATIONS_FSYNC_BATCH_SIZE = int(
+    os.environ.get('NOTIFICATIONS_FSYNC_BATCH_SIZE', 100))
+NOTIFICATIONS_SNAPSHOT_INTERVAL = int(
+    os.environ.get('NOTIFICATIONS_SNAPSHOT_INTERVAL', 300))
+# The debug mode of the development server, which also indents the JSON
+NOTIFICATIONS_DEBUG = os.environ.get(
+    'NOTIFICATIONS_DEBUG', '1').lower() not in ('0', 'false', 'no')
+
+if NOTIFICATIONS_DIRECTORY:
+    notification_manager = NotificationManager(NotificationStore(
+        NOTIFICATIONS_DIRECTORY, NOTIFICATIONS_FSYNC_BATCH_SIZE))
+    SnapshotWriter(
+        notification_manager, NOTIFICATIONS_SNAPSHOT_INTERVAL).start()
+else:
+    notification_manager = NotificationManager()
+
+# The page size when only an offset or an id cursor is requested
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+# The notifications marshalled by each chunk of a streamed list
+STREAM_BATCH_SIZE = 1000
+
+class JSONLayout():
+    """Renders the notifications and joins their cached representations
+    into the same JSON that flask_restful renders for the marshalled
+    notifications, with the json.dumps settings of its responses: the
+    RESTFUL_JSON setting, along with the indentation of the debug mode.
+
+    json.dumps indents the items of a list one level deeper than the list
+    and separates them with the item separator followed, when indenting, by
+    a line break, so the representations rendered on their own are joined
+    and nested at any level."""
+    def __init__(self, settings):
+        self.settings = settings
+        self.key = repr(sorted(settings.items()))
+        indent = settings.get('indent')
+        self.indent = ' ' * indent if isinstance(indent, int) else indent
+        separators = settings.get('separators') or \
+            (', ' if self.indent is None else ',', ': ')
+        self.item_separator = separators[0].encode('utf-8')
+
+    @classmethod
+    def from_app(cls):
+        settings = dict(current_app.config.get('RESTFUL_JSON', {}))
+        if current_app.debug:
+            # The defaults of flask_restful.representations.json.output_json
+            settings.setdefault('indent', 4)
+            settings.setdefault('sort_keys', False)
+        return cls(settings)
+
+    def render(self, data):
+        return json.dumps(data, **self.settings).encode('utf-8')
+
+    def render_notification(self, notification):
+        """Returns the UTF-8 encoded JSON of the notification marshalled
+        with notification_fields, which the manager caches until it
+        changes.
+
+        The uri field is relative, so the cached representations are valid
+        as long as the service is mounted under the same script root."""
+        return self.render(marshal(notification, notification_fields))
+
+    def get_representations(self, notifications):
+        """Returns the cached representations of the notifications."""
+        get_representation = notification_manager.get_representation
+        return [get_representation(
+                    notification, self.render_notification, self.key)
+                for notification in notifications]
+
+    def new_line(self, level):
+        if self.indent is None:
+            return b''
+        return ('\n' + self.indent * level).encode('utf-8')
+
+    def nest(self, representations, level):
+        # The JSON strings escape their line breaks, so the line breaks
+        # only separate the items and the members
+        if self.indent is None or not level:
+            return representations
+        new_line = self.new_line(level)
+        return [representation.replace(b'\n', new_line)
+                for representation in representations]
+
+    def list_delimiters(self, level):
+        """Returns the opening, the separator and the closing of a non
+        empty list at the given level."""
+        return (b'[' + self.new_line(level + 1),
+                self.item_separator + self.new_line(level + 1),
+                self.new_line(level) + b']')
+
+    def join(self, representations, level=0):
+        if not representations:
+            return b'[]'
+        opening, separator, closing = self.list_delimiters(level)
+        return opening + \
+            separator.join(self.nest(representations, level + 1)) + closing
+
+    def join_object(self, items, list_name, representations):
+        """Renders the items of a dictionary, along with the list of
+        representations as the value of the list_name key."""
+        placeholder = '<{0}>'.format(uuid.uuid4().hex)
+        items[list_name] = placeholder
+        return self.render(items).replace(
+            json.dumps(placeholder).encode('utf-8'),
+            self.join(representations, level=1), 1)
+
+def get_representations(notifications):
+    """Returns the cached representations of the notifications, rendered
+    with the JSON settings of the application."""
+    return JSONLayout.from_app().get_representations(notifications)
+
+def json_response(body, status=HttpStatus.ok_200.value):
+    """Returns a response with a JSON body that is already encoded, with
+    the trailing new line of the flask_restful JSON responses."""
+    return Response(body + b'\n', status=status,
+                    mimetype='application/json')
 
 class Notification(Resource):
     """Represents the notification resource of the Flask-RESTful API
@@ -87,13 +551,21 @@ class Notification(Resource):
 
         Args:
             id (int): NotificationManager.notifications id key
+        Returns:
+            The NotificationModel instance, retrieved along with the check
+            so that a concurrent delete can't remove it in between
         """
-        if id not in notification_manager.notifications:
-            abort(
-                HttpStatus.not_found_404.value,
-                message="Notification {0} not found".format(id))
+        notification_manager.remove_expired_notifications()
+        try:
+            return notification_manager.get_notification(id)
+        except KeyError:
+            self.abort_notification_not_found(id)
+
+    def abort_notification_not_found(self, id):
+        abort(
+            HttpStatus.not_found_404.value,
+            message="Notification {0} not found".format(id))
 
-    @marshal_with(notification_fields)
     def get(self, id):
         """Retreives the resource with a particular id argument.
 
@@ -103,10 +575,11 @@ class Notification(Resource):
         Args:
             id (int): Notification id key
         Returns:
-            Notificaion object
+            A response with the cached representation of the Notificaion
+            object
         """
-        self.abort_if_notification_not_found(id)
-        return notification_manager.get_notification(id)
+        notification = self.abort_if_notification_not_found(id)
+        return json_response(get_representations([notification])[0])
 
     def delete(self, id):
         """Deletes the resource with a particular id argument.
@@ -120,7 +593,11 @@ class Notification(Resource):
             tuple pair with empty strings and the HTTP no content status code
         """
         self.abort_if_notification_not_found(id)
-        notification_manager.delete_notification(id)
+        try:
+            notification_manager.delete_notification(id)
+        except KeyError:
+            # Another request deleted it after the check
+            self.abort_notification_not_found(id)
         return '', HttpStatus.no_content_204.value
 
     @marshal_with(notification_fields)
@@ -141,23 +618,19 @@ class Notification(Resource):
             Notificaion object
         """
         self.abort_if_notification_not_found(id)
-        notification = notification_manager.get_notification(id)
         parser = reqparse.RequestParser()
         parser.add_argument('message', type=str)
         parser.add_argument('ttl', type=int)
         parser.add_argument('displayed_times', type=int)
         parser.add_argument('displayed_once', type=bool)
         args = parser.parse_args()
-        print(args)
-        if 'message' in args and args['message'] is not None:
-            notification.message = args['message']
-        if 'ttl' in args and args['ttl'] is not None:
-            notificatin.ttl = args['ttl']
-        if 'displayed_times' in args and args['displayed_times'] is not None:
-            notification.displayed_times = args['displayed_times']
-        if 'displayed_once' in args and args['displayed_once'] is not None:
-            notification.displayed_once = args['displayed_once']
-        return notification
+        # The manager applies all the changes at once
+        changes = {name: value for name, value in args.items()
+                   if value is not None}
+        try:
+            return notification_manager.update_notification(id, **changes)
+        except KeyError:
+            self.abort_notification_not_found(id)
 
 class NotificationList(Resource):
     """Represents the collection of notifications (resources)
@@ -165,19 +638,164 @@ class NotificationList(Resource):
     This class is a subclass of the flask_restful.Resource superclass and
     declares the following two methods that will be called when the HTTP method
     with the same name arrives as a request on the resource."""
-    @marshal_with(notification_fields)
     def get(self):
         """Returns a list with all the NotificationModel instances saved
-        in the notification_manager.notifications dictionary.
+        in the notification_manager.notifications dictionary, taken from
+        a snapshot that concurrent requests don't modify.
 
-        The marshal_with decorator will take each NotificationModel instance
-        in the returned list and apply the field filtering and output
-        formatting specified in notification_fields.
+        The notification_category, displayed_once, created_after and
+        created_before query arguments filter the list, and the sort
+        argument sorts it by creation date (prefixed with a minus sign, in
+        descending order).
+
+        The limit argument, along with offset or with one of the after_id
+        and before_id cursors, requests a page instead (see paginate). The
+        stream argument streams the whole list in chunks instead (see
+        stream).
+
+        Each NotificationModel instance is marshalled with the field
+        filtering and output formatting specified in notification_fields,
+        once: the list is made of their cached representations.
 
         Returns:
-           List of Notifications (resources)
+           List of Notifications (resources) or a page of them
         """
-        return [v for v in notification_manager.notifications.values()]
+        notification_manager.remove_expired_notifications()
+        parser = reqparse.RequestParser()
+        parser.add_argument('notification_category', type=str,
+                            location='args')
+        parser.add_argument('displayed_once', type=inputs.boolean,
+                            location='args')
+        parser.add_argument('created_after', type=inputs.datetime_from_iso8601,
+                            location='args')
+        parser.add_argument('created_before',
+                            type=inputs.datetime_from_iso8601,
+                            location='args')
+        parser.add_argument('sort', choices=NotificationManager.SORT_ORDERS,
+                            location='args')
+        args = parser.parse_args()
+        page_parser = reqparse.RequestParser()
+        page_parser.add_argument('limit', type=inputs.int_range(1, MAX_LIMIT),
+                                 location='args')
+        page_parser.add_argument('offset', type=inputs.natural,
+                                 location='args')
+        page_parser.add_argument('after_id', type=int, location='args')
+        page_parser.add_argument('before_id', type=int, location='args')
+        page_parser.add_argument('stream', type=inputs.boolean,
+                                 default=False, location='args')
+        page_args = page_parser.parse_args()
+        page_requested = any(
+            page_args[name] is not None
+            for name in ('limit', 'offset', 'after_id', 'before_id'))
+        if page_args['stream'] and page_requested:
+            self.abort_bad_request(
+                'The stream argument cannot be combined with a page')
+        seeks_id = page_args['after_id'] is not None or \
+            page_args['before_id'] is not None
+        if seeks_id and (page_args['offset'] is not None or args['sort']):
+            self.abort_bad_request(
+                'The after_id and before_id arguments sort by id and cannot '
+                'be combined with offset or sort')
+        if not any(value is not None for value in args.values()):
+            if seeks_id:
+                notifications, ids = notification_manager.get_snapshot()
+            else:
+                notifications = notification_manager.list_notifications()
+        else:
+            notifications = notification_manager.query_notifications(
+                notification_category=args['notification_category'],
+                displayed_once=args['displayed_once'],
+                created_after=args['created_after'],
+                created_before=args['created_before'],
+                sort=args['sort'] or 'creation_date')
+            if seeks_id:
+                notifications.sort(key=attrgetter('id'))
+                ids = [notification.id for notification in notifications]
+        if page_args['stream']:
+            return self.stream(notifications)
+        if not page_requested:
+            layout = JSONLayout.from_app()
+            return json_response(
+                layout.join(layout.get_representations(notifications)))
+        limit = page_args['limit'] or DEFAULT_LIMIT
+        if seeks_id:
+            return self.paginate_by_id(
+                notifications, ids, limit, page_args['after_id'],
+                page_args['before_id'])
+        return self.paginate(notifications, limit, page_args['offset'] or 0)
+
+    def abort_bad_request(self, message):
+        abort(HttpStatus.bad_request_400.value, message=message)
+
+    def paginate(self, notifications, limit, offset):
+        """Returns the page of the notifications that starts at the offset,
+        with the links to the previous and next pages and the count of
+        all the notifications."""
+        end = offset + limit
+        return self.page(
+            notifications[offset:end],
+            self.build_url(offset=max(offset - limit, 0), limit=limit)
+            if offset > 0 else None,
+            self.build_url(offset=end, limit=limit)
+            if end < len(notifications) else None,
+            len(notifications))
+
+    def paginate_by_id(self, notifications, ids, limit, after_id=None,
+                       before_id=None):
+        """Returns the limit notifications that follow the after_id, or that
+        precede the before_id, found by a binary search in the sorted ids,
+        so the page doesn't shift when notifications are inserted or
+        deleted in between."""
+        if before_id is not None:
+            end = bisect.bisect_left(ids, before_id)
+            start = max(end - limit, 0)
+        else:
+            start = 0 if after_id is None else \
+                bisect.bisect_right(ids, after_id)
+            end = start + limit
+        page = notifications[start:end]
+        return self.page(
+            page,
+            self.build_url(before_id=page[0].id, limit=limit)
+            if page and start > 0 else None,
+            self.build_url(after_id=page[-1].id, limit=limit)
+            if page and end < len(ids) else None,
+            len(ids))
+
+    def build_url(self, **args):
+        url_args = request.args.to_dict()
+        for name in ('offset', 'after_id', 'before_id'):
+            url_args.pop(name, None)
+        url_args.update(args)
+        return url_for('notificationlist', _external=True, **url_args)
+
+    def page(self, notifications, previous_url, next_url, count):
+        # The same as rendering the dictionary with the marshalled results
+        layout = JSONLayout.from_app()
+        return json_response(layout.join_object(
+            OrderedDict([('results', None), ('previous', previous_url),
+                         ('next', next_url), ('count', count)]),
+            'results', layout.get_representations(notifications)))
+
+    def stream(self, notifications):
+        """Returns a chunked response with the JSON list of the
+        notifications, joined STREAM_BATCH_SIZE at a time while the
+        response is sent, so the whole list is never built in memory."""
+        layout = JSONLayout.from_app()
+        def generate():
+            if not notifications:
+                yield b'[]\n'
+                return
+            opening, separator, closing = layout.list_delimiters(0)
+            yield opening
+            for start in range(0, len(notifications), STREAM_BATCH_SIZE):
+                chunk = separator.join(layout.nest(
+                    layout.get_representations(
+                        notifications[start:start + STREAM_BATCH_SIZE]), 1))
+                yield chunk if start == 0 else separator + chunk
+            yield closing + b'\n'
+        return Response(stream_with_context(generate()),
+                        mimetype='application/json')
 
     @marshal_with(notification_fields)
     def post(self):
@@ -215,4 +833,7 @@ service.add_resource(Notification, '/service/notifications/<int:id>',
                      endpoint='notification_endpoint')
 
 if __name__ == '__main__':
-    app.run(debug=True)
+    # The reloader runs the module in a second process, which would load
+    # and snapshot the same files
+    app.run(debug=NOTIFICATIONS_DEBUG,
+            use_reloader=NOTIFICATIONS_DEBUG and not NOTIFICATIONS_DIRECTORY)
@@ -0,0 +1,499 @@
+"""
+This module contains code that tests the NotificationManager and the API using
+pytest module.
+"""
+import json
+import pytest
+import service
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from flask_restful import marshal
+from flask_restful.representations.json import output_json
+from http_status import HttpStatus
+from persistence import NotificationStore, SnapshotWriter
+from pytz import utc
+from models import NotificationModel
+from service import app, JSONLayout, notification_fields, \
+        NotificationManager
+
+def create_notification(message, ttl=3600, notification_category='Information',
+                        creation_date=None):
+    return NotificationModel(
+        message=message,
+        ttl=ttl,
+        creation_date=creation_date or datetime.now(utc),
+        notification_category=notification_category)
+
+def restore(directory):
+    """
+    Returns a NotificationManager that restores the notifications persisted
+    in the directory, as after a restart
+    """
+    NotificationManager.last_id = 0
+    return NotificationManager(NotificationStore(directory))
+
+def get_records(notification_manager):
+    return [notification.to_record() for notification in
+            notification_manager.list_notifications()]
+
+def test_restore_after_failed_snapshots(notification_store, monkeypatch):
+    """
+    Ensure the changes logged before a snapshot that failed to be written
+    survive the next rotations of the log
+    """
+    store = notification_store
+    notification_manager = NotificationManager(store)
+    for i in range(3):
+        notification_manager.insert_notification(
+            create_notification('Snapshotted notification {0}'.format(i)))
+    notification_manager.snapshot()
+    for i in range(3):
+        notification_manager.insert_notification(
+            create_notification('Logged notification {0}'.format(i)))
+    def fail_to_write_snapshot(last_id, records):
+        raise OSError('No space left on device')
+    monkeypatch.setattr(store, 'write_snapshot', fail_to_write_snapshot)
+    for _ in range(2):
+        with pytest.raises(OSError):
+            notification_manager.snapshot()
+    for i in range(2):
+        notification_manager.insert_notification(
+            create_notification('Another logged notification {0}'.format(i)))
+    records = get_records(notification_manager)
+    store.close()
+
+    restored_manager = restore(store.directory)
+    assert list(restored_manager.notifications) == list(range(1, 9))
+    assert get_records(restored_manager) == records
+    restored_manager.store.close()
+
+def test_snapshot_and_log_round_trip(notification_store):
+    """
+    Ensure restoring a snapshot followed by a log reproduces the
+    notifications, including more categories than a 16-bit number counts
+    """
+    store = notification_store
+    store.fsync_batch_size = 0
+    notification_manager = NotificationManager(store)
+    for i in range(70000):
+        notification_manager.insert_notification(create_notification(
+            'Notification number {0}'.format(i),
+            notification_category='Category number {0}'.format(i)))
+    notification_manager.update_notification(
+        1, displayed_times=2, displayed_once=True)
+    notification_manager.delete_notification(2)
+    notification_manager.snapshot()
+    assert store.snapshots == 1
+    notification_manager.insert_notification(create_notification(
+        'Notification after the snapshot', notification_category='Warning'))
+    notification_manager.update_notification(
+        3, message='Notification updated after the snapshot', ttl=7200)
+    notification_manager.delete_notification(4)
+    records = get_records(notification_manager)
+    store.close()
+
+    restored_manager = restore(store.directory)
+    assert get_records(restored_manager) == records
+    assert restored_manager.ids_by_category['Warning'] == {70001}
+    restored_manager.insert_notification(
+        create_notification('Notification after the restart'))
+    assert restored_manager.notifications[70002].message == \
+        'Notification after the restart'
+    restored_manager.store.close()
+
+def test_snapshot_writer_survives_errors(notification_manager, monkeypatch):
+    """
+    Ensure the thread that writes the snapshots keeps running after a
+    snapshot raises an exception
+    """
+    errors = [ValueError('Unexpected error')]
+    snapshots = []
+    def snapshot():
+        if errors:
+            raise errors.pop()
+        snapshots.append(True)
+    monkeypatch.setattr(notification_manager, 'snapshot', snapshot)
+    SnapshotWriter(notification_manager, 0.01).start()
+    for _ in range(500):
+        if snapshots:
+            break
+        time.sleep(0.01)
+    assert not errors
+    assert snapshots
+
+def render_like_flask_restful(data):
+    """
+    Returns the body that flask_restful renders for the data
+    """
+    return output_json(data, HttpStatus.ok_200.value).get_data()
+
+@pytest.mark.parametrize('config', [
+    {},
+    {'DEBUG': True},
+    {'RESTFUL_JSON': {'sort_keys': True, 'separators': (',', ':')}}])
+def test_representations_match_the_json_settings(client, notification_manager,
+                                                 monkeypatch, config):
+    """
+    Ensure the notifications are rendered like flask_restful renders its
+    responses, whose JSON settings change with RESTFUL_JSON and the debug
+    mode
+    """
+    for name, value in config.items():
+        monkeypatch.setitem(app.config, name, value)
+    # Stream the list in two chunks
+    monkeypatch.setattr(service, 'STREAM_BATCH_SIZE', 2)
+    response = client.get('/service/notifications/?stream=true')
+    empty_list = response.get_data()
+    with app.test_request_context():
+        assert empty_list == render_like_flask_restful([])
+    for i in range(3):
+        notification_manager.insert_notification(create_notification(
+            'Rendered notification {0}'.format(i)))
+    notifications = list(notification_manager.list_notifications())
+    with app.test_request_context():
+        # Cache representations rendered with other settings, which the
+        # requests discard
+        JSONLayout({'sort_keys': True}).get_representations(notifications)
+        marshalled_notifications = marshal(notifications, notification_fields)
+        expected_notification = render_like_flask_restful(
+            marshalled_notifications[0])
+        expected_list = render_like_flask_restful(marshalled_notifications)
+        expected_page = render_like_flask_restful(OrderedDict([
+            ('results', marshalled_notifications[:2]),
+            ('previous', None),
+            ('next',
+             'http://localhost/service/notifications/?limit=2&offset=2'),
+            ('count', 3)]))
+
+    response = client.get('/service/notifications/1')
+    assert response.get_data() == expected_notification
+    response = client.get('/service/notifications/')
+    assert response.get_data() == expected_list
+    response = client.get('/service/notifications/?stream=true')
+    assert response.is_streamed
+    assert response.get_data() == expected_list
+    response = client.get('/service/notifications/?limit=2')
+    assert response.get_data() == expected_page
+
+def get_ids(notifications):
+    return [notification.id for notification in notifications]
+
+# Keeps the notifications created in the past from expiring
+CENTURY_TTL = 100 * 365 * 24 * 3600
+
+def insert_notifications(notification_manager):
+    """
+    Inserts notifications of three categories created a minute apart, and
+    marks the third one as displayed
+    """
+    for i, category in enumerate(('Information', 'Warning', 'Information',
+                                  'Error', 'Warning')):
+        notification_manager.insert_notification(create_notification(
+            'Indexed notification {0}'.format(i),
+            ttl=CENTURY_TTL,
+            notification_category=category,
+            creation_date=datetime(2020, 1, 1, 12, i, tzinfo=utc)))
+    notification_manager.update_notification(
+        3, displayed_times=1, displayed_once=True)
+
+def test_query_notifications(notification_manager):
+    """
+    Ensure the notifications are filtered by category, displayed_once and
+    creation date, and sorted by creation date in both orders
+    """
+    insert_notifications(notification_manager)
+    query = notification_manager.query_notifications
+    assert get_ids(query()) == [1, 2, 3, 4, 5]
+    assert get_ids(query(sort='-creation_date')) == [5, 4, 3, 2, 1]
+    assert get_ids(query(notification_category='Information')) == [1, 3]
+    assert get_ids(query(notification_category='Critical')) == []
+    assert get_ids(query(displayed_once=True)) == [3]
+    assert get_ids(query(displayed_once=False)) == [1, 2, 4, 5]
+    assert get_ids(query(notification_category='Information',
+                         displayed_once=False)) == [1]
+    created_after = datetime(2020, 1, 1, 12, 1, tzinfo=utc)
+    created_before = datetime(2020, 1, 1, 12, 4, tzinfo=utc)
+    assert get_ids(query(created_after=created_after)) == [2, 3, 4, 5]
+    assert get_ids(query(created_before=created_before)) == [1, 2, 3, 4]
+    assert get_ids(query(created_after=created_after,
+                         created_before=created_before,
+                         sort='-creation_date')) == [4, 3, 2]
+    assert get_ids(query(notification_category='Warning',
+                         created_after=created_after,
+                         created_before=created_before)) == [2]
+    # Few ids in a wide range are sorted instead of scanning the range
+    for i in range(100):
+        notification_manager.insert_notification(create_notification(
+            'Later notification {0}'.format(i),
+            ttl=CENTURY_TTL,
+            creation_date=datetime(2020, 1, 1, 13, tzinfo=utc)))
+    assert get_ids(query(notification_category='Warning',
+                         sort='-creation_date')) == [5, 2]
+    assert get_ids(query(notification_category='Warning',
+                         created_before=created_before)) == [2]
+
+def assert_indexes_match(notification_manager):
+    """
+    Ensure the indexes hold exactly the notifications of the manager
+    """
+    notifications = notification_manager.notifications
+    ids_by_category = {}
+    for id, notification in notifications.items():
+        ids_by_category.setdefault(
+            notification.notification_category, set()).add(id)
+    assert notification_manager.ids_by_category == ids_by_category
+    assert notification_manager.ids_by_displayed_once == {
+        displayed_once: {id for id, notification in notifications.items()
+                         if notification.displayed_once == displayed_once}
+        for displayed_once in (True, False)}
+    assert notification_manager.creation_index == sorted(
+        (notification.creation_timestamp, id)
+        for id, notification in notifications.items())
+
+def test_indexes_follow_the_changes(notification_manager):
+    """
+    Ensure the indexes are updated by the patches, the deletes and the
+    expiration of the notifications
+    """
+    insert_notifications(notification_manager)
+    assert_indexes_match(notification_manager)
+    assert notification_manager.ids_by_displayed_once[True] == {3}
+
+    notification_manager.update_notification(
+        1, notification_category='Error', displayed_once=True)
+    assert_indexes_match(notification_manager)
+    assert notification_manager.ids_by_category['Error'] == {1, 4}
+    assert notification_manager.ids_by_displayed_once[True] == {1, 3}
+
+    notification_manager.delete_notification(3)
+    assert_indexes_match(notification_manager)
+    # The categories without notifications are removed
+    assert 'Information' not in notification_manager.ids_by_category
+    assert [id for _, id in notification_manager.creation_index] == \
+        [1, 2, 4, 5]
+
+    # A notification created in 2020 expires right away without its ttl
+    notification_manager.update_notification(2, ttl=0)
+    assert notification_manager.remove_expired_notifications() == 1
+    assert list(notification_manager.notifications) == [1, 4, 5]
+    assert_indexes_match(notification_manager)
+    assert notification_manager.ids_by_category['Warning'] == {5}
+    assert get_ids(notification_manager.query_notifications()) == [1, 4, 5]
+
+def test_expiration_heap_drops_outdated_entries(notification_manager):
+    """
+    Ensure the entries of the deleted notifications and of the replaced
+    ttls don't make the heap grow without bound
+    """
+    for i in range(100):
+        notification_manager.insert_notification(
+            create_notification('Expiring notification {0}'.format(i)))
+    for id in range(1, 51):
+        notification_manager.delete_notification(id)
+    for ttl in range(10):
+        for id in range(51, 101):
+            notification_manager.update_notification(id, ttl=7200 + ttl)
+    # Rebuilt whenever half of it is outdated
+    assert len(notification_manager.expirations) <= 100
+    assert {(notification.expiration_timestamp, id) for id, notification
+            in notification_manager.notifications.items()} <= \
+        set(notification_manager.expirations)
+
+def get_page(client, query_string):
+    response = client.get('/service/notifications/?' + query_string)
+    assert response.status_code == HttpStatus.ok_200.value
+    return json.loads(response.get_data(as_text=True))
+
+def get_messages(page):
+    return [notification['message'] for notification in page['results']]
+
+def test_paginate_by_offset(client, notification_manager):
+    """
+    Ensure the offset pages link to the previous and next pages
+    """
+    for i in range(5):
+        notification_manager.insert_notification(create_notification(
+            'Paged notification {0}'.format(i)))
+    page = get_page(client, 'limit=2')
+    assert get_messages(page) == \
+        ['Paged notification 0', 'Paged notification 1']
+    assert page['previous'] is None
+    assert page['next'] == \
+        'http://localhost/service/notifications/?limit=2&offset=2'
+    assert page['count'] == 5
+    page = get_page(client, 'limit=2&offset=2')
+    assert get_messages(page) == \
+        ['Paged notification 2', 'Paged notification 3']
+    assert page['previous'] == \
+        'http://localhost/service/notifications/?limit=2&offset=0'
+    assert page['next'] == \
+        'http://localhost/service/notifications/?limit=2&offset=4'
+    page = get_page(client, 'limit=2&offset=3')
+    assert page['previous'] == \
+        'http://localhost/service/notifications/?limit=2&offset=1'
+    page = get_page(client, 'limit=2&offset=4')
+    assert get_messages(page) == ['Paged notification 4']
+    assert page['next'] is None
+    page = get_page(client, 'offset=10')
+    assert page['results'] == []
+    assert page['count'] == 5
+    # The links keep the filters
+    page = get_page(client, 'limit=1&sort=-creation_date')
+    assert get_messages(page) == ['Paged notification 4']
+    assert page['next'] == 'http://localhost/service/notifications/' \
+        '?limit=1&sort=-creation_date&offset=1'
+
+def test_paginate_by_id(client, notification_manager):
+    """
+    Ensure the id cursors seek the pages, which don't shift when
+    notifications are deleted or inserted in between
+    """
+    for i in range(5):
+        notification_manager.insert_notification(create_notification(
+            'Paged notification {0}'.format(i),
+            notification_category='Warning' if i % 2 else 'Information'))
+    page = get_page(client, 'limit=2&after_id=0')
+    assert [notification['id'] for notification in page['results']] == [1, 2]
+    assert page['previous'] is None
+    assert page['next'] == \
+        'http://localhost/service/notifications/?limit=2&after_id=2'
+    notification_manager.delete_notification(2)
+    page = get_page(client, 'limit=2&after_id=2')
+    assert [notification['id'] for notification in page['results']] == [3, 4]
+    assert page['previous'] == \
+        'http://localhost/service/notifications/?limit=2&before_id=3'
+    assert page['next'] == \
+        'http://localhost/service/notifications/?limit=2&after_id=4'
+    assert page['count'] == 4
+    notification_manager.insert_notification(
+        create_notification('Paged notification 5'))
+    page = get_page(client, 'limit=2&after_id=4')
+    assert [notification['id'] for notification in page['results']] == [5, 6]
+    assert page['next'] is None
+    page = get_page(client, 'limit=2&before_id=3')
+    assert [notification['id'] for notification in page['results']] == [1]
+    assert page['previous'] is None
+    assert page['next'] == \
+        'http://localhost/service/notifications/?limit=2&after_id=1'
+    page = get_page(client, 'limit=2&before_id=1')
+    assert page == {'results': [], 'previous': None, 'next': None,
+                    'count': 5}
+    # The filtered notifications are sorted by id too
+    page = get_page(client,
+                    'limit=1&after_id=1&notification_category=Warning')
+    assert [notification['id'] for notification in page['results']] == [4]
+    assert page['previous'] is None
+    assert page['next'] is None
+    assert page['count'] == 1
+
+@pytest.mark.parametrize('query_string', [
+    'stream=true&limit=2',
+    'stream=true&after_id=1',
+    'after_id=1&offset=2',
+    'before_id=3&sort=creation_date',
+    'limit=0',
+    'limit=1001',
+    'offset=-1'])
+def test_invalid_pages(client, notification_manager, query_string):
+    """
+    Ensure the invalid combinations of page arguments are rejected
+    """
+    notification_manager.insert_notification(
+        create_notification('A notification'))
+    response = client.get('/service/notifications/?' + query_string)
+    assert response.status_code == HttpStatus.bad_request_400.value
+
+def test_pages_and_stream_match_the_marshalled_list(client,
+                                                    notification_manager,
+                                                    monkeypatch):
+    """
+    Ensure the responses joined from the cached representations are the
+    same bytes as the JSON of the marshalled notifications
+    """
+    monkeypatch.setattr(service, 'STREAM_BATCH_SIZE', 2)
+    for i in range(5):
+        notification_manager.insert_notification(create_notification(
+            'A "quoted" notification é {0}'.format(i)))
+    notifications = list(notification_manager.list_notifications())
+    with app.test_request_context():
+        marshalled_notifications = marshal(notifications, notification_fields)
+        expected_list = render_like_flask_restful(marshalled_notifications)
+        expected_pages = [
+            render_like_flask_restful(OrderedDict([
+                ('results', marshalled_notifications[2:4]),
+                ('previous',
+                 'http://localhost/service/notifications/?limit=2&offset=0'),
+                ('next',
+                 'http://localhost/service/notifications/?limit=2&offset=4'),
+                ('count', 5)])),
+            render_like_flask_restful(OrderedDict([
+                ('results', marshalled_notifications[4:]),
+                ('previous',
+                 'http://localhost/service/notifications/?limit=2&before_id=5'),
+                ('next', None),
+                ('count', 5)]))]
+
+    for query_string in ('', '?stream=true'):
+        response = client.get('/service/notifications/' + query_string)
+        assert response.get_data() == expected_list
+    response = client.get('/service/notifications/?limit=2&offset=2')
+    assert response.get_data() == expected_pages[0]
+    response = client.get('/service/notifications/?limit=2&after_id=4')
+    assert response.get_data() == expected_pages[1]
+
+def test_concurrent_inserts_deletes_and_lists(notification_manager):
+    """
+    Ensure the threads that insert get unique ids, and that listing the
+    notifications while others are inserted and deleted neither fails nor
+    returns a list that changes while it is iterated
+    """
+    thread_count = 4
+    insert_count = 500
+    ids_by_thread = [[] for _ in range(thread_count)]
+    errors = []
+    inserting = threading.Event()
+    inserting.set()
+    def insert_and_delete(ids):
+        try:
+            for i in range(insert_count):
+                notification = create_notification(
+                    'Concurrent notification {0}'.format(i))
+                notification_manager.insert_notification(notification)
+                ids.append(notification.id)
+                if i % 2:
+                    notification_manager.delete_notification(notification.id)
+        except Exception as error:
+            errors.append(error)
+    def list_notifications():
+        try:
+            while inserting.is_set():
+                notifications = notification_manager.list_notifications()
+                ids = [notification.id for notification in notifications]
+                # Sorted and unique, although the manager keeps changing
+                assert ids == sorted(set(ids))
+                time.sleep(0.001)
+                assert [notification.id for notification in notifications] \
+                    == ids
+                notification_manager.query_notifications(
+                    notification_category='Information')
+        except Exception as error:
+            errors.append(error)
+    threads = [threading.Thread(target=insert_and_delete, args=(ids,))
+               for ids in ids_by_thread]
+    reader = threading.Thread(target=list_notifications)
+    reader.start()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    inserting.clear()
+    reader.join()
+
+    assert errors == []
+    ids = [id for thread_ids in ids_by_thread for id in thread_ids]
+    assert sorted(ids) == list(range(1, thread_count * insert_count + 1))
+    assert len(notification_manager.list_notifications()) == \
+        thread_count * insert_count // 2
+    assert_indexes_match(notification_manager)